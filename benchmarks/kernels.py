@@ -0,0 +1,126 @@
+"""
+Window-filter and per-user aggregation benchmark.
+
+Times the user-level metric tables of one event over one or more
+attribution windows three ways on synthetic data:
+  join     a windowed join plus groupby per window (user_metric_table over
+           _filter_events_by_metric)
+  numpy    windowed_user_tables with the numpy kernel, all windows in one pass
+  numba    windowed_user_tables with the Numba kernel, when Numba is
+           installed; its one-off compile time is reported separately
+
+Usage, from the repository root:
+  python benchmarks/kernels.py --users 1000000 --events 10000000 --runs 5
+  python benchmarks/kernels.py --windows 1d,7d,28d --json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from services import kernels  # noqa: E402
+from services.metric_analysis import user_metric_table, windowed_user_tables, _filter_events_by_metric  # noqa: E402
+
+EVENT_NAME = 'purchase'
+
+
+def synthetic_data(users: int, events: int, seed: int = 0):
+    """A first-exposure table and an event log over 30 days, half of it purchases"""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2025-01-01', 'ns')
+    exposures = pd.DataFrame({
+        'user_id': np.arange(users),
+        'experiment_id': '0',
+        'variant': rng.choice(['A', 'B'], users),
+        'exposure_time': start + rng.integers(0, 30 * 86400, users).astype('timedelta64[s]'),
+    })
+    event_log = pd.DataFrame({
+        'user_id': rng.integers(0, users, events),
+        'event_name': rng.choice(['purchase', 'view'], events),
+        'event_time': start + rng.integers(0, 40 * 86400, events).astype('timedelta64[s]'),
+        'event_value': rng.exponential(20.0, events),
+    })
+    return exposures, event_log
+
+
+def _time(function, runs: int) -> list:
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def _summary(values: list) -> dict:
+    return {
+        'median': statistics.median(values),
+        'min': min(values),
+        'max': max(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--events', type=int, default=2_000_000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--windows', default='7d', help='comma-separated window ends, all starting at exposure')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    exposures, event_log = synthetic_data(args.users, args.events)
+    windows = [('0h', end.strip()) for end in args.windows.split(',')]
+
+    def run_joins():
+        return [
+            user_metric_table(exposures, _filter_events_by_metric(
+                exposures, event_log, {'event': {'name': EVENT_NAME}, 'window': {'start': start, 'end': end}}
+            ))
+            for start, end in windows
+        ]
+
+    def run_kernel(use_numba: bool):
+        kernels.NUMBA_KERNELS = int(use_numba)
+        return windowed_user_tables(exposures, event_log, EVENT_NAME, windows)
+
+    paths = {
+        'join': run_joins,
+        'numpy': lambda: run_kernel(False),
+    }
+    results = {
+        'users': args.users, 'events': args.events, 'windows': [end for _, end in windows], 'runs': args.runs,
+        'numba_installed': kernels.numba is not None,
+    }
+    if kernels.numba is not None:
+        results['numba_compile_seconds'] = _time(lambda: run_kernel(True), 1)[0]
+        paths['numba'] = lambda: run_kernel(True)
+
+    for name, function in paths.items():
+        results[f'{name}_seconds'] = _summary(_time(function, args.runs))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"users: {args.users}, events: {args.events}, windows: {args.windows}, runs: {args.runs}")
+    if not results['numba_installed']:
+        print("numba not installed: timing the numpy path only")
+    elif 'numba_compile_seconds' in results:
+        print(f"numba first call (compile or cache load): {results['numba_compile_seconds'] * 1000:.1f} ms")
+    join = results['join_seconds']['median']
+    for name in paths:
+        value = results[f'{name}_seconds']
+        print(f"{name:>8}: median {value['median'] * 1000:8.1f} ms"
+              f"  (min {value['min'] * 1000:.1f}, max {value['max'] * 1000:.1f})  {join / value['median']:5.1f}x vs join")
+
+
+if __name__ == '__main__':
+    main()
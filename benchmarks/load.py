@@ -0,0 +1,310 @@
+"""
+Concurrent API load test.
+
+Starts uvicorn on a throwaway SQLite database (or --database-url, e.g. a
+local Postgres) and drives it with an async httpx client. Each scenario
+keeps --concurrency requests in flight for --duration seconds (or until
+--requests requests) and reports, per request kind, latency percentiles,
+throughput and error rate, plus the server's peak RSS over the scenario
+(uvicorn and its child processes, sampled from /proc on Linux):
+  token        POST /api/users/token
+  sample_size  POST /api/sample-size
+  upload       POST /api/files/upload of a generated experiment
+               (--users users, about --events-per-user events each)
+  mixed        all three, weighted by --mix
+
+Uploads send a unique metrics config each time so every one is analyzed;
+--upload-cache-hits resends the same one to measure result cache hits.
+
+Usage, from the repository root:
+  python benchmarks/load.py --scenarios token,sample_size --concurrency 32 --duration 20
+  python benchmarks/load.py --scenarios upload,mixed --users 100000 --concurrency 4 --duration 60 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from startup import _env, _free_port, _wait_until_up
+
+SCENARIOS = {
+    'token': {'token': 1},
+    'sample_size': {'sample_size': 1},
+    'upload': {'upload': 1},
+    'mixed': None,  # weights from --mix
+}
+USERNAME, PASSWORD = 'loadtest', 'loadtest'
+
+
+def generate_experiment(directory: str, users: int, events_per_user: float, seed: int = 0) -> dict:
+    """
+    Exposures and events CSVs plus a metrics config shaped like the sample
+    data: two variants over 14 days, purchases (with values) and sessions.
+    Returns the file paths by upload field.
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2025-01-01T00:00:00', 's')
+    exposure_times = start + rng.integers(0, 14 * 86400, users).astype('timedelta64[s]')
+    pd.DataFrame({
+        'user_id': np.arange(users),
+        'experiment_id': 0,
+        'variant': rng.choice(['A', 'B'], users),
+        'exposure_time': exposure_times,
+    }).to_csv(os.path.join(directory, 'exposures.csv'), index=False)
+
+    events = rng.poisson(events_per_user, users)
+    owners = np.repeat(np.arange(users), events)
+    names = rng.choice(['session_start', 'purchase'], len(owners), p=[0.8, 0.2])
+    pd.DataFrame({
+        'user_id': owners,
+        'event_name': names,
+        'event_time': exposure_times[owners] + rng.integers(0, 21 * 86400, len(owners)).astype('timedelta64[s]'),
+        'event_value': np.where(names == 'purchase', rng.exponential(30.0, len(owners)).round(2), np.nan),
+    }).to_csv(os.path.join(directory, 'events.csv'), index=False)
+
+    metrics = {
+        'metric_01': {'metric_id': 'conversion_7d', 'display_name': '7-day Conversion Rate', 'event': {'name': 'purchase'},
+                      'aggregation': 'binary', 'window': {'start': '0h', 'end': '7d'}},
+        'metric_02': {'metric_id': 'revenue_14d', 'display_name': '14-day Revenue', 'event': {'name': 'purchase'},
+                      'aggregation': 'sum', 'window': {'start': '0h', 'end': '14d'}},
+        'metric_03': {'metric_id': 'session_7d', 'display_name': '7-day Session Count', 'event': {'name': 'session_start'},
+                      'aggregation': 'count', 'window': {'start': '0h', 'end': '7d'}},
+    }
+    with open(os.path.join(directory, 'metrics.json'), 'w') as f:
+        json.dump(metrics, f)
+    return {
+        'json_file': os.path.join(directory, 'metrics.json'),
+        'exposures_file': os.path.join(directory, 'exposures.csv'),
+        'events_file': os.path.join(directory, 'events.csv'),
+    }
+
+
+def _rss_bytes(pid: int) -> int:
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def tree_rss_bytes(root: int) -> int | None:
+    """Resident memory of a process and all its descendants, or None without /proc"""
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # the command name may contain spaces; fields resume after its closing parenthesis
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total, pending = 0, [root]
+    while pending:
+        pid = pending.pop()
+        try:
+            total += _rss_bytes(pid)
+        except OSError:
+            continue
+        pending.extend(children.get(pid, []))
+    return total
+
+
+class Traffic:
+    """Request senders sharing one logged-in user and the generated upload files"""
+
+    def __init__(self, token: str, upload_files: dict, cache_hits: bool):
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.contents = {field: open(path, 'rb').read() for field, path in upload_files.items()}
+        self.metrics = json.loads(self.contents['json_file'])
+        self.cache_hits = cache_hits
+        self.uploads = 0
+
+    async def token(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.post('/api/users/token', data={'username': USERNAME, 'password': PASSWORD})
+
+    async def sample_size(self, client: httpx.AsyncClient) -> httpx.Response:
+        body = {'baseline_rate': round(random.uniform(0.02, 0.3), 3), 'mde': round(random.uniform(0.02, 0.2), 3)}
+        return await client.post('/api/sample-size', json=body, headers=self.headers)
+
+    async def upload(self, client: httpx.AsyncClient) -> httpx.Response:
+        self.uploads += 1
+        metrics = self.contents['json_file']
+        if not self.cache_hits:
+            # any change to the config changes the result cache key
+            renamed = {**self.metrics['metric_01'], 'display_name': f'7-day Conversion Rate ({self.uploads})'}
+            metrics = json.dumps({**self.metrics, 'metric_01': renamed}).encode()
+        files = {
+            'json_file': ('metrics.json', metrics),
+            'exposures_file': ('exposures.csv', self.contents['exposures_file']),
+            'events_file': ('events.csv', self.contents['events_file']),
+        }
+        data = {'exp_name': f'load test {self.uploads}', 'experiment_id': '0', 'selected_option': 'custom'}
+        return await client.post('/api/files/upload', files=files, data=data, headers=self.headers)
+
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    cuts = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+    return {'p50': cuts[49], 'p90': cuts[89], 'p99': cuts[98], 'max': max(values), 'mean': statistics.fmean(values)}
+
+
+async def run_scenario(base_url: str, traffic: Traffic, weights: dict, concurrency: int, duration: float,
+                       max_requests: int | None, server_pid: int) -> dict:
+    """Keep concurrency requests of the weighted kinds in flight until duration or max_requests"""
+    kinds, kind_weights = list(weights), list(weights.values())
+    samples = {kind: {'latencies': [], 'statuses': {}} for kind in kinds}
+    sent = 0
+    deadline = time.perf_counter() + duration
+    peak_rss = tree_rss_bytes(server_pid)
+
+    def more() -> bool:
+        return time.perf_counter() < deadline and (max_requests is None or sent < max_requests)
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal sent
+        while more():
+            sent += 1
+            kind = random.choices(kinds, kind_weights)[0]
+            start = time.perf_counter()
+            try:
+                status = str((await getattr(traffic, kind)(client)).status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            samples[kind]['latencies'].append(time.perf_counter() - start)
+            samples[kind]['statuses'][status] = samples[kind]['statuses'].get(status, 0) + 1
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            rss = tree_rss_bytes(server_pid)
+            if rss is not None:
+                peak_rss = max(peak_rss or 0, rss)
+            await asyncio.sleep(0.1)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+        sampler = asyncio.create_task(sample_rss())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+    kinds_result = {}
+    for kind, sample in samples.items():
+        count = len(sample['latencies'])
+        if not count:
+            continue
+        errors = sum(n for status, n in sample['statuses'].items() if not (status.isdigit() and int(status) < 400))
+        kinds_result[kind] = {
+            'requests': count,
+            'throughput_per_second': count / elapsed,
+            'error_rate': errors / count,
+            'statuses': sample['statuses'],
+            'latency_seconds': _percentiles(sample['latencies']),
+        }
+    return {
+        'seconds': elapsed,
+        'requests': sum(kind['requests'] for kind in kinds_result.values()),
+        'peak_rss_bytes': peak_rss,
+        'kinds': kinds_result,
+    }
+
+
+def _login(base_url: str) -> str:
+    with httpx.Client(base_url=base_url) as client:
+        client.post('/api/users/register', json={'email': 'loadtest@example.com', 'username': USERNAME, 'password': PASSWORD})
+        response = client.post('/api/users/token', data={'username': USERNAME, 'password': PASSWORD})
+        response.raise_for_status()
+        return response.json()['access_token']
+
+
+def _print_results(results: dict):
+    print(f"server: {results['server']}, concurrency: {results['concurrency']}")
+    for name, scenario in results['scenarios'].items():
+        rss = scenario['peak_rss_bytes']
+        print(f"\n{name}: {scenario['requests']} requests in {scenario['seconds']:.1f}s, "
+              f"peak RSS {rss / 2 ** 20:.0f} MiB" if rss is not None else f"\n{name}: {scenario['requests']} requests")
+        for kind, result in scenario['kinds'].items():
+            latency = result['latency_seconds']
+            print(f"  {kind:>12}: {result['throughput_per_second']:7.1f} req/s  errors {result['error_rate'] * 100:5.1f}%"
+                  f"  p50 {latency['p50'] * 1000:8.1f} ms  p90 {latency['p90'] * 1000:8.1f} ms"
+                  f"  p99 {latency['p99'] * 1000:8.1f} ms  statuses {result['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default='token,sample_size,upload,mixed', help=f"comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15, help='seconds per scenario')
+    parser.add_argument('--requests', type=int, default=None, help='stop a scenario after this many requests')
+    parser.add_argument('--mix', default='60,30,10', help='token,sample_size,upload weights of the mixed scenario')
+    parser.add_argument('--users', type=int, default=20_000, help='users in the generated upload')
+    parser.add_argument('--events-per-user', type=float, default=10, help='mean events per generated user')
+    parser.add_argument('--upload-cache-hits', action='store_true', help='resend an identical metrics config')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--database-url', default=None, help='default: a temporary SQLite database')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    mix = dict(zip(('token', 'sample_size', 'upload'), (float(weight) for weight in args.mix.split(','))))
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        upload_files = generate_experiment(tmp, args.users, args.events_per_user, args.seed)
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'load.db')}"
+        port = _free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'api.main:app', '--host', '127.0.0.1', '--port', str(port),
+             '--workers', str(args.workers), '--log-level', 'warning'],
+            cwd=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'),
+            env=_env(database_url),
+        )
+        try:
+            with httpx.Client(base_url=base_url) as client:
+                _wait_until_up(client, process, timeout=60)
+            traffic = Traffic(_login(base_url), upload_files, args.upload_cache_hits)
+            results = {
+                'server': 'sqlite' if args.database_url is None else database_url.split(':', 1)[0],
+                'concurrency': args.concurrency,
+                'upload_bytes': sum(os.path.getsize(path) for path in upload_files.values()),
+                'scenarios': {},
+            }
+            for name in scenarios:
+                weights = {kind: weight for kind, weight in (SCENARIOS[name] or mix).items() if weight > 0}
+                results['scenarios'][name] = asyncio.run(run_scenario(
+                    base_url, traffic, weights, args.concurrency, args.duration, args.requests, process.pid
+                ))
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    _print_results(results)
+
+
+if __name__ == '__main__':
+    main()
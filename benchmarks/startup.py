@@ -0,0 +1,179 @@
+"""
+API import-time and cold-start benchmark.
+
+Each run starts a fresh interpreter, so nothing is cached between runs:
+  import       time to `import api.main`, and which analytics modules it loaded
+  cold start   time from launching uvicorn to the first answered request,
+               then the latency of the first token request (database + auth)
+               and, with --analysis, of the first analysis upload (which
+               loads the analytics stack)
+
+Usage, from the repository root:
+  python benchmarks/startup.py --runs 5
+  python benchmarks/startup.py --runs 3 --analysis --json
+The database defaults to a throwaway SQLite file; pass --database-url to
+measure against Postgres.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT, 'src')
+SAMPLE_DIR = os.path.join(ROOT, 'frontend', 'public', 'sample_data')
+HEAVY_MODULES = ('pandas', 'numpy', 'scipy', 'pyarrow', 'duckdb')
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import api.main
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def _env(database_url: str) -> dict:
+    return {
+        **os.environ,
+        'DATABASE_URL': database_url,
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'benchmark'),
+        'ALGORITHM': os.environ.get('ALGORITHM', 'HS256'),
+        'UPLOAD_DIR': os.path.join(tempfile.gettempdir(), 'abexp-benchmark-uploads'),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_import(database_url: str) -> dict:
+    """Seconds to import the app in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT], cwd=SRC_DIR, env=_env(database_url),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _wait_until_up(client: httpx.Client, process, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            client.get('/')
+            return
+        except httpx.TransportError:
+            time.sleep(0.005)
+    raise TimeoutError(f"server not up after {timeout}s")
+
+
+def _first_analysis(client: httpx.Client) -> float:
+    client.post('/api/users/register', json={'email': 'bench@example.com', 'username': 'bench', 'password': 'bench'})
+    token = client.post('/api/users/token', data={'username': 'bench', 'password': 'bench'}).json()['access_token']
+    names = {
+        'json_file': 'metric_definition.json',
+        'exposures_file': 'exposure_events.csv',
+        'events_file': 'user_events_conversion.csv',
+    }
+    files = {field: (name, open(os.path.join(SAMPLE_DIR, name), 'rb')) for field, name in names.items()}
+    try:
+        start = time.perf_counter()
+        response = client.post(
+            '/api/files/upload',
+            headers={'Authorization': f'Bearer {token}'},
+            files=files,
+            data={'exp_name': 'benchmark', 'experiment_id': '0', 'selected_option': 'custom'},
+            timeout=120,
+        )
+        seconds = time.perf_counter() - start
+    finally:
+        for _, f in files.values():
+            f.close()
+    response.raise_for_status()
+    return seconds
+
+
+def measure_cold_start(database_url: str, analysis: bool = False, timeout: float = 60) -> dict:
+    """Seconds from launching uvicorn to its first response, then first-request latencies"""
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api.main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=SRC_DIR, env=_env(database_url),
+    )
+    try:
+        with httpx.Client(base_url=f'http://127.0.0.1:{port}') as client:
+            _wait_until_up(client, process, timeout)
+            result = {'time_to_first_request': time.perf_counter() - start}
+
+            token_start = time.perf_counter()
+            client.post('/api/users/token', data={'username': 'nobody', 'password': 'wrong'})
+            result['first_token_request'] = time.perf_counter() - token_start
+
+            if analysis:
+                result['first_analysis'] = _first_analysis(client)
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _summary(values: list) -> dict:
+    return {
+        'median': statistics.median(values),
+        'min': min(values),
+        'max': max(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--analysis', action='store_true', help='also time the first analysis upload')
+    parser.add_argument('--database-url', default=None, help='default: a temporary SQLite database per run')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    imports, cold_starts, loaded = [], [], set()
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in range(args.runs):
+            database_url = args.database_url or f"sqlite:///{os.path.join(tmp, f'run{run}.db')}"
+            measured = measure_import(database_url)
+            imports.append(measured['seconds'])
+            loaded.update(measured['loaded'])
+            cold_starts.append(measure_cold_start(database_url, args.analysis))
+
+    results = {
+        'runs': args.runs,
+        'import_seconds': _summary(imports),
+        'analytics_modules_loaded_on_import': sorted(loaded),
+        **{
+            f'{key}_seconds': _summary([run[key] for run in cold_starts])
+            for key in cold_starts[0]
+        },
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"runs: {results['runs']}")
+    print(f"analytics modules loaded on import: {', '.join(results['analytics_modules_loaded_on_import']) or 'none'}")
+    for key, value in results.items():
+        if key.endswith('_seconds'):
+            print(f"{key[:-len('_seconds')]:>24}: median {value['median'] * 1000:8.1f} ms"
+                  f"  (min {value['min'] * 1000:.1f}, max {value['max'] * 1000:.1f})")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,19 @@ import FileInput from './FileInput';
 import MetricResult from './MetricResult';
 import { SparklesIcon, ArrowDownTrayIcon, DocumentTextIcon, TableCellsIcon, UserGroupIcon } from '@heroicons/react/24/outline';
 
+// Button text for the latest progress event of a running upload
+const progressLabel = (progress) => {
+  switch (progress?.stage) {
+    case 'spooled': return 'Reading files...';
+    case 'parsed': return 'Validating...';
+    case 'validated': return 'Analyzing...';
+    case 'metric': return `Analyzed metric ${progress.index} of ${progress.total}...`;
+    case 'serialized':
+    case 'analyzed': return 'Saving results...';
+    default: return 'Processing...';
+  }
+};
+
 const FileUpload = () => {
   const {
     jsonFile,
@@ -24,6 +37,7 @@ const FileUpload = () => {
     error,
     success,
     loading,
+    progress,
     analysisResults,
     isUsingSampleData,
     applyCorrectionState,
@@ -260,7 +274,7 @@ const FileUpload = () => {
                   isDisabled={loading}
                   className="font-semibold h-14 px-8"
                 >
-                  {loading ? 'Processing...' : 'Upload & Run Analysis'}
+                  {loading ? progressLabel(progress) : 'Upload & Run Analysis'}
                 </Button>
               </div>
             </Form>
@@ -1,4 +1,5 @@
 import ChartTabs from "./charts/ChartTabs";
+import SegmentBreakdown from "./SegmentBreakdown";
 import { Card, CardBody, CardHeader, Chip, Tooltip } from "@heroui/react";
 import { InformationCircleIcon } from '@heroicons/react/24/outline';
 
@@ -26,11 +27,11 @@ const MetricResult = ({ metricId, data, metricDefinitions }) => {
   
   const variantAValue = isChiSquare 
     ? `${(data.variant_a_rate * 100).toFixed(2)}%`
-    : data.variant_a_mean?.toFixed(2);
+    : (data.variant_a_quantile ?? data.variant_a_mean)?.toFixed(2);
   
   const variantBValue = isChiSquare
     ? `${(data.variant_b_rate * 100).toFixed(2)}%`
-    : data.variant_b_mean?.toFixed(2);
+    : (data.variant_b_quantile ?? data.variant_b_mean)?.toFixed(2);
 
   const getEffectSizeInterpretation = (effectSize) => {
     if (!effectSize || effectSize === 'N/A') return { label: 'N/A', color: 'default' };
@@ -213,6 +214,10 @@ const MetricResult = ({ metricId, data, metricDefinitions }) => {
           )}
         </div>
       </div>
+
+      {data.segments && Object.keys(data.segments).length > 0 && (
+        <SegmentBreakdown segments={data.segments} isRate={isChiSquare} />
+      )}
     </div>
   );
 };
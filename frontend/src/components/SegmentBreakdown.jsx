@@ -0,0 +1,59 @@
+import { Card, CardBody, CardHeader, Chip } from "@heroui/react";
+import { Table, TableHeader, TableBody, TableColumn, TableRow, TableCell } from "@heroui/table";
+
+// Per-segment test results of one metric: {attribute: {segment: result}}
+const SegmentBreakdown = ({ segments, isRate }) => {
+  const formatValue = (val) =>
+    val === null || val === undefined ? '–' : isRate ? `${(val * 100).toFixed(2)}%` : val.toFixed(2);
+
+  return (
+    <Card className="shadow-sm mt-4">
+      <CardHeader className="pb-2 pt-3 px-4">
+        <h4 className="text-sm font-semibold text-gray-700">Segment Breakdown</h4>
+      </CardHeader>
+      <CardBody className="pt-0 p-4 space-y-4">
+        {Object.entries(segments).map(([attribute, levels]) => (
+          <Table key={attribute} aria-label={`Results by ${attribute}`} removeWrapper>
+            <TableHeader>
+              <TableColumn>{attribute}</TableColumn>
+              <TableColumn>Sample (A / B)</TableColumn>
+              <TableColumn>A</TableColumn>
+              <TableColumn>B</TableColumn>
+              <TableColumn>Lift</TableColumn>
+              <TableColumn>P-value</TableColumn>
+            </TableHeader>
+            <TableBody>
+              {Object.entries(levels).map(([segment, result]) => {
+                const sizes = result.users ?? result.events;
+                return (
+                  <TableRow key={segment}>
+                    <TableCell>{segment}</TableCell>
+                    <TableCell>{sizes.A.toLocaleString()} / {sizes.B.toLocaleString()}</TableCell>
+                    <TableCell>{formatValue(result.variant_a_rate ?? result.variant_a_quantile ?? result.variant_a_mean)}</TableCell>
+                    <TableCell>{formatValue(result.variant_b_rate ?? result.variant_b_quantile ?? result.variant_b_mean)}</TableCell>
+                    <TableCell>
+                      {result.tested && result.lift !== null && result.lift !== undefined
+                        ? `${result.lift > 0 ? '+' : ''}${(result.lift * 100).toFixed(2)}%`
+                        : '–'}
+                    </TableCell>
+                    <TableCell>
+                      {result.tested ? (
+                        <Chip size="sm" variant="flat" color={result.significance === 'YES' ? 'success' : 'default'}>
+                          {result['p-value']?.toFixed(4)}
+                        </Chip>
+                      ) : (
+                        <span className="text-xs text-gray-500">{result.reason}</span>
+                      )}
+                    </TableCell>
+                  </TableRow>
+                );
+              })}
+            </TableBody>
+          </Table>
+        ))}
+      </CardBody>
+    </Card>
+  );
+};
+
+export default SegmentBreakdown;
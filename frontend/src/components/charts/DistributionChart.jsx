@@ -102,6 +102,19 @@ const DistributionChart = ({ distribution, metricId }) => {
   const traces = variants.map((variantKey) => {
     const data = distribution[variantKey];
     const variantLetter = variantKey.replace('variant_', '');
+
+    // Quantile metrics only carry sketch bin counts, not raw values
+    if (!data.values) {
+      return {
+        x: data.bins.slice(0, -1).map((edge, i) => (edge + data.bins[i + 1]) / 2),
+        y: data.counts,
+        type: 'bar',
+        name: `Variant ${variantLetter}`,
+        opacity: 0.7,
+        marker: { color: colors[variantLetter] || "#000" },
+        hovertemplate: '<b>Variant ' + variantLetter + '</b><br>Value: %{x}<br>Count: %{y}<br><extra></extra>',
+      };
+    }
     
     return {
       x: data.values,
@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { uploadFiles, getUploadOptions, loadSampleData, downloadSampleFiles } from '../services/api';
+import { uploadFilesWithProgress, getUploadOptions, loadSampleData, downloadSampleFiles } from '../services/api';
 import { isTokenExpired, getTokenTimeRemaining } from '../utils/auth';
 
 export const useFileUpload = () => {
@@ -16,6 +16,7 @@ export const useFileUpload = () => {
   const [success, setSuccess] = useState('');
   const [loading, setLoading] = useState(false);
   const [analysisResults, setAnalysisResults] = useState(null);
+  const [progress, setProgress] = useState(null);
   const [isUsingSampleData, setIsUsingSampleData] = useState(false);
   const [availableExperimentIds, setAvailableExperimentIds] = useState([]);
   const [submittedExperimentName, setSubmittedExperimentName] = useState('');
@@ -302,6 +303,7 @@ export const useFileUpload = () => {
     setError('');
     setSuccess('');
     setAnalysisResults(null);
+    setProgress(null);
 
     // Validation
     if (!experimentId. trim()) {
@@ -335,7 +337,15 @@ export const useFileUpload = () => {
       // Save metric definitions before reset
       const savedMetricDefinitions = metricDefinitions;
       
-      const response = await uploadFiles(
+      // Show each metric's summary as soon as the server reports it
+      const handleProgress = (event) => {
+        setProgress(event);
+        if (event.stage === 'metric') {
+          setAnalysisResults((prev) => ({ ...(prev || {}), [event.metric_id]: event.summary }));
+        }
+      };
+
+      const response = await uploadFilesWithProgress(
         experimentName, 
         experimentId,
         jsonFile, 
@@ -343,12 +353,14 @@ export const useFileUpload = () => {
         eventsFile,
         usersFile, 
         selectedOption,
-        applyCorrectionState
+        applyCorrectionState,
+        handleProgress
       );
 
       if (response.processing_error) {
         setError(`Analysis error: ${response.processing_error}`);
         setSuccess('Files uploaded, but analysis failed');
+        setAnalysisResults(null);
       } else {
         setSuccess('Files uploaded and analyzed successfully!');
         setAnalysisResults(response.analysis);
@@ -366,6 +378,7 @@ export const useFileUpload = () => {
       }
     } finally {
       setLoading(false);
+      setProgress(null);
     }
   };
 
@@ -388,6 +401,7 @@ export const useFileUpload = () => {
     error,
     success,
     loading,
+    progress,
     analysisResults,
     isUsingSampleData,
     applyCorrectionState,
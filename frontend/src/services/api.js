@@ -140,6 +140,71 @@ export const uploadFiles = async (
   return response.data;
 };
 
+// Same upload as uploadFiles, but reads the server's progress stream:
+// onProgress receives each progress event ({stage, ...}) as it arrives,
+// and the final upload response is returned.
+export const uploadFilesWithProgress = async (
+  experimentName, experimentId, jsonFile,
+  exposuresFile, eventsFile, usersFile,
+  selectedOption, applyCorrection = true, onProgress = () => {}
+) => {
+  const formData = new FormData();
+  formData.append('exp_name', experimentName);
+  formData.append('experiment_id', experimentId);
+  formData.append('exposures_file', exposuresFile);
+  formData.append('events_file', eventsFile);
+  formData.append('json_file', jsonFile);
+  formData.append('selected_option', selectedOption);
+  if (usersFile) {
+    formData.append('users_file', usersFile);
+  }
+  formData.append('apply_correction', applyCorrection);
+
+  const token = localStorage.getItem('token');
+  const response = await fetch(`${API_BASE_URL}/files/upload/stream`, {
+    method: 'POST',
+    headers: token ? { Authorization: `Bearer ${token}` } : {},
+    body: formData,
+  });
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}));
+    const error = new Error(body.detail || 'Upload failed');
+    error.response = { status: response.status, data: body };
+    throw error;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const chunk = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = chunk.match(/^event: (.*)$/m)?.[1];
+      const data = chunk.match(/^data: (.*)$/m)?.[1];
+      if (!event || !data) continue;  // keepalive comment
+
+      const payload = JSON.parse(data);
+      if (event === 'progress') {
+        onProgress(payload);
+      } else if (event === 'result') {
+        return payload;
+      } else if (event === 'error') {
+        const error = new Error(payload.detail);
+        error.response = { status: payload.status_code, data: payload };
+        throw error;
+      }
+    }
+  }
+  throw new Error('Progress stream ended without a result');
+};
+
 export const calculateSampleSize = async (data) => {
   const response = await api.post('/sample-size', data);
   return response.data;
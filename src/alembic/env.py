@@ -9,7 +9,7 @@ from sqlalchemy import pool
 from alembic import context
 
 from api.database import Base
-from api.models import User, FileUpload
+from api.models import User, FileUpload, AnalysisCache, RawDataset
 
 load_dotenv()
 
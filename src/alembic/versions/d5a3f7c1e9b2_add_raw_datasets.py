@@ -0,0 +1,48 @@
+"""add_raw_datasets
+
+Revision ID: d5a3f7c1e9b2
+Revises: c7e2a9d4f1b3
+Create Date: 2026-10-19 18:05:12.481307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a3f7c1e9b2'
+down_revision: Union[str, Sequence[str], None] = 'c7e2a9d4f1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The partitioned raw_exposures/raw_events tables themselves are created
+    # by services.postgres_engine on the first ingest.
+    op.create_table('raw_datasets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('experiment_id', sa.String(), nullable=False),
+    sa.Column('exposures_filename', sa.String(), nullable=True),
+    sa.Column('events_filename', sa.String(), nullable=True),
+    sa.Column('exposures_sha256', sa.String(), nullable=False),
+    sa.Column('events_sha256', sa.String(), nullable=False),
+    sa.Column('has_event_value', sa.Boolean(), nullable=False),
+    sa.Column('exposures_rows', sa.BigInteger(), nullable=True),
+    sa.Column('events_rows', sa.BigInteger(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_raw_datasets_id'), 'raw_datasets', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP TABLE IF EXISTS raw_exposures, raw_events")
+    op.drop_index(op.f('ix_raw_datasets_id'), table_name='raw_datasets')
+    op.drop_table('raw_datasets')
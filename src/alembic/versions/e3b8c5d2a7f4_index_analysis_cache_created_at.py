@@ -0,0 +1,29 @@
+"""index_analysis_cache_created_at
+
+Revision ID: e3b8c5d2a7f4
+Revises: d5a3f7c1e9b2
+Create Date: 2026-10-19 21:40:07.113592
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3b8c5d2a7f4'
+down_revision: Union[str, Sequence[str], None] = 'd5a3f7c1e9b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # expired cache entries are pruned by created_at on every write
+    op.create_index(op.f('ix_analysis_cache_created_at'), 'analysis_cache', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_analysis_cache_created_at'), table_name='analysis_cache')
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+from prometheus_client import Counter, Gauge, Histogram
+
+# Estimated analysis memory this process may have reserved at once
+ADMISSION_MEMORY_BUDGET_BYTES = int(os.getenv("ADMISSION_MEMORY_BUDGET_BYTES", 4 * 1024 ** 3))
+MAX_CONCURRENT_ANALYSES = int(os.getenv("MAX_CONCURRENT_ANALYSES", 4))
+# Analyses allowed to wait for admission; beyond this requests get a 429
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 8))
+# Longest wait for admission before giving up with a 503
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 60))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 30))
+# Same setting as services.duckdb_engine, read here to keep it off the import path
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "1GB")
+# Same settings as services.sharded
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 8))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", os.cpu_count() or 1))
+
+# Peak pandas analysis memory per uploaded byte, by file extension. Compressed
+# and columnar files expand several-fold on load; anything else counts as CSV.
+MEMORY_PER_INPUT_BYTE = {
+    '.csv': 5,
+    '.gz': 20,
+    '.zst': 20,
+    '.parquet': 20,
+    '.arrow': 4,
+    '.feather': 4,
+    '.ipc': 4,
+    '.arrows': 4,
+}
+# Fixed per-analysis overhead (interpreter, result building, DuckDB buffers)
+ANALYSIS_BASE_BYTES = 64 * 1024 ** 2
+
+ADMISSION_QUEUE_DEPTH = Gauge('abexp_admission_queue_depth', 'Analyses waiting for admission')
+ADMISSION_ACTIVE = Gauge('abexp_admission_active', 'Analyses admitted and running')
+ADMISSION_RESERVED_BYTES = Gauge('abexp_admission_reserved_bytes', 'Estimated memory reserved by running analyses')
+ADMISSION_REJECTIONS = Counter(
+    'abexp_admission_rejections_total', 'Analyses rejected by admission control', ['reason']
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    'abexp_admission_wait_seconds', 'Time analyses waited for admission',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+_BYTE_UNITS = {'': 1, 'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+               'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3, 'TIB': 1024 ** 4}
+
+
+def parse_bytes(value: str) -> int:
+    """Byte count of a size such as '1GB' or '512MiB'"""
+    text = str(value).strip().upper().replace(' ', '')
+    number = text.rstrip('KMGTIB')
+    return int(float(number) * _BYTE_UNITS[text[len(number):]])
+
+
+def estimate_memory_cost(uploads: list, engine: str = 'pandas', fraction: float = 1.0) -> int:
+    """
+    Estimated peak memory of analyzing uploads (SpooledUpload or None) with
+    engine: their sizes scaled by MEMORY_PER_INPUT_BYTE for pandas, capped
+    at the memory limit for DuckDB, which spills past it. The sharded engine
+    holds only the shards its workers are processing at once, and a preview
+    only its fraction sample of users.
+    """
+    data_bytes = sum(
+        upload.size * MEMORY_PER_INPUT_BYTE.get(os.path.splitext(upload.path)[1].lower(), MEMORY_PER_INPUT_BYTE['.csv'])
+        for upload in uploads if upload is not None
+    )
+    if engine == 'duckdb':
+        data_bytes = min(data_bytes, parse_bytes(DUCKDB_MEMORY_LIMIT))
+    elif engine == 'sharded':
+        data_bytes = data_bytes * min(SHARD_WORKERS, SHARD_COUNT) // SHARD_COUNT
+    return ANALYSIS_BASE_BYTES + int(data_bytes * fraction)
+
+
+class AdmissionController:
+    """
+    Admits analyses against a memory budget and a concurrency limit, in
+    arrival order. Requests that don't fit wait in a bounded queue for a
+    bounded time; a full queue is answered with 429 and a timed-out wait
+    with 503, both with Retry-After. A request estimated to need more than
+    the whole budget is admitted alone once everything else has finished.
+    State is per process: each worker enforces its own budget.
+    """
+
+    def __init__(self, memory_budget: int = ADMISSION_MEMORY_BUDGET_BYTES,
+                 max_concurrent: int = MAX_CONCURRENT_ANALYSES,
+                 max_queue: int = ADMISSION_QUEUE_SIZE,
+                 max_wait: float = ADMISSION_MAX_WAIT_SECONDS,
+                 retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        self.memory_budget = memory_budget
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.reserved = 0
+        self.active = 0
+        self._waiters = deque()
+
+    def _reject(self, status_code: int, reason: str, detail: str):
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        return HTTPException(status_code=status_code, detail=detail, headers={'Retry-After': str(self.retry_after)})
+
+    def _fits(self, cost: int) -> bool:
+        return self.active < self.max_concurrent and self.reserved + cost <= self.memory_budget
+
+    def _update_gauges(self):
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+        ADMISSION_ACTIVE.set(self.active)
+        ADMISSION_RESERVED_BYTES.set(self.reserved)
+
+    def _grant(self, cost: int):
+        self.active += 1
+        self.reserved += cost
+        self._update_gauges()
+
+    def _release(self, cost: int):
+        self.active -= 1
+        self.reserved -= cost
+        self._wake()
+
+    def _wake(self):
+        """Admit waiters from the head of the queue while they fit"""
+        while self._waiters:
+            cost, future = self._waiters[0]
+            if not future.done() and not self._fits(cost):
+                break
+            self._waiters.popleft()
+            if not future.done():
+                self._grant(cost)
+                future.set_result(None)
+        self._update_gauges()
+
+    def check_queue(self):
+        """Fail fast with 429 when the queue is full, e.g. before spooling an upload"""
+        if self._waiters and len(self._waiters) >= self.max_queue:
+            raise self._reject(
+                status.HTTP_429_TOO_MANY_REQUESTS, 'queue_full', "Too many analyses queued; retry later"
+            )
+
+    @asynccontextmanager
+    async def admit(self, cost: int):
+        """Hold an admission for an analysis estimated to need cost bytes"""
+        cost = min(cost, self.memory_budget)
+        start = time.perf_counter()
+        if not self._waiters and self._fits(cost):
+            self._grant(cost)
+        else:
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject(
+                    status.HTTP_429_TOO_MANY_REQUESTS, 'queue_full', "Too many analyses queued; retry later"
+                )
+            waiter = (cost, asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)
+            self._update_gauges()
+            try:
+                await asyncio.wait_for(waiter[1], self.max_wait)
+            except asyncio.TimeoutError:
+                raise self._reject(
+                    status.HTTP_503_SERVICE_UNAVAILABLE, 'timeout',
+                    "Server is busy with other analyses; retry later"
+                )
+            except BaseException:
+                # cancelled (e.g. client gone) right after being admitted
+                if waiter[1].done() and not waiter[1].cancelled():
+                    self._release(cost)
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    # a large request leaving the head may let smaller ones in
+                    self._wake()
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+        try:
+            yield
+        finally:
+            self._release(cost)
+
+
+admission = AdmissionController()
@@ -1,5 +1,7 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from typing import Any
+from datetime import datetime, timedelta, UTC
 from . import models, schemas
 from .auth import get_password_hash
 
@@ -24,7 +26,7 @@ def create_user(db:  Session, user: schemas.UserCreate):
 def create_file_upload(
         db: Session, user_id: int, exp_name:str,  
         experiment_id: str, json_filename: str, 
-        exposures_filename:  str, events_filename: str,
+        exposures_filename:  str, events_filename: str | None,
         users_filename: str | None, 
         selected_option: str,
         analysis_results: Any = None,
@@ -45,3 +47,103 @@ def create_file_upload(
     db.commit()
     db.refresh(db_upload)
     return db_upload
+
+def get_cached_analysis(db: Session, cache_key: str, max_age_seconds: float | None = None):
+    query = db.query(models.AnalysisCache).filter(models.AnalysisCache.cache_key == cache_key)
+    if max_age_seconds:
+        query = query.filter(models.AnalysisCache.created_at >= datetime.now(UTC) - timedelta(seconds=max_age_seconds))
+    return query.first()
+
+def store_cached_analysis(db: Session, cache_key: str, analysis_results: Any):
+    db_entry = models.AnalysisCache(cache_key=cache_key, analysis_results=analysis_results)
+    db.add(db_entry)
+    try:
+        db.commit()
+    except IntegrityError:
+        # another worker stored the same key first
+        db.rollback()
+        return get_cached_analysis(db, cache_key)
+    db.refresh(db_entry)
+    return db_entry
+
+def prune_cached_analyses(db: Session, max_age_seconds: float | None = None, max_rows: int | None = None) -> int:
+    """Delete cache entries older than max_age_seconds and all but the newest max_rows; returns rows deleted"""
+    deleted = 0
+    if max_age_seconds:
+        cutoff = datetime.now(UTC) - timedelta(seconds=max_age_seconds)
+        deleted += db.query(models.AnalysisCache).filter(models.AnalysisCache.created_at < cutoff).delete()
+    if max_rows:
+        # ids increase with insertion, so the newest rows have the largest ids
+        oldest_kept = (
+            db.query(models.AnalysisCache.id).order_by(models.AnalysisCache.id.desc()).offset(max_rows - 1).limit(1).scalar()
+        )
+        if oldest_kept is not None:
+            deleted += db.query(models.AnalysisCache).filter(models.AnalysisCache.id < oldest_kept).delete()
+    db.commit()
+    return deleted
+
+def get_file_upload(db: Session, upload_id: int, user_id: int):
+    return db.query(models.FileUpload).filter(
+        models.FileUpload.id == upload_id,
+        models.FileUpload.user_id == user_id
+    ).first()
+
+def update_upload_analysis(db: Session, db_upload: models.FileUpload, analysis_results: Any):
+    # JSON columns only notice reassignment, not in-place mutation
+    db_upload.analysis_results = analysis_results
+    db.commit()
+    db.refresh(db_upload)
+    return db_upload
+
+def create_raw_dataset(
+        db: Session, user_id: int, experiment_id: str,
+        exposures_filename: str, events_filename: str,
+        exposures_sha256: str, events_sha256: str,
+        has_event_value: bool, load):
+    """
+    Add a raw dataset and fill its data with load(connection, dataset_id),
+    which returns its row counts, in the same transaction: a failed load
+    leaves nothing behind.
+    """
+    db_dataset = models.RawDataset(
+        user_id=user_id,
+        experiment_id=experiment_id,
+        exposures_filename=exposures_filename,
+        events_filename=events_filename,
+        exposures_sha256=exposures_sha256,
+        events_sha256=events_sha256,
+        has_event_value=has_event_value
+    )
+    db.add(db_dataset)
+    try:
+        db.flush()
+        counts = load(db.connection(), db_dataset.id)
+        db_dataset.exposures_rows = counts['exposures_rows']
+        db_dataset.events_rows = counts['events_rows']
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(db_dataset)
+    return db_dataset
+
+def get_raw_dataset(db: Session, dataset_id: int, user_id: int):
+    return db.query(models.RawDataset).filter(
+        models.RawDataset.id == dataset_id,
+        models.RawDataset.user_id == user_id
+    ).first()
+
+def get_raw_datasets(db: Session, user_id: int):
+    return db.query(models.RawDataset).filter(
+        models.RawDataset.user_id == user_id
+    ).order_by(models.RawDataset.id).all()
+
+def delete_raw_dataset(db: Session, db_dataset: models.RawDataset, drop):
+    """Delete a raw dataset, dropping its data with drop(connection, dataset_id) in the same transaction"""
+    try:
+        drop(db.connection(), db_dataset.id)
+        db.delete(db_dataset)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
@@ -1,12 +1,23 @@
-from fastapi import FastAPI
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from .database import engine, Base
 from .routers import users, files, sample_size
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+# Deployments that run the Alembic migrations (init_db.sh) can skip this
+CREATE_TABLES_ON_STARTUP = int(os.getenv("CREATE_TABLES_ON_STARTUP", 1))
 
-app = FastAPI(title="A/B Testing Experimentation Platform")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables once the server starts rather than on import,
+    # so importing the app (workers, tooling, tests) doesn't touch the database
+    if CREATE_TABLES_ON_STARTUP:
+        Base.metadata.create_all(bind=engine)
+    yield
+
+app = FastAPI(title="A/B Testing Experimentation Platform", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -19,6 +30,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Analysis-Cache"],
 )
 
 # Include routers
@@ -29,3 +41,8 @@ app.include_router(sample_size.router, prefix="/api")
 @app.get("/")
 async def root():
     return {"message":  "Welcome to A/B Testing Experimentation Platform"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
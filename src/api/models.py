@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Text
+from sqlalchemy import Column, Integer, BigInteger, Boolean, String, DateTime, ForeignKey, JSON, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime, UTC
 from .database import Base
@@ -13,6 +13,7 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.now(UTC))
 
     uploads = relationship("FileUpload", back_populates="owner")
+    raw_datasets = relationship("RawDataset", back_populates="owner")
 
 class FileUpload(Base):
     __tablename__ = "file_uploads"
@@ -32,4 +33,27 @@ class FileUpload(Base):
 
     owner = relationship("User", back_populates="uploads")
 
-    
\ No newline at end of file
+class AnalysisCache(Base):
+    __tablename__ = "analysis_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String, unique=True, index=True, nullable=False)
+    analysis_results = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), index=True)
+
+class RawDataset(Base):
+    __tablename__ = "raw_datasets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    experiment_id = Column(String, nullable=False)
+    exposures_filename = Column(String)
+    events_filename = Column(String)
+    exposures_sha256 = Column(String, nullable=False)
+    events_sha256 = Column(String, nullable=False)
+    has_event_value = Column(Boolean, nullable=False, default=False)
+    exposures_rows = Column(BigInteger)
+    events_rows = Column(BigInteger)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+
+    owner = relationship("User", back_populates="raw_datasets")
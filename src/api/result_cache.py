@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from datetime import datetime, UTC
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from .crud import get_cached_analysis, prune_cached_analyses, store_cached_analysis
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 128))
+# Age after which a cached result is recomputed, and rows kept in the analysis_cache table; 0 disables either
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", 10_000))
+
+
+def config_hash(metrics_config: dict) -> str:
+    """Hash of a metrics config that ignores key order and whitespace"""
+    canonical = json.dumps(metrics_config, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def make_cache_key(exposures_sha256: str, events_sha256: str, metrics_config: dict,
+                   experiment_id: str, apply_correction: bool, **params) -> str:
+    """
+    Key for an analysis result. Anything else that changes the output
+    (e.g. later analysis options) is passed as extra keyword params.
+    """
+    parts = {
+        'exposures': exposures_sha256,
+        'events': events_sha256,
+        'metrics_config': config_hash(metrics_config),
+        'experiment_id': str(experiment_id),
+        'apply_correction': bool(apply_correction),
+        **params,
+    }
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def make_dataset_key(exposures_sha256: str, events_sha256: str, metrics_config: dict, experiment_id: str) -> str:
+    """Key for the prepared inputs of an analysis, independent of analysis options"""
+    parts = {
+        'exposures': exposures_sha256,
+        'events': events_sha256,
+        'metrics_config': config_hash(metrics_config),
+        'experiment_id': str(experiment_id),
+    }
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _age_seconds(created_at) -> float:
+    """Age of a stored row's created_at, read back naive (UTC) or aware depending on the database"""
+    if created_at is None:
+        return 0.0
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=UTC)
+    return max((datetime.now(UTC) - created_at).total_seconds(), 0.0)
+
+
+class ResultCache:
+    """
+    Analysis results keyed by input hashes and parameters: an in-process LRU
+    in front of the analysis_cache table, plus de-duplication of concurrent
+    computations of the same key within this process. Entries expire after
+    ttl_seconds, and each write prunes the table to its newest max_rows.
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+                 max_rows: int = RESULT_CACHE_MAX_ROWS):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self._lru = OrderedDict()
+        self._in_flight = {}
+
+    def _remember(self, key: str, analysis_results, age_seconds: float = 0.0):
+        self._lru[key] = (time.monotonic() - age_seconds, analysis_results)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def _recall(self, key: str):
+        """The LRU's unexpired results for key, or None"""
+        stored_at, analysis_results = self._lru[key]
+        if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return analysis_results
+
+    def clear(self):
+        self._lru.clear()
+
+    async def get_or_compute(self, db: Session, key: str, compute, admit=None):
+        """
+        Return (analysis_results, processing_error, status) for key, where
+        status is 'hit', 'shared' or 'miss'. compute is a blocking callable
+        returning (analysis_results, processing_error); it runs in the thread
+        pool and only error-free results are stored. admit, if given, returns
+        an async context manager held while computing (see api.admission),
+        so hits and shared computations skip admission.
+        """
+        analysis_results = self._recall(key) if key in self._lru else None
+        if analysis_results is not None:
+            return analysis_results, None, 'hit'
+
+        if key in self._in_flight:
+            analysis_results, processing_error = await asyncio.shield(self._in_flight[key])
+            return analysis_results, processing_error, 'shared'
+
+        cached = get_cached_analysis(db, key, self.ttl_seconds)
+        if cached is not None:
+            self._remember(key, cached.analysis_results, _age_seconds(cached.created_at))
+            return cached.analysis_results, None, 'hit'
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            async with admit() if admit else nullcontext():
+                analysis_results, processing_error = await run_in_threadpool(compute)
+            if analysis_results is not None and processing_error is None:
+                store_cached_analysis(db, key, analysis_results)
+                prune_cached_analyses(db, self.ttl_seconds, self.max_rows)
+                self._remember(key, analysis_results)
+            future.set_result((analysis_results, processing_error))
+        except BaseException as e:
+            future.set_exception(e)
+            # nobody else may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+        return analysis_results, processing_error, 'miss'
+
+
+result_cache = ResultCache()
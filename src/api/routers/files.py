@@ -1,145 +1,542 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+import asyncio
 import json
-import pandas as pd
-import numpy as np
-from ..database import get_db
+import os
+from starlette.concurrency import run_in_threadpool
+from ..database import get_db, SessionLocal
 from ..auth import get_current_user
 from ..models import User
-from ..crud import create_file_upload
-from ..schemas import FileUploadResponse
-from services.analysis import run_experiment_analysis
-from services.load import load_files
-from services.validate import validate_csv_structure
+from ..crud import (
+    create_file_upload,
+    get_file_upload,
+    update_upload_analysis,
+    create_raw_dataset,
+    get_raw_dataset,
+    get_raw_datasets,
+    delete_raw_dataset,
+)
+from ..schemas import FileUploadResponse, RawDatasetResponse
+from ..uploads import UploadSpool, SpooledUpload
+from ..result_cache import result_cache, make_cache_key, make_dataset_key
+from ..admission import admission, estimate_memory_cost
+from services.options import (
+    ANALYSIS_SECTIONS,
+    SECTION_RESULT_KEYS,
+    AGGREGATED_INPUT_MODES,
+    SERIES_SECTIONS,
+    SERIES_FORMATS,
+)
+from services.instrumentation import collect_timings, server_timing_header, timed
+from services.progress import progress_callback, report_progress
 
 router = APIRouter()
 
+# Combined exposures + events size above which engine='auto' switches to DuckDB
+LARGE_UPLOAD_BYTES = int(os.getenv("LARGE_UPLOAD_BYTES", 512 * 1024 * 1024))
+ANALYSIS_ENGINES = ('auto', 'pandas', 'duckdb', 'sharded')
+# Idle seconds after which the progress stream sends a keepalive comment
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
+# Share of users a preview analyzes when the request doesn't set preview_fraction
+PREVIEW_FRACTION = float(os.getenv("PREVIEW_FRACTION", 0.05))
+
+EXPOSURES_COLUMNS = ['user_id', 'experiment_id', 'variant', 'exposure_time']
+EVENTS_COLUMNS = ['user_id', 'event_name', 'event_time']
+USERS_COLUMNS = ['user_id']
+# Accepted table uploads; the format itself is sniffed from the file contents
+TABLE_EXTENSIONS = ('.csv', '.csv.gz', '.csv.zst', '.parquet', '.arrow', '.feather', '.ipc', '.arrows')
+TABLE_FORMATS_DETAIL = "CSV (optionally gzip or zstd compressed), Parquet or Arrow IPC/Feather"
+
 def make_json_serializable(obj):
     """Convert pandas/numpy objects to JSON-serializable types"""
-    if isinstance(obj, dict):
-        return {key: make_json_serializable(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [make_json_serializable(item) for item in obj]
-    elif isinstance(obj, (pd.Timestamp, pd.Timedelta)):
-        return obj.isoformat()
-    elif isinstance(obj, (np.integer, np.floating)):
-        return obj.item()
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif pd.isna(obj):
+    import numpy as np
+    import pandas as pd
+
+    def convert(obj):
+        if isinstance(obj, dict):
+            return {key: convert(value) for key, value in obj.items()}
+        elif isinstance(obj, list):
+            return [convert(item) for item in obj]
+        elif isinstance(obj, (pd.Timestamp, pd.Timedelta)):
+            return obj.isoformat()
+        elif isinstance(obj, (np.integer, np.floating)):
+            return obj.item()
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
+        elif pd.isna(obj):
+            return None
+        return obj
+
+    return convert(obj)
+
+def _resolve_engine(engine: str, exposures: SpooledUpload, events: SpooledUpload) -> str:
+    """Pick the analysis engine; 'auto' uses DuckDB for uploads too large for pandas"""
+    if engine != 'auto':
+        return engine
+    return 'duckdb' if exposures.size + events.size > LARGE_UPLOAD_BYTES else 'pandas'
+
+def _parse_sections(sections: str | None):
+    """
+    Parse a comma-separated list of chart sections. None means all sections;
+    an empty value or 'summary' means the stat tests only.
+    """
+    if sections is None:
         return None
-    return obj
-    
-@router.post("/upload", response_model=FileUploadResponse)
-async def upload_files(
-    exp_name: str = Form(...),
-    experiment_id: str = Form(...),
-    json_file: UploadFile = File(...),
-    exposures_file: UploadFile = File(...),
-    events_file: UploadFile = File(...),
-    users_file: UploadFile = File(None),
-    selected_option: str = Form(...),
-    apply_correction: bool = Form(True),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    
-    # Validate file extensions
-    if not json_file.filename or not json_file.filename.endswith('.json'):
-        raise HTTPException(status_code=400, detail="Metrics config must be JSON")
-    if not exposures_file.filename or not exposures_file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Exposures file must be CSV")
-    if not events_file.filename or not events_file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Events file must be CSV")
-    if users_file and users_file.filename and not users_file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Users file must be CSV")
-    
-    try:
-        users_filename = users_file.filename if users_file and users_file.filename else None
-        users_file_obj = users_file.file if users_file and users_file.filename else None
-        
-        metrics_config, exposures_df, events_df, users_df = load_files(
-            json_file.file, 
-            exposures_file.file, 
-            events_file.file, 
-            users_file_obj
+    names = [name.strip() for name in sections.split(',') if name.strip() and name.strip() != 'summary']
+    unknown = [name for name in names if name not in ANALYSIS_SECTIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown sections: {', '.join(unknown)}. Choose from: summary, {', '.join(ANALYSIS_SECTIONS)}"
         )
-    except json.JSONDecodeError:
+    return [name for name in ANALYSIS_SECTIONS if name in names]
+
+def _parse_segments(segments: str | None):
+    """
+    Users-file attributes to break results down by, from a comma-separated
+    form value; None means every attribute column of the users file.
+    """
+    if segments is None:
+        return None
+    return [name.strip() for name in segments.split(',') if name.strip()]
+
+def _parse_metrics_config(content: bytes) -> dict:
+    """Metrics config JSON with multi-window metrics expanded (see services.windows)"""
+    from services.windows import expand_metric_windows
+
+    try:
+        return expand_metric_windows(json.loads(content))
+    except (json.JSONDecodeError, UnicodeDecodeError):
         raise HTTPException(status_code=400, detail="Invalid JSON file format")
-    except FileNotFoundError as e:
-        raise HTTPException(status_code=400, detail=f"File not found: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error loading files: {str(e)}")
-    
-    exposures_missing_cols = validate_csv_structure(
-        exposures_df,
-        ['user_id', 'experiment_id', 'variant', 'exposure_time'],
-    )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _read_metrics_config(metrics: SpooledUpload) -> dict:
+    with open(metrics.path, 'rb') as f:
+        return _parse_metrics_config(f.read())
+
+def _validate_inputs(metrics_config: dict, exposures_columns, events_columns, experiment_id: str, available_ids: list,
+                     users_columns=None, segment_by=None):
+    """Check required columns and experiment id; raise HTTPException on failure"""
+    from services.options import QUANTILE_USER_VALUES
+    from services.segments import segment_attributes
+    from services.validate import validate_columns
+
+    exposures_missing_cols = validate_columns(exposures_columns, EXPOSURES_COLUMNS)
     if exposures_missing_cols:
         raise HTTPException(status_code=400, detail=f"Exposures file missing required columns: {', '.join(exposures_missing_cols)}")
     
-    events_missing_cols = validate_csv_structure(
-        events_df,
-        ['user_id', 'event_name', 'event_time'],
-    )
+    events_missing_cols = validate_columns(events_columns, EVENTS_COLUMNS)
     if events_missing_cols:
         raise HTTPException(status_code=400, detail=f"Events file missing required columns: {', '.join(events_missing_cols)}")
 
-    # future: validate users info df
+    if users_columns is not None:
+        users_missing_cols = validate_columns(users_columns, USERS_COLUMNS)
+        if users_missing_cols:
+            raise HTTPException(status_code=400, detail=f"Users file missing required columns: {', '.join(users_missing_cols)}")
+        try:
+            segment_attributes(users_columns, segment_by)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-    # validate event_value if using 'sum' aggregation:
-    has_sum_metric = any(
-        m.get('aggregation') == 'sum'
+    # validate event_value if using 'sum' or 'quantile' aggregation:
+    has_value_metric = any(
+        m.get('aggregation') in ('sum', 'quantile')
         for m in metrics_config.values()
     )
 
-    if has_sum_metric and 'event_value' not in events_df.columns:
+    if has_value_metric and 'event_value' not in events_columns:
         raise HTTPException(
             status_code=400,
-            detail="Events file must have 'event_value' column for revenue metrics"
+            detail="Events file must have 'event_value' column for revenue and quantile metrics"
         )
+
+    for m in metrics_config.values():
+        if m.get('aggregation') == 'quantile':
+            q = m.get('quantile', 0.5)
+            if not isinstance(q, (int, float)) or not 0 < q < 1:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Metric '{m.get('metric_id')}' quantile must be a number between 0 and 1"
+                )
+            if m.get('user_value', 'sum') not in QUANTILE_USER_VALUES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Metric '{m.get('metric_id')}' user_value must be one of: {', '.join(QUANTILE_USER_VALUES)}"
+                )
     
-    if experiment_id not in exposures_df['experiment_id'].astype(str).values:
+    if experiment_id not in available_ids:
         raise HTTPException(
             status_code=400,
-            detail=f"Experiment ID '{experiment_id}' not found in exposures data. Available IDs: {exposures_df['experiment_id'].unique().tolist()}"
+            detail=f"Experiment ID '{experiment_id}' not found in exposures data. Available IDs: {available_ids}"
         )
 
-    # Run analysis and store results in database
-    analysis_results = None
-    processing_error = None
-    
+def _run_analysis(analyze):
+    """
+    Run analyze() and serialize its results. Returns (analysis_results,
+    processing_error): failures are reported rather than raised, since the
+    upload is stored either way; ValueErrors are problems with the input.
+    """
     try:
-        analysis_results = run_experiment_analysis(
-            experiment_id=experiment_id,
-            exposures_df=exposures_df,
-            events_df=events_df,
-            metrics_config=metrics_config,
-            apply_correction=apply_correction
-        )
-        # Convert to JSON-serializable format
+        analysis_results = analyze()
         if analysis_results:
-            analysis_results = make_json_serializable(analysis_results)
+            with timed('serialize'):
+                analysis_results = make_json_serializable(analysis_results)
+            report_progress('serialized')
+        return analysis_results, None
     except ValueError as e:
-        processing_error = f"Analysis failed: {str(e)}"
+        return None, f"Analysis failed: {str(e)}"
     except Exception as e:
-        processing_error = f"Unexpected error during analysis: {str(e)}"
+        return None, f"Unexpected error during analysis: {str(e)}"
+
+def _keep_dataset(analysis_results: dict, dataset_key: str | None, experiment_id, metrics_config: dict, engine: str,
+                  **data):
+    """Save what later on-demand sections need under dataset_key, if given (see services.prepared)"""
+    from services.prepared import save_prepared_dataset
+
+    if dataset_key:
+        save_prepared_dataset(dataset_key, experiment_id, metrics_config, engine, **data)
+        analysis_results['_sections_info']['dataset'] = dataset_key
+    return analysis_results
+
+def _analyze_in_memory(experiment_id, metrics, exposures, events, users, apply_correction, max_points=None,
+                       sections=None, dataset_key=None, segment_by=None, sample_fraction=None):
+    """
+    Load spooled uploads into pandas and run the analysis. With dataset_key,
+    the prepared frames are kept so skipped sections can be computed later.
+    With a users file, results are also broken down by its attributes. With
+    sample_fraction, only that hash sample of users is loaded and the
+    results are marked approximate (see services.sampling).
+    """
+    from services.load import load_files, experiment_ids
+    from services.analysis import prepare_experiment_data, prepare_segments, analyze_prepared_experiment
+
+    try:
+        with timed('load'):
+            metrics_config, exposures_df, events_df, users_df = load_files(
+                metrics.path,
+                exposures.path,
+                events.path,
+                users.path if users else None,
+                experiment_id=experiment_id,
+                sample_fraction=sample_fraction,
+            )
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON file format")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=400, detail=f"File not found: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error loading files: {str(e)}")
+    report_progress('parsed', exposures_rows=len(exposures_df), events_rows=len(events_df))
+
+    with timed('validate'):
+        available_ids = []
+        if 'experiment_id' in exposures_df.columns:
+            available_ids = exposures_df['experiment_id'].astype(str).unique().tolist()
+            if experiment_id not in available_ids:
+                # exposures may have been filtered to experiment_id while reading
+                available_ids = experiment_ids(exposures.path)
+        _validate_inputs(
+            metrics_config,
+            exposures_df.columns,
+            events_df.columns,
+            experiment_id,
+            available_ids,
+            users_df.columns if users_df is not None else None,
+            segment_by,
+        )
+    report_progress('validated', metrics=len(metrics_config))
+
+    def analyze():
+        # drop the raw frames once prepared
+        nonlocal exposures_df, events_df
+        exp_exposures, events_df = prepare_experiment_data(experiment_id, exposures_df, events_df, metrics_config)
+        exposures_df = None
+        segments = prepare_segments(exp_exposures, users_df, segment_by) if users_df is not None else None
+        analysis_results = analyze_prepared_experiment(
+            exp_exposures,
+            events_df,
+            metrics_config,
+            apply_correction=apply_correction,
+            max_points=max_points,
+            sections=sections,
+            segments=segments
+        )
+        analysis_results = _keep_dataset(
+            analysis_results, dataset_key, experiment_id, metrics_config, 'pandas',
+            exp_exposures=exp_exposures, events_df=events_df
+        )
+        if sample_fraction is not None:
+            from services.sampling import project_preview_results
+            analysis_results = project_preview_results(analysis_results, sample_fraction)
+        return analysis_results
+
+    return _run_analysis(analyze)
+
+def _analyze_out_of_core(experiment_id, metrics_config, exposures, events, users, work_dir, apply_correction,
+                         max_points=None, sections=None, dataset_key=None, segment_by=None):
+    """
+    Analyze spooled uploads with the DuckDB engine, which streams the files
+    and spills to work_dir instead of loading them into pandas. With
+    dataset_key, the spooled files are kept for later on-demand sections.
+    """
+    from services import duckdb_engine
+
+    with timed('validate'):
+        try:
+            con = duckdb_engine.connect(temp_directory=work_dir)
+            try:
+                exposures_columns = duckdb_engine.file_columns(con, exposures.path)
+                events_columns = duckdb_engine.file_columns(con, events.path)
+                users_columns = duckdb_engine.file_columns(con, users.path) if users else None
+                available_ids = (
+                    duckdb_engine.experiment_ids(con, exposures.path)
+                    if 'experiment_id' in exposures_columns else []
+                )
+            finally:
+                con.close()
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error loading files: {str(e)}")
+
+        _validate_inputs(
+            metrics_config, exposures_columns, events_columns, experiment_id, available_ids, users_columns, segment_by
+        )
+    report_progress('validated', metrics=len(metrics_config))
+
+    def analyze():
+        analysis_results = duckdb_engine.run_experiment_analysis_duckdb(
+            experiment_id=experiment_id,
+            exposures_path=exposures.path,
+            events_path=events.path,
+            metrics_config=metrics_config,
+            apply_correction=apply_correction,
+            temp_directory=work_dir,
+            max_points=max_points,
+            sections=sections,
+            users_path=users.path if users else None,
+            segment_by=segment_by,
+        )
+        return _keep_dataset(
+            analysis_results, dataset_key, experiment_id, metrics_config, 'duckdb',
+            exposures_path=exposures.path, events_path=events.path
+        )
+
+    return _run_analysis(analyze)
     
-    # Store metadata and analysis results in database
-    db_upload = create_file_upload(
-        db=db,
-        exp_name=exp_name,
-        user_id=current_user.id,
-        experiment_id=experiment_id,
-        json_filename=json_file.filename,
-        exposures_filename=exposures_file.filename,
-        events_filename=events_file.filename,
-        users_filename=users_filename,
-        selected_option=selected_option,
-        analysis_results=analysis_results,
-        processing_error=processing_error
+def _analyze_sharded(experiment_id, metrics_config, exposures, events, work_dir, apply_correction,
+                     max_points=None, sections=None, dataset_key=None):
+    """
+    Analyze spooled uploads split by user into shards that worker processes
+    analyze independently (see services.sharded); shard files go to
+    work_dir. With dataset_key, the spooled files are kept for later
+    on-demand sections, which the DuckDB engine serves.
+    """
+    from services.load import table_columns, experiment_ids
+    from services.sharded import run_sharded_analysis
+
+    with timed('validate'):
+        try:
+            exposures_columns = table_columns(exposures.path)
+            events_columns = table_columns(events.path)
+            available_ids = experiment_ids(exposures.path) if 'experiment_id' in exposures_columns else []
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error loading files: {str(e)}")
+
+        _validate_inputs(metrics_config, exposures_columns, events_columns, experiment_id, available_ids)
+    report_progress('validated', metrics=len(metrics_config))
+
+    def analyze():
+        analysis_results = run_sharded_analysis(
+            experiment_id,
+            exposures.path,
+            events.path,
+            metrics_config,
+            apply_correction=apply_correction,
+            max_points=max_points,
+            sections=sections,
+            work_dir=work_dir,
+        )
+        return _keep_dataset(
+            analysis_results, dataset_key, experiment_id, metrics_config, 'duckdb',
+            exposures_path=exposures.path, events_path=events.path
+        )
+
+    return _run_analysis(analyze)
+
+def _is_table_upload(upload: UploadFile) -> bool:
+    return bool(upload.filename) and upload.filename.lower().endswith(TABLE_EXTENSIONS)
+
+def _check_upload_request(json_file: UploadFile, exposures_file: UploadFile, events_file: UploadFile,
+                          users_file: UploadFile | None, engine: str, max_points: int | None, sections: str | None):
+    """Validate file extensions and analysis options; returns the parsed sections"""
+    if not json_file.filename or not json_file.filename.endswith('.json'):
+        raise HTTPException(status_code=400, detail="Metrics config must be JSON")
+    if not _is_table_upload(exposures_file):
+        raise HTTPException(status_code=400, detail=f"Exposures file must be {TABLE_FORMATS_DETAIL}")
+    if not _is_table_upload(events_file):
+        raise HTTPException(status_code=400, detail=f"Events file must be {TABLE_FORMATS_DETAIL}")
+    if users_file and users_file.filename and not _is_table_upload(users_file):
+        raise HTTPException(status_code=400, detail=f"Users file must be {TABLE_FORMATS_DETAIL}")
+    
+    if engine not in ANALYSIS_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Unknown engine '{engine}'. Choose one of: {', '.join(ANALYSIS_ENGINES)}")
+    if engine == 'sharded' and users_file and users_file.filename:
+        raise HTTPException(status_code=400, detail="Segment breakdowns are not supported by the sharded engine")
+
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+
+    return _parse_sections(sections)
+
+async def _spool_files(spool: UploadSpool, json_file: UploadFile, exposures_file: UploadFile,
+                       events_file: UploadFile, users_file: UploadFile | None):
+    """Stream uploads to disk (hashed, size-limited); parsers read the spooled files"""
+    with timed('spool'):
+        metrics = await spool.add('metrics', json_file)
+        exposures = await spool.add('exposures', exposures_file)
+        events = await spool.add('events', events_file)
+        users = await spool.add('users', users_file) if users_file and users_file.filename else None
+    report_progress('spooled', bytes=spool.total_bytes)
+    return metrics, exposures, events, users
+
+def _check_preview(preview: bool, preview_fraction: float | None, full_analysis: bool) -> float | None:
+    """The user sample fraction of a preview request, or None for a full analysis"""
+    if not preview:
+        if preview_fraction is not None or full_analysis:
+            raise HTTPException(status_code=400, detail="preview_fraction and full_analysis only apply with preview=true")
+        return None
+    fraction = PREVIEW_FRACTION if preview_fraction is None else preview_fraction
+    if not 0 < fraction < 1:
+        raise HTTPException(status_code=400, detail="preview_fraction must be between 0 and 1")
+    return fraction
+
+async def _analyze_spooled(db: Session, spool: UploadSpool, spooled: tuple, experiment_id: str,
+                           apply_correction: bool, engine: str, max_points: int | None,
+                           selected_sections: list | None, segment_by: list | None = None,
+                           preview_fraction: float | None = None):
+    """
+    Analyze spooled uploads through the result cache. A preview analyzes
+    only the preview_fraction hash sample of users, with pandas whatever the
+    engine. Returns (analysis_results, processing_error, cache_status).
+    """
+    metrics, exposures, events, users = spooled
+    metrics_config = _read_metrics_config(metrics)
+    analysis_engine = 'pandas' if preview_fraction is not None else _resolve_engine(engine, exposures, events)
+
+    # Keep the inputs when sections are skipped, so they can be requested later
+    # (not a preview's: its prepared frames hold only the sample)
+    dataset_key = None
+    if preview_fraction is None and selected_sections is not None and len(selected_sections) < len(ANALYSIS_SECTIONS):
+        dataset_key = make_dataset_key(exposures.sha256, events.sha256, metrics_config, experiment_id)
+
+    def analyze():
+        if analysis_engine == 'sharded':
+            return _analyze_sharded(
+                experiment_id, metrics_config, exposures, events, spool.path, apply_correction, max_points,
+                selected_sections, dataset_key
+            )
+        if analysis_engine == 'duckdb':
+            return _analyze_out_of_core(
+                experiment_id, metrics_config, exposures, events, users, spool.path, apply_correction, max_points,
+                selected_sections, dataset_key, segment_by
+            )
+        return _analyze_in_memory(
+            experiment_id, metrics, exposures, events, users, apply_correction, max_points,
+            selected_sections, dataset_key, segment_by, preview_fraction
+        )
+
+    # Identical resubmissions reuse the stored result or join the running one
+    segment_params = {'users': users.sha256, 'segments': segment_by} if users else {}
+    preview_params = {'preview': preview_fraction} if preview_fraction is not None else {}
+    cache_key = make_cache_key(
+        exposures.sha256, events.sha256, metrics_config, experiment_id, apply_correction,
+        max_points=max_points, sections=selected_sections, **segment_params, **preview_params
     )
+    # Only a computation that actually runs waits for memory and a slot
+    memory_cost = estimate_memory_cost([exposures, events, users], analysis_engine, preview_fraction or 1.0)
+    analysis_results, processing_error, cache_status = await result_cache.get_or_compute(
+        db, cache_key, analyze, admit=lambda: admission.admit(memory_cost)
+    )
+    report_progress('analyzed', cache=cache_status)
+    return analysis_results, processing_error, cache_status
+
+async def _analyze_and_store(db: Session, user_id: int, spool: UploadSpool, spooled: tuple,
+                             exp_name: str, experiment_id: str, selected_option: str, apply_correction: bool,
+                             engine: str, max_points: int | None, selected_sections: list | None,
+                             segment_by: list | None = None, preview_fraction: float | None = None,
+                             full_analysis: bool = False):
+    """
+    Analyze spooled uploads (see _analyze_spooled) and store the upload.
+    A preview's results note whether its full analysis follows.
+    Returns (FileUploadResponse, cache_status).
+    """
+    metrics, exposures, events, users = spooled
+    analysis_results, processing_error, cache_status = await _analyze_spooled(
+        db, spool, spooled, experiment_id, apply_correction, engine, max_points, selected_sections,
+        segment_by, preview_fraction
+    )
+    if analysis_results and preview_fraction is not None:
+        # copied: the cached preview is shared with other uploads of the same files
+        preview = {**analysis_results['_preview'], 'full_analysis': 'running' if full_analysis else 'not requested'}
+        analysis_results = {**analysis_results, '_preview': preview}
+
+    # Store metadata and analysis results in database
+    with timed('db_write'):
+        db_upload = create_file_upload(
+            db=db,
+            exp_name=exp_name,
+            user_id=user_id,
+            experiment_id=experiment_id,
+            json_filename=metrics.filename,
+            exposures_filename=exposures.filename,
+            events_filename=events.filename,
+            users_filename=users.filename if users else None,
+            selected_option=selected_option,
+            analysis_results=analysis_results,
+            processing_error=processing_error
+        )
+    report_progress('stored', upload_id=db_upload.id)
+
+    return _upload_response(db_upload, analysis_results, processing_error), cache_status
 
+# Full analyses that continue after their preview was answered, held until done
+_background_analyses: set = set()
+
+async def _complete_preview(upload_id: int, user_id: int, spool: UploadSpool, spooled: tuple, experiment_id: str,
+                            apply_correction: bool, engine: str, max_points: int | None,
+                            selected_sections: list | None, segment_by: list | None):
+    """
+    Run the full analysis of a previewed upload and replace the stored
+    preview with its results. If it fails, the preview stays, with the
+    error under _preview. Removes spool when done.
+    """
+    db = SessionLocal()
+    try:
+        try:
+            with spool:
+                analysis_results, processing_error, _ = await _analyze_spooled(
+                    db, spool, spooled, experiment_id, apply_correction, engine, max_points,
+                    selected_sections, segment_by
+                )
+        except HTTPException as e:
+            analysis_results, processing_error = None, str(e.detail)
+        except Exception as e:
+            analysis_results, processing_error = None, f"Unexpected error during analysis: {str(e)}"
+
+        db_upload = get_file_upload(db, upload_id, user_id)
+        if db_upload is None:
+            return
+        if analysis_results is not None and processing_error is None:
+            update_upload_analysis(db, db_upload, analysis_results)
+        else:
+            stored = db_upload.analysis_results or {}
+            preview = {**stored.get('_preview', {}), 'full_analysis': 'failed', 'full_analysis_error': processing_error}
+            update_upload_analysis(db, db_upload, {**stored, '_preview': preview})
+    finally:
+        db.close()
+
+def _upload_response(db_upload, analysis_results, processing_error) -> FileUploadResponse:
     return FileUploadResponse(
         id=db_upload.id,
         user_id=db_upload.user_id,
@@ -155,6 +552,587 @@ async def upload_files(
         processing_error=processing_error
     )
 
+@router.post("/upload", response_model=FileUploadResponse)
+async def upload_files(
+    request: Request,
+    response: Response,
+    exp_name: str = Form(...),
+    experiment_id: str = Form(...),
+    json_file: UploadFile = File(...),
+    exposures_file: UploadFile = File(...),
+    events_file: UploadFile = File(...),
+    users_file: UploadFile = File(None),
+    selected_option: str = Form(...),
+    apply_correction: bool = Form(True),
+    engine: str = Form("auto"),
+    max_points: int | None = Form(None),
+    sections: str | None = Form(None),
+    segments: str | None = Form(None),
+    preview: bool = Form(False),
+    preview_fraction: float | None = Form(None),
+    full_analysis: bool = Form(False),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload and analyze an experiment. With preview=true, only a deterministic
+    hash sample of users (preview_fraction, default PREVIEW_FRACTION) is
+    analyzed and the results are marked approximate; with full_analysis=true
+    the full analysis then continues in the background and replaces them in
+    the stored upload (see GET /{upload_id}).
+    """
+    selected_sections = _check_upload_request(
+        json_file, exposures_file, events_file, users_file, engine, max_points, sections
+    )
+    preview_fraction = _check_preview(preview, preview_fraction, full_analysis)
+    segment_by = _parse_segments(segments)
+
+    # Don't spool what couldn't be queued anyway
+    admission.check_queue()
+
+    # Label stage timings by the size of the whole multipart request
+    content_length = request.headers.get('content-length')
+    spool = UploadSpool()
+    continue_full = False
+    try:
+        with collect_timings(int(content_length) if content_length else None) as timings:
+            spooled = await _spool_files(spool, json_file, exposures_file, events_file, users_file)
+            upload_response, cache_status = await _analyze_and_store(
+                db, current_user.id, spool, spooled, exp_name, experiment_id, selected_option,
+                apply_correction, engine, max_points, selected_sections, segment_by, preview_fraction, full_analysis
+            )
+        continue_full = full_analysis and upload_response.processing_error is None
+    finally:
+        if not continue_full:
+            spool.cleanup()
+
+    if continue_full:
+        # the full analysis now owns the spooled files
+        task = asyncio.create_task(_complete_preview(
+            upload_response.id, current_user.id, spool, spooled, experiment_id, apply_correction, engine,
+            max_points, selected_sections, segment_by
+        ))
+        _background_analyses.add(task)
+        task.add_done_callback(_background_analyses.discard)
+
+    response.headers['Server-Timing'] = server_timing_header(timings)
+    response.headers['X-Analysis-Cache'] = cache_status
+
+    return upload_response
+
+def _analyze_aggregated(experiment_id, metrics_config, summary: SpooledUpload, input_mode: str, apply_correction,
+                        max_points=None, sections=None):
+    """Load a spooled pre-aggregated table and analyze it without the window join"""
+    from services.aggregated import aggregated_columns, run_user_table_analysis, run_bucket_table_analysis
+    from services.load import read_table
+    from services.validate import validate_columns
+
+    try:
+        required_columns = aggregated_columns(input_mode, metrics_config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        with timed('load'):
+            table = read_table(summary.path, columns=required_columns + ['experiment_id'])
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error loading files: {str(e)}")
+    report_progress('parsed', summary_rows=len(table))
+
+    with timed('validate'):
+        missing_cols = validate_columns(table.columns, required_columns)
+        if missing_cols:
+            raise HTTPException(status_code=400, detail=f"Summary file missing required columns: {', '.join(missing_cols)}")
+        if 'experiment_id' in table.columns:
+            available_ids = table['experiment_id'].astype(str).unique().tolist()
+            if experiment_id not in available_ids:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Experiment ID '{experiment_id}' not found in summary data. Available IDs: {available_ids}"
+                )
+    report_progress('validated', metrics=len(metrics_config))
+
+    run_analysis = run_user_table_analysis if input_mode == 'users' else run_bucket_table_analysis
+    return _run_analysis(lambda: run_analysis(
+        experiment_id, table, metrics_config, apply_correction, max_points=max_points, sections=sections
+    ))
+
+@router.post("/upload/aggregated", response_model=FileUploadResponse)
+async def upload_aggregated(
+    request: Request,
+    response: Response,
+    exp_name: str = Form(...),
+    experiment_id: str = Form(...),
+    json_file: UploadFile = File(...),
+    summary_file: UploadFile = File(...),
+    input_mode: str = Form(...),
+    selected_option: str = Form(...),
+    apply_correction: bool = Form(True),
+    max_points: int | None = Form(None),
+    sections: str | None = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Analyze a pre-aggregated table instead of raw exposures and events (see
+    services.aggregated): input_mode 'users' for one row per user with a
+    column per metric, 'buckets' for per-bucket, per-variant n, sum, sum_sq.
+    """
+    if not json_file.filename or not json_file.filename.endswith('.json'):
+        raise HTTPException(status_code=400, detail="Metrics config must be JSON")
+    if not _is_table_upload(summary_file):
+        raise HTTPException(status_code=400, detail=f"Summary file must be {TABLE_FORMATS_DETAIL}")
+    if input_mode not in AGGREGATED_INPUT_MODES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown input_mode '{input_mode}'. Choose one of: {', '.join(AGGREGATED_INPUT_MODES)}"
+        )
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+    selected_sections = _parse_sections(sections)
+    admission.check_queue()
+
+    content_length = request.headers.get('content-length')
+    with collect_timings(int(content_length) if content_length else None) as timings:
+        with UploadSpool() as spool:
+            with timed('spool'):
+                metrics = await spool.add('metrics', json_file)
+                summary = await spool.add('summary', summary_file)
+            report_progress('spooled', bytes=spool.total_bytes)
+            metrics_config = _read_metrics_config(metrics)
+
+            cache_key = make_cache_key(
+                summary.sha256, '', metrics_config, experiment_id, apply_correction,
+                max_points=max_points, sections=selected_sections, input_mode=input_mode
+            )
+            memory_cost = estimate_memory_cost([summary])
+            analysis_results, processing_error, cache_status = await result_cache.get_or_compute(
+                db, cache_key, lambda: _analyze_aggregated(
+                    experiment_id, metrics_config, summary, input_mode, apply_correction, max_points, selected_sections
+                ),
+                admit=lambda: admission.admit(memory_cost)
+            )
+            report_progress('analyzed', cache=cache_status)
+
+        with timed('db_write'):
+            db_upload = create_file_upload(
+                db=db,
+                exp_name=exp_name,
+                user_id=current_user.id,
+                experiment_id=experiment_id,
+                json_filename=metrics.filename,
+                exposures_filename=summary.filename,
+                events_filename=None,
+                users_filename=None,
+                selected_option=selected_option,
+                analysis_results=analysis_results,
+                processing_error=processing_error
+            )
+        report_progress('stored', upload_id=db_upload.id)
+
+    response.headers['Server-Timing'] = server_timing_header(timings)
+    response.headers['X-Analysis-Cache'] = cache_status
+
+    return _upload_response(db_upload, analysis_results, processing_error)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/upload/stream")
+async def upload_files_stream(
+    request: Request,
+    exp_name: str = Form(...),
+    experiment_id: str = Form(...),
+    json_file: UploadFile = File(...),
+    exposures_file: UploadFile = File(...),
+    events_file: UploadFile = File(...),
+    users_file: UploadFile = File(None),
+    selected_option: str = Form(...),
+    apply_correction: bool = Form(True),
+    engine: str = Form("auto"),
+    max_points: int | None = Form(None),
+    sections: str | None = Form(None),
+    segments: str | None = Form(None),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Same as /upload, but answers with a text/event-stream: 'progress' events
+    as stages finish (spooled, parsed, validated, metric i of n with its
+    uncorrected summary, serialized, stored), then one 'result' event with
+    the upload response or an 'error' event. The analysis keeps running if
+    the client disconnects, so a retry joins it through the result cache.
+    """
+    selected_sections = _check_upload_request(
+        json_file, exposures_file, events_file, users_file, engine, max_points, sections
+    )
+
+    admission.check_queue()
+
+    # Spool before responding: the request's upload files don't outlive this handler
+    content_length = request.headers.get('content-length')
+    input_bytes = int(content_length) if content_length else None
+    spool = UploadSpool()
+    try:
+        with collect_timings(input_bytes):
+            spooled = await _spool_files(spool, json_file, exposures_file, events_file, users_file)
+    except BaseException:
+        spool.cleanup()
+        raise
+    user_id = current_user.id
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(event: str, data):
+        # called from the analysis thread as well as the event loop; going
+        # through the loop's callback queue keeps events in report order
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+    def on_progress(stage, details):
+        emit('progress', make_json_serializable({'stage': stage, **details}))
+
+    async def run():
+        db = SessionLocal()
+        try:
+            with spool, progress_callback(on_progress), collect_timings(input_bytes):
+                upload_response, _ = await _analyze_and_store(
+                    db, user_id, spool, spooled, exp_name, experiment_id, selected_option,
+                    apply_correction, engine, max_points, selected_sections, _parse_segments(segments)
+                )
+            emit('result', upload_response.model_dump(mode='json'))
+        except HTTPException as e:
+            error = {'status_code': e.status_code, 'detail': e.detail}
+            if e.headers and 'Retry-After' in e.headers:
+                error['retry_after'] = int(e.headers['Retry-After'])
+            emit('error', error)
+        except Exception as e:
+            emit('error', {'status_code': 500, 'detail': f"Unexpected error: {str(e)}"})
+        finally:
+            db.close()
+
+    emit('progress', {'stage': 'spooled', 'bytes': spool.total_bytes})
+    task = asyncio.create_task(run())
+
+    async def stream():
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # comment line keeps proxies from timing out an idle connection
+                yield ": keepalive\n\n"
+                continue
+            yield _sse(event, data)
+            if event in ('result', 'error'):
+                break
+        await task
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+def _require_postgres(db: Session):
+    if db.get_bind().dialect.name != 'postgresql':
+        raise HTTPException(status_code=501, detail="Raw data storage needs a PostgreSQL database")
+
+def _ingest_raw(db: Session, user_id: int, experiment_id: str, exposures: SpooledUpload, events: SpooledUpload):
+    """Validate spooled exposures and events and COPY them into a new raw dataset"""
+    from services.load import table_columns, experiment_ids
+    from services.postgres_engine import ingest_raw_data
+
+    with timed('validate'):
+        try:
+            exposures_columns = table_columns(exposures.path)
+            events_columns = table_columns(events.path)
+            available_ids = experiment_ids(exposures.path) if 'experiment_id' in exposures_columns else []
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error loading files: {str(e)}")
+        # metrics are checked against the stored columns at analysis time
+        _validate_inputs({}, exposures_columns, events_columns, experiment_id, available_ids)
+    report_progress('validated')
+
+    has_event_value = 'event_value' in events_columns
+    try:
+        return create_raw_dataset(
+            db,
+            user_id=user_id,
+            experiment_id=experiment_id,
+            exposures_filename=exposures.filename,
+            events_filename=events.filename,
+            exposures_sha256=exposures.sha256,
+            events_sha256=events.sha256,
+            has_event_value=has_event_value,
+            load=lambda con, dataset_id: ingest_raw_data(
+                con, dataset_id, experiment_id, exposures.path, events.path, has_event_value
+            ),
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error loading files: {str(e)}")
+
+@router.post("/raw", response_model=RawDatasetResponse, status_code=201)
+async def upload_raw_data(
+    request: Request,
+    response: Response,
+    experiment_id: str = Form(...),
+    exposures_file: UploadFile = File(...),
+    events_file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Load an experiment's raw exposures and events into Postgres (see
+    services.postgres_engine), to be analyzed there with any metrics config
+    without uploading the files again.
+    """
+    _require_postgres(db)
+    if not _is_table_upload(exposures_file):
+        raise HTTPException(status_code=400, detail=f"Exposures file must be {TABLE_FORMATS_DETAIL}")
+    if not _is_table_upload(events_file):
+        raise HTTPException(status_code=400, detail=f"Events file must be {TABLE_FORMATS_DETAIL}")
+    admission.check_queue()
+
+    content_length = request.headers.get('content-length')
+    with collect_timings(int(content_length) if content_length else None) as timings:
+        with UploadSpool() as spool:
+            with timed('spool'):
+                exposures = await spool.add('exposures', exposures_file)
+                events = await spool.add('events', events_file)
+            report_progress('spooled', bytes=spool.total_bytes)
+
+            # files are copied in bounded chunks, so only the base cost is reserved
+            async with admission.admit(estimate_memory_cost([])):
+                db_dataset = await run_in_threadpool(
+                    _ingest_raw, db, current_user.id, experiment_id, exposures, events
+                )
+
+    response.headers['Server-Timing'] = server_timing_header(timings)
+    return db_dataset
+
+@router.get("/raw", response_model=list[RawDatasetResponse])
+async def list_raw_data(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Raw datasets of the current user"""
+    return get_raw_datasets(db, current_user.id)
+
+def _analyze_raw(bind, dataset_id: int, metrics_config: dict, apply_correction, max_points=None, sections=None):
+    """Analyze a raw dataset inside Postgres; temporary tables go with the connection's transaction"""
+    from services.postgres_engine import run_experiment_analysis_postgres
+
+    def analyze():
+        with bind.connect() as con:
+            analysis_results = run_experiment_analysis_postgres(
+                con, dataset_id, metrics_config, apply_correction, max_points=max_points, sections=sections
+            )
+        if sections is not None and len(sections) < len(ANALYSIS_SECTIONS):
+            analysis_results['_sections_info']['raw_dataset'] = dataset_id
+        return analysis_results
+
+    return _run_analysis(analyze)
+
+@router.post("/raw/{dataset_id}/analyze", response_model=FileUploadResponse)
+async def analyze_raw_data(
+    dataset_id: int,
+    response: Response,
+    exp_name: str = Form(...),
+    json_file: UploadFile = File(...),
+    selected_option: str = Form(...),
+    apply_correction: bool = Form(True),
+    max_points: int | None = Form(None),
+    sections: str | None = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Analyze a raw dataset with a metrics config: the window join and the
+    aggregations run in Postgres and only aggregates come back. The result
+    is stored like an upload's.
+    """
+    _require_postgres(db)
+    db_dataset = get_raw_dataset(db, dataset_id, current_user.id)
+    if db_dataset is None:
+        raise HTTPException(status_code=404, detail="Raw dataset not found")
+    if not json_file.filename or not json_file.filename.endswith('.json'):
+        raise HTTPException(status_code=400, detail="Metrics config must be JSON")
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+    selected_sections = _parse_sections(sections)
+    admission.check_queue()
+
+    with collect_timings() as timings:
+        metrics_config = _parse_metrics_config(await json_file.read())
+        with timed('validate'):
+            _validate_inputs(
+                metrics_config,
+                EXPOSURES_COLUMNS,
+                EVENTS_COLUMNS + (['event_value'] if db_dataset.has_event_value else []),
+                db_dataset.experiment_id,
+                [db_dataset.experiment_id],
+            )
+
+        cache_key = make_cache_key(
+            db_dataset.exposures_sha256, db_dataset.events_sha256, metrics_config, db_dataset.experiment_id,
+            apply_correction, max_points=max_points, sections=selected_sections, raw_dataset=db_dataset.id
+        )
+        analysis_results, processing_error, cache_status = await result_cache.get_or_compute(
+            db, cache_key, lambda: _analyze_raw(
+                db.get_bind(), db_dataset.id, metrics_config, apply_correction, max_points, selected_sections
+            ),
+            admit=lambda: admission.admit(estimate_memory_cost([]))
+        )
+
+        with timed('db_write'):
+            db_upload = create_file_upload(
+                db=db,
+                exp_name=exp_name,
+                user_id=current_user.id,
+                experiment_id=db_dataset.experiment_id,
+                json_filename=json_file.filename,
+                exposures_filename=db_dataset.exposures_filename,
+                events_filename=db_dataset.events_filename,
+                users_filename=None,
+                selected_option=selected_option,
+                analysis_results=analysis_results,
+                processing_error=processing_error
+            )
+
+    response.headers['Server-Timing'] = server_timing_header(timings)
+    response.headers['X-Analysis-Cache'] = cache_status
+
+    return _upload_response(db_upload, analysis_results, processing_error)
+
+def _drop_raw(db: Session, db_dataset):
+    from services.postgres_engine import drop_raw_data
+    delete_raw_dataset(db, db_dataset, drop_raw_data)
+
+@router.delete("/raw/{dataset_id}", status_code=204)
+async def delete_raw_data(
+    dataset_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Delete a raw dataset and drop its partitions"""
+    _require_postgres(db)
+    db_dataset = get_raw_dataset(db, dataset_id, current_user.id)
+    if db_dataset is None:
+        raise HTTPException(status_code=404, detail="Raw dataset not found")
+    await run_in_threadpool(_drop_raw, db, db_dataset)
+    return Response(status_code=204)
+
+def _prepared_sections(dataset_key: str, metric_id: str, sections: list, max_points=None) -> dict:
+    # imported here so the analysis stack loads in the worker thread, not the event loop
+    from services.prepared import analyze_prepared_sections
+    return analyze_prepared_sections(dataset_key, metric_id, sections, max_points)
+
+@router.get("/{upload_id}/metrics/{metric_id}/sections")
+async def get_metric_sections(
+    upload_id: int,
+    metric_id: str,
+    sections: str,
+    max_points: int | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Compute chart sections skipped at upload time for one metric, store them
+    with the upload's results and return them.
+    """
+    db_upload = get_file_upload(db, upload_id, current_user.id)
+    if db_upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    requested = _parse_sections(sections)
+    if not requested:
+        raise HTTPException(status_code=400, detail=f"Request at least one of: {', '.join(ANALYSIS_SECTIONS)}")
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+
+    analysis_results = db_upload.analysis_results or {}
+    if metric_id not in analysis_results or metric_id.startswith('_'):
+        raise HTTPException(status_code=404, detail=f"Metric '{metric_id}' not found in upload")
+
+    # Sections already stored for the metric are returned as-is
+    stored = analysis_results[metric_id]
+    keys = [SECTION_RESULT_KEYS[name] for name in requested]
+    if max_points is None and all(key in stored for key in keys):
+        return {key: stored[key] for key in keys}
+
+    sections_info = analysis_results.get('_sections_info') or {}
+    if 'raw_dataset' in sections_info:
+        raise HTTPException(status_code=409, detail="Analyze the raw dataset again with the sections needed")
+    if 'dataset' not in sections_info:
+        raise HTTPException(status_code=409, detail="This upload was analyzed with all sections; upload again to change max_points")
+
+    try:
+        with timed('sections'):
+            metric_sections = await run_in_threadpool(
+                _prepared_sections, sections_info['dataset'], metric_id, requested, max_points
+            )
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="Prepared data for this upload is no longer available; upload the files again")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    metric_sections = make_json_serializable(metric_sections)
+
+    # Merge into the stored results
+    updated = dict(analysis_results)
+    updated[metric_id] = {**analysis_results[metric_id], **metric_sections}
+    update_upload_analysis(db, db_upload, updated)
+
+    return metric_sections
+
+def _columnar_series(records: list, section: str, series_format: str, start, end, max_points):
+    from services.series import series_frame, series_columns, series_arrow
+    df = series_frame(records, section, start, end, max_points)
+    return series_arrow(df) if series_format == 'arrow' else series_columns(df)
+
+@router.get("/{upload_id}/metrics/{metric_id}/series/{section}")
+async def get_metric_series(
+    upload_id: int,
+    metric_id: str,
+    section: str,
+    format: str = 'json',
+    start: str | None = None,
+    end: str | None = None,
+    max_points: int | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    One stored time series of a metric in columnar form, for charts: JSON
+    with a parallel array per column, or an Arrow IPC stream (format=arrow).
+    Dates are epoch milliseconds. start/end limit the date range
+    (inclusive) and max_points the points per line.
+    """
+    if section not in SERIES_SECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown series '{section}'. Choose one of: {', '.join(SERIES_SECTIONS)}")
+    if format not in SERIES_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}'. Choose one of: {', '.join(SERIES_FORMATS)}")
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+
+    db_upload = get_file_upload(db, upload_id, current_user.id)
+    if db_upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    analysis_results = db_upload.analysis_results or {}
+    if metric_id not in analysis_results or metric_id.startswith('_'):
+        raise HTTPException(status_code=404, detail=f"Metric '{metric_id}' not found in upload")
+    records = analysis_results[metric_id].get(SECTION_RESULT_KEYS[section])
+    if records is None:
+        raise HTTPException(
+            status_code=409, detail=f"Section '{section}' was not computed for this metric; request it from /sections first"
+        )
+
+    try:
+        encoded = await run_in_threadpool(_columnar_series, records, section, format, start, end, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == 'arrow':
+        return Response(content=encoded, media_type='application/vnd.apache.arrow.stream')
+    return {'metric_id': metric_id, 'section': section, 'length': len(next(iter(encoded.values()), [])), 'columns': encoded}
+
 @router.get("/options")
 async def get_upload_options():
     """Return dropdown options for file upload"""
@@ -166,3 +1144,19 @@ async def get_upload_options():
             {"value": "custom", "label": "Custom format"}
         ]
     }
+
+@router.get("/{upload_id}", response_model=FileUploadResponse)
+async def get_upload(
+    upload_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    An upload with its stored analysis results. A preview whose full
+    analysis continues in the background is replaced by the full results
+    once they are done; until then _preview.full_analysis is 'running'.
+    """
+    db_upload = get_file_upload(db, upload_id, current_user.id)
+    if db_upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return _upload_response(db_upload, db_upload.analysis_results, db_upload.processing_error)
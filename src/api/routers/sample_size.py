@@ -1,20 +1,24 @@
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
-from services.sample_size import calculate_sample_size
-from ..schemas import SampleSizeRequest, SampleSizeResponse
+from ..schemas import SampleSizeRequest, SampleSizeResponse, PowerSimulationRequest, PowerSimulationResponse
 from ..auth import get_current_user
+from ..crud import get_file_upload
+from ..database import get_db
 from ..models import User
 
 router = APIRouter()
 
 @router.post("/sample-size", response_model=SampleSizeResponse)
-async def calculate_sample_size_endpoint(
+def calculate_sample_size_endpoint(
     request: SampleSizeRequest,
     current_user: User = Depends(get_current_user)):
     """
     Calculate required sample size for A/B test.
     Returns sample size per variant and total sample size needed.
     """
+    # scipy loads on first use; a sync endpoint does that in the thread pool
+    from services.sample_size import calculate_sample_size
+
     try:
         n_per_variant = calculate_sample_size(
             baseline_rate=request.baseline_rate,
@@ -54,6 +58,61 @@ async def calculate_sample_size_endpoint(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Calculation failed: {str(e)}")
 
+@router.post("/power-simulation", response_model=PowerSimulationResponse)
+def simulate_power_endpoint(
+    request: PowerSimulationRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)):
+    """
+    Estimate power against sample size by simulating experiments drawn from a
+    parametric distribution or a metric's per-user values from a previous
+    upload, tested like the upload analysis tests them.
+    """
+    from services.power_simulation import simulate_power, distribution_from_results
+
+    if (request.distribution is None) == (request.upload_id is None):
+        raise HTTPException(status_code=400, detail="Give either a distribution or an upload_id and metric_id")
+
+    try:
+        if request.upload_id is not None:
+            db_upload = get_file_upload(db, request.upload_id, current_user.id)
+            if db_upload is None:
+                raise HTTPException(status_code=404, detail="Upload not found")
+            analysis_results = db_upload.analysis_results or {}
+            if request.metric_id not in analysis_results or str(request.metric_id).startswith('_'):
+                raise HTTPException(status_code=404, detail=f"Metric '{request.metric_id}' not found in upload")
+            distribution = distribution_from_results(analysis_results[request.metric_id], request.variant)
+        else:
+            distribution = request.distribution
+
+        result = simulate_power(
+            distribution,
+            mde=request.mde,
+            alpha=request.alpha,
+            power=request.power,
+            sample_sizes=request.sample_sizes,
+            simulations=request.simulations,
+            seed=request.seed
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if result['sample_size_per_variant'] is None:
+        interpretation = (
+            f"None of the simulated sample sizes reaches {request.power*100:.0f}% power for a "
+            f"{request.mde*100:.1f}% change; the largest, {result['curve'][-1]['sample_size_per_variant']:,} "
+            f"users per variant, has {result['curve'][-1]['power']*100:.0f}%."
+        )
+    else:
+        interpretation = (
+            f"With {result['sample_size_per_variant']:,} users in each variant, "
+            f"{result['simulations']:,} simulated experiments detected a {request.mde*100:.1f}% change "
+            f"with at least {request.power*100:.0f}% power at a {request.alpha*100:.0f}% significance level "
+            f"(the normal approximation suggests {result['normal_approximation']:,})."
+        )
+
+    return PowerSimulationResponse(**result, interpretation=interpretation)
+
 @router.get("/sample-size/defaults")
 async def get_sample_size_defaults(
     current_user: User = Depends(get_current_user)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, field_validator
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -31,7 +31,7 @@ class FileUploadResponse(BaseModel):
     experiment_id: str
     json_filename: str
     exposures_filename: str
-    events_filename: str
+    events_filename: str | None
     users_filename: str | None
     selected_option: str
     upload_date: datetime
@@ -41,6 +41,20 @@ class FileUploadResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class RawDatasetResponse(BaseModel):
+    id: int
+    user_id: int
+    experiment_id: str
+    exposures_filename: str | None
+    events_filename: str | None
+    has_event_value: bool
+    exposures_rows: int | None
+    events_rows: int | None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
 # Sample Size Calculator Schemas
 class SampleSizeRequest(BaseModel):
     baseline_rate: float = Field(
@@ -87,3 +101,42 @@ class SampleSizeResponse(BaseModel):
     total_sample_size: int
     parameters: Dict[str, float]
     interpretation: str
+
+# Power Simulation Schemas
+class PowerSimulationRequest(BaseModel):
+    distribution: Dict[str, Any] | None = Field(
+        default=None,
+        description="Baseline per-user distribution, e.g. {'name': 'zero_inflated_lognormal', "
+                    "'zero_prob': 0.95, 'mu': 3, 'sigma': 1.5}; or use upload_id and metric_id"
+    )
+    upload_id: int | None = Field(default=None, description="Upload whose stored per-user values are the baseline")
+    metric_id: str | None = Field(default=None, description="Metric of upload_id to take the baseline from")
+    variant: str = Field(default='A', description="Variant of upload_id to take the baseline from")
+    mde: float = Field(..., gt=0, le=10, description="Minimum detectable effect as a relative change of the mean")
+    alpha: float = Field(default=0.05, gt=0, le=0.2, description="Significance level (default: 0.05)")
+    power: float = Field(default=0.80, ge=0.5, lt=1, description="Target power (default: 0.80)")
+    sample_sizes: List[int] | None = Field(
+        default=None,
+        min_length=1,
+        max_length=20,
+        description="Per-variant sample sizes to simulate (default: sizes around the normal approximation)"
+    )
+    simulations: int = Field(default=1000, ge=100, le=20000, description="Simulated experiments per sample size")
+    seed: int | None = Field(default=None, description="Random seed, for reproducible results")
+
+class PowerPoint(BaseModel):
+    sample_size_per_variant: int
+    power: float
+    power_ci: List[float]
+
+class PowerSimulationResponse(BaseModel):
+    test: str
+    distribution: str
+    baseline_mean: float
+    baseline_std: float
+    treatment_mean: float
+    simulations: int
+    curve: List[PowerPoint]
+    sample_size_per_variant: int | None
+    normal_approximation: int
+    interpretation: str
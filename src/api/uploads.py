@@ -0,0 +1,74 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from fastapi import HTTPException, UploadFile, status
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", 2 * 1024 ** 3))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", 4 * 1024 ** 3))
+
+
+class SpooledUpload:
+    """An uploaded file written to disk, with its size and content hash"""
+
+    def __init__(self, path: str, filename: str, size: int, sha256: str):
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+
+
+class UploadSpool:
+    """
+    Per-request scratch directory under UPLOAD_DIR that uploads are streamed
+    into in fixed-size chunks. Per-file and per-request byte limits are
+    enforced while streaming; the directory is removed on exit.
+    """
+
+    def __init__(self, directory: str = UPLOAD_DIR,
+                 max_file_bytes: int = MAX_UPLOAD_FILE_BYTES,
+                 max_request_bytes: int = MAX_UPLOAD_REQUEST_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix="upload_", dir=directory)
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+        self.total_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _too_large(self, detail: str):
+        return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+
+    async def add(self, name: str, upload: UploadFile) -> SpooledUpload:
+        """Stream one upload to disk as <name><ext>, hashing it on the way"""
+        filename = upload.filename or name
+        limit_detail = f"File '{filename}' exceeds the {self.max_file_bytes:,} byte limit"
+        if upload.size is not None and upload.size > self.max_file_bytes:
+            raise self._too_large(limit_detail)
+
+        suffix = os.path.splitext(filename)[1]
+        path = os.path.join(self.path, name + suffix)
+        hasher = hashlib.sha256()
+        size = 0
+
+        with open(path, 'wb') as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                self.total_bytes += len(chunk)
+                if size > self.max_file_bytes:
+                    raise self._too_large(limit_detail)
+                if self.total_bytes > self.max_request_bytes:
+                    raise self._too_large(f"Upload exceeds the {self.max_request_bytes:,} byte request limit")
+                hasher.update(chunk)
+                out.write(chunk)
+
+        return SpooledUpload(path=path, filename=filename, size=size, sha256=hasher.hexdigest())
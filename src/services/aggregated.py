@@ -0,0 +1,182 @@
+"""
+Analysis from pre-aggregated inputs.
+
+Instead of raw exposure and event rows, the warehouse can send one of
+  - a per-user metric table ('users'): one row per exposed user with
+    user_id, variant, exposure_time and a column per metric_id holding the
+    user's in-window metric value (0 for users without events), or
+  - per-bucket sufficient statistics ('buckets'): one row per metric,
+    exposure bucket and variant with metric_id, date, variant, n, sum, sum_sq
+    over the users exposed in that bucket.
+Both feed the stat tests and time-series builders directly, without the
+exposure/event window join. An optional experiment_id column is filtered on.
+Quantile metrics need raw event values and are not supported; the
+distribution chart needs user-level values and is skipped for buckets.
+"""
+import pandas as pd
+
+from .metric_analysis import _choose_time_unit, _exposure_span
+from .stat_tests import run_stat_tests, run_stat_tests_from_summary, sample_ratio_check
+from .analysis import (
+    _bucket_sections,
+    _metric_sections,
+    assignment_check,
+    report_metric_done,
+    apply_correction_to_results,
+)
+from .instrumentation import timed
+from .options import AGGREGATED_INPUT_MODES, ANALYSIS_SECTIONS, BUCKET_SECTIONS
+
+USER_TABLE_COLUMNS = ['user_id', 'variant', 'exposure_time']
+BUCKET_TABLE_COLUMNS = ['metric_id', 'date', 'variant', 'n', 'sum', 'sum_sq']
+
+
+def _check_metrics(metrics_config: dict):
+    quantile = [str(m.get('metric_id')) for m in metrics_config.values() if m.get('aggregation') == 'quantile']
+    if quantile:
+        raise ValueError(f"Quantile metrics need raw event values and can't use aggregated input: {', '.join(quantile)}")
+
+
+def aggregated_columns(input_mode: str, metrics_config: dict) -> list:
+    """
+    Columns an aggregated table of input_mode must have for these metrics.
+    Raises ValueError for an unknown mode or metrics it can't serve.
+    """
+    _check_metrics(metrics_config)
+    if input_mode == 'users':
+        return USER_TABLE_COLUMNS + [metric_config['metric_id'] for metric_config in metrics_config.values()]
+    if input_mode == 'buckets':
+        return BUCKET_TABLE_COLUMNS
+    raise ValueError(f"Unknown input mode '{input_mode}'. Choose one of: {', '.join(AGGREGATED_INPUT_MODES)}")
+
+
+def _experiment_rows(table: pd.DataFrame, experiment_id) -> pd.DataFrame:
+    if 'experiment_id' in table.columns:
+        table = table[table['experiment_id'].astype(str) == str(experiment_id)]
+    if table.empty:
+        raise ValueError(f"No rows found for experiment_id: {experiment_id}")
+    return table
+
+
+def _selected_sections(sections):
+    return ANALYSIS_SECTIONS if sections is None else tuple(s for s in ANALYSIS_SECTIONS if s in sections)
+
+
+def _collect_results(metric_configs: list, analyses: list, assignment: dict, apply_correction: bool,
+                     sections, computed, unavailable=()) -> dict:
+    """Results keyed by metric_id, corrected like analyze_prepared_experiment's"""
+    results = {}
+    p_values = []
+    metric_ids = []
+    for metric_config, analysis in zip(metric_configs, analyses):
+        metric_ids.append(metric_config['metric_id'])
+        p_values.append(analysis['p-value'])
+        results[metric_config['metric_id']] = analysis
+
+    results['_assignment_check'] = assignment
+
+    if sections is not None or unavailable:
+        results['_sections_info'] = {
+            'computed': list(computed),
+            'skipped': [s for s in ANALYSIS_SECTIONS if s not in computed and s not in unavailable],
+            'unavailable': list(unavailable),
+        }
+
+    return apply_correction_to_results(results, p_values, metric_ids, apply_correction)
+
+
+def run_user_table_analysis(experiment_id, user_table: pd.DataFrame, metrics_config: dict, apply_correction=True,
+                            max_points=None, sections=None) -> dict:
+    """
+    run_experiment_analysis from a per-user metric table: each metric column
+    is the metric_users table the window join would have produced.
+    """
+    _check_metrics(metrics_config)
+    metric_configs = list(metrics_config.values())
+    selected = _selected_sections(sections)
+
+    with timed('prepare'):
+        users = _experiment_rows(user_table, experiment_id)
+        users = users.assign(exposure_time=pd.to_datetime(users['exposure_time']))
+        variants = sorted(users['variant'].dropna().unique().tolist())
+        exposure_span = _exposure_span(users)
+
+    analyses = []
+    for index, metric_config in enumerate(metric_configs, start=1):
+        agg_type = metric_config['aggregation']
+        metric_df = users[USER_TABLE_COLUMNS].assign(
+            metric_value=pd.to_numeric(users[metric_config['metric_id']], errors='coerce').fillna(0.0)
+        )
+        with timed('stats', agg_type):
+            analysis = run_stat_tests(metric_df, metric_config)
+        time_unit = _choose_time_unit(metric_config, exposure_span)
+        analysis.update(_metric_sections(metric_df, metric_config, variants, time_unit, selected, max_points))
+        report_metric_done(index, len(metric_configs), metric_config, analysis)
+        analyses.append(analysis)
+
+    return _collect_results(metric_configs, analyses, assignment_check(users), apply_correction, sections, selected)
+
+
+def _rebucket(bucket_stats: pd.DataFrame, metric_config: dict):
+    """
+    A metric's bucket statistics at the time unit the raw analysis would
+    chart it with. Buckets are only merged, never split: input coarser than
+    that unit is kept as it is.
+    """
+    dates = pd.Series(bucket_stats['date'].unique()).sort_values()
+    time_unit = _choose_time_unit(metric_config, dates.max() - dates.min())
+    granularity = dates.diff().min() if len(dates) > 1 else None
+    if granularity is not None and granularity >= pd.Timedelta(time_unit):
+        return bucket_stats, granularity
+
+    rebucketed = (
+        bucket_stats.assign(date=bucket_stats['date'].dt.floor(time_unit))
+        .groupby(['date', 'variant'], as_index=False)[['n', 'sum', 'sum_sq']]
+        .sum()
+    )
+    return rebucketed, time_unit
+
+
+def run_bucket_table_analysis(experiment_id, bucket_table: pd.DataFrame, metrics_config: dict, apply_correction=True,
+                              max_points=None, sections=None) -> dict:
+    """
+    run_experiment_analysis from per-bucket sufficient statistics: the stat
+    test runs on their per-variant totals, the time series on the buckets.
+    """
+    _check_metrics(metrics_config)
+    metric_configs = list(metrics_config.values())
+    selected = tuple(s for s in _selected_sections(sections) if s in BUCKET_SECTIONS)
+
+    with timed('prepare'):
+        buckets = _experiment_rows(bucket_table, experiment_id)
+        buckets = buckets.assign(
+            metric_id=buckets['metric_id'].astype(str),
+            date=pd.to_datetime(buckets['date']),
+            **{column: pd.to_numeric(buckets[column], errors='coerce').fillna(0) for column in ('n', 'sum', 'sum_sq')}
+        )
+        variants = sorted(buckets['variant'].dropna().unique().tolist())
+
+    analyses = []
+    for index, metric_config in enumerate(metric_configs, start=1):
+        agg_type = metric_config['aggregation']
+        metric_buckets = buckets[buckets['metric_id'] == metric_config['metric_id']]
+        if metric_buckets.empty:
+            raise ValueError(f"No bucket statistics for metric '{metric_config['metric_id']}'")
+
+        with timed('stats', agg_type):
+            summary = metric_buckets.groupby('variant')[['n', 'sum', 'sum_sq']].sum()
+            analysis = run_stat_tests_from_summary(summary, metric_config)
+        bucket_stats, time_unit = _rebucket(metric_buckets[['date', 'variant', 'n', 'sum', 'sum_sq']], metric_config)
+        analysis.update(_bucket_sections(bucket_stats, metric_config, variants, time_unit, selected, max_points))
+        report_metric_done(index, len(metric_configs), metric_config, analysis)
+        analyses.append(analysis)
+
+    # every metric covers the same exposed users; the first one's counts give the assignment
+    first = buckets[buckets['metric_id'] == metric_configs[0]['metric_id']]
+    variant_users = first.groupby('variant')['n'].sum()
+    assignment = sample_ratio_check({variant: int(n) for variant, n in variant_users.items()})
+    assignment['users'] = int(variant_users.sum())
+
+    # user-level values are needed for the distribution chart
+    unavailable = ('distribution',) if 'distribution' in _selected_sections(sections) else ()
+    return _collect_results(metric_configs, analyses, assignment, apply_correction, sections, selected, unavailable)
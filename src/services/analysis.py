@@ -1,19 +1,47 @@
 import pandas as pd
 from .metric_analysis import (
-    analyze_metric,
-    analyze_metric_timeseries_exposed_daily,
-    analyze_metric_timeseries_exposed_cumulative,
-    analyze_metric_distribution,
-    analyze_relative_lift_timeseries,
-    analyze_ci_timeseries,
+    first_exposures,
+    plan_event_groups,
+    metric_window,
+    windowed_user_tables,
+    windowed_joins,
+    metric_users,
+    user_bucket_stats,
+    daily_from_bucket_stats,
+    cumulative_from_daily,
+    distribution_from_metric_users,
+    relative_lift_from_cumulative,
+    ci_timeseries_from_bucket_stats,
+    quantile_bucket_bins,
+    quantile_user_values,
+    quantile_timeseries_from_bins,
+    quantile_ci_timeseries_from_bins,
+    quantile_distribution_from_bins,
+    _exposure_span,
     _choose_time_unit,
 )
-from .stat_tests import run_stat_tests
+from .stat_tests import run_stat_tests, sample_ratio_check
+from .segments import (
+    segment_stats,
+    segment_bins,
+    segment_tests,
+    quantile_segment_tests,
+    segment_attributes,
+    user_segments,
+    apply_segment_corrections,
+)
+from .instrumentation import timed
+from .downsample import series_records
+from .progress import report_progress
+from .options import ANALYSIS_SECTIONS, BUCKET_SECTIONS, SECTION_RESULT_KEYS
+
 
-def run_experiment_analysis(experiment_id, exposures_df, events_df, metrics_config, apply_correction=True):
+def prepare_experiment_data(experiment_id, exposures_df, events_df, metrics_config):
     """
-    Analysis of user uploaded data (validated) - for every metric.
-    Perform appropriate statistical tests and return results.
+    Prepared dataset for one experiment: its first-exposure table (one row
+    per user, see first_exposures) and only the events the metrics refer to,
+    with parsed times and numeric values. Any metric or section can be
+    (re)computed from it.
     """
     exp_exposures = exposures_df[exposures_df['experiment_id'].astype(str) == str(experiment_id)].copy()
     
@@ -21,43 +49,327 @@ def run_experiment_analysis(experiment_id, exposures_df, events_df, metrics_conf
         raise ValueError(f"No exposure data found for experiment_id: {experiment_id}")
     
     exp_exposures['exposure_time'] = pd.to_datetime(exp_exposures['exposure_time'])
-    
+    with timed('first_exposures'):
+        exp_exposures = first_exposures(exp_exposures[['user_id', 'experiment_id', 'variant', 'exposure_time']])
+
+    event_names = {metric_config['event']['name'] for metric_config in metrics_config.values()}
+    event_columns = ['user_id', 'event_name', 'event_time'] + (['event_value'] if 'event_value' in events_df.columns else [])
+    events = events_df.loc[events_df['event_name'].isin(event_names), event_columns].copy()
+    events['event_time'] = pd.to_datetime(events['event_time'])
+    if 'event_value' in events.columns:
+        events['event_value'] = pd.to_numeric(events['event_value'], errors='coerce')
+
+    return exp_exposures, events
+
+
+def assignment_check(exp_exposures):
+    """
+    Sample ratio mismatch check over users per assigned variant, plus how
+    many users were exposed to more than one variant or more than once.
+    """
+    result = sample_ratio_check(exp_exposures['variant'].value_counts().to_dict())
+    result['users'] = len(exp_exposures)
+    if 'multi_variant' in exp_exposures.columns:
+        result['multi_variant_users'] = int(exp_exposures['multi_variant'].sum())
+        result['repeat_exposures'] = int(exp_exposures['exposure_count'].sum() - len(exp_exposures))
+    return result
+
+
+def metric_summary(analysis: dict) -> dict:
+    """A metric's stat test results without its chart sections"""
+    sections = set(SECTION_RESULT_KEYS.values())
+    return {key: value for key, value in analysis.items() if key not in sections}
+
+
+def report_metric_done(index: int, total: int, metric_config: dict, analysis: dict):
+    """Progress report for a finished metric, with its uncorrected summary"""
+    report_progress(
+        'metric', index=index, total=total,
+        metric_id=metric_config['metric_id'], summary=metric_summary(analysis)
+    )
+
+
+def _quantile_sections(exp_exposures, user_values, metric_config, time_unit, sections, max_points=None):
+    """Chart sections of a quantile metric, all derived from per-bucket sketches of its user values"""
+    with timed('daily', metric_config['aggregation']):
+        daily_exposed, bins, variants = quantile_bucket_bins(exp_exposures, user_values, time_unit)
+    return _quantile_bin_sections(daily_exposed, bins, variants, metric_config, time_unit, sections, max_points)
+
+
+def _quantile_bin_sections(daily_exposed, bins, variants, metric_config, time_unit, sections, max_points=None):
+    """Chart sections of a quantile metric from quantile_bucket_bins' output"""
+    agg_type = metric_config['aggregation']
+    analysis = {}
+
+    with timed('daily', agg_type):
+        daily_df, cumulative_df = quantile_timeseries_from_bins(daily_exposed, bins, variants, time_unit, metric_config)
+        if 'daily' in sections:
+            analysis['daily_timeseries'] = series_records(daily_df, max_points)
+
+    if 'cumulative' in sections:
+        with timed('cumulative', agg_type):
+            analysis['cumulative_timeseries'] = series_records(cumulative_df, max_points)
+
+    if 'distribution' in sections:
+        with timed('distribution', agg_type):
+            # sketches merge by adding counts, so per-bucket sketches roll up per variant
+            variant_bins = bins.groupby(['variant', 'key'], as_index=False)['count'].sum()
+            analysis['distribution'] = quantile_distribution_from_bins(variant_bins, variants, metric_config)
+
+    if 'lift' in sections:
+        with timed('lift', agg_type):
+            lift_df = relative_lift_from_cumulative(cumulative_df)
+            analysis['lift_timeseries'] = series_records(lift_df, max_points, y='lift', by=None)
+
+    if 'ci' in sections:
+        with timed('ci', agg_type):
+            ci_df = quantile_ci_timeseries_from_bins(bins, sorted(daily_df['date'].unique()), variants, metric_config)
+            analysis['ci_timeseries'] = series_records(ci_df, max_points)
+
+    return analysis
+
+
+def _bucket_sections(bucket_stats, metric_config, variants, time_unit, sections, max_points=None):
+    """
+    daily, cumulative, lift and ci sections of a binary/sum/count metric from
+    its per-bucket sufficient statistics (see user_bucket_stats).
+    """
+    agg_type = metric_config['aggregation']
+    analysis = {}
+
+    if set(sections) & set(BUCKET_SECTIONS):
+        with timed('daily', agg_type):
+            daily_df = daily_from_bucket_stats(bucket_stats, variants, time_unit)
+            if 'daily' in sections:
+                analysis['daily_timeseries'] = series_records(daily_df, max_points)
+
+        with timed('cumulative', agg_type):
+            cumulative_df = cumulative_from_daily(daily_df)
+            if 'cumulative' in sections:
+                analysis['cumulative_timeseries'] = series_records(cumulative_df, max_points)
+
+    if 'lift' in sections:
+        with timed('lift', agg_type):
+            lift_df = relative_lift_from_cumulative(cumulative_df)
+            analysis['lift_timeseries'] = series_records(lift_df, max_points, y='lift', by=None)
+
+    if 'ci' in sections:
+        with timed('ci', agg_type):
+            ci_df = ci_timeseries_from_bucket_stats(bucket_stats, sorted(daily_df['date'].unique()), variants, agg_type)
+            analysis['ci_timeseries'] = series_records(ci_df, max_points)
+
+    return analysis
+
+
+def _metric_sections(metric_df, metric_config, variants, time_unit, sections, max_points=None):
+    """
+    Chart sections of a binary/sum/count metric from its user-level table
+    (see metric_users). daily, cumulative, lift and ci all derive from one
+    per-bucket aggregation.
+    """
+    agg_type = metric_config['aggregation']
+
+    bucket_stats = None
+    if set(sections) & set(BUCKET_SECTIONS):
+        with timed('bucket_stats', agg_type):
+            bucket_stats = user_bucket_stats(metric_df, time_unit)
+    analysis = _bucket_sections(bucket_stats, metric_config, variants, time_unit, sections, max_points)
+
+    if 'distribution' in sections:
+        with timed('distribution', agg_type):
+            analysis['distribution'] = distribution_from_metric_users(metric_df, agg_type)
+
+    return analysis
+
+
+def _quantile_sample_key(metric_config) -> tuple:
+    """Quantile metrics with the same window and user_value share one user-values sample"""
+    return metric_window(metric_config), metric_config.get('user_value', 'sum')
+
+
+def analyze_metric_group(exp_exposures, events_df, metric_configs, max_points=None, sections=ANALYSIS_SECTIONS,
+                         stats=True, segments=None):
+    """
+    Stat test (unless stats is False) plus the requested chart sections for
+    metrics sharing an event (see plan_event_groups). User-level tables of
+    all the group's windows come from one pass over the event's rows, and
+    quantile metrics' in-window rows from one join; every metric's results
+    derive from its window's share. Given a user_segments table, each metric
+    also gets uncorrected per-segment tests under 'segments'. Returns one
+    analysis per metric config.
+    """
+    event_name = metric_configs[0]['event']['name']
+    value_windows, quantile_windows = {}, {}
+    for metric_config in metric_configs:
+        windows = quantile_windows if metric_config['aggregation'] == 'quantile' else value_windows
+        windows.setdefault(metric_window(metric_config), set()).add(metric_config['aggregation'])
+
+    with timed('join'):
+        # user-level tables come from the fused kernel; only quantile metrics need the in-window event rows
+        user_tables = dict(zip(value_windows, windowed_user_tables(exp_exposures, events_df, event_name, list(value_windows)))) if value_windows else {}
+        in_windows = dict(zip(quantile_windows, windowed_joins(exp_exposures, events_df, event_name, list(quantile_windows)))) if quantile_windows else {}
+        # quantile samples by window and per-user reduction, shared by metrics with both in common
+        user_values = {}
+        for metric_config in metric_configs:
+            if metric_config['aggregation'] == 'quantile':
+                key = _quantile_sample_key(metric_config)
+                if key not in user_values:
+                    user_values[key] = quantile_user_values(in_windows[key[0]], metric_config)
+
+    if segments is not None:
+        with timed('segments'):
+            stats_by_segment = {
+                window: segment_stats(user_tables[window], segments, sorted(aggregations))
+                for window, aggregations in value_windows.items()
+            }
+            bins_by_segment = {key: segment_bins(values, segments) for key, values in user_values.items()}
+
+    variants = sorted(exp_exposures['variant'].dropna().unique().tolist())
+    exposure_span = _exposure_span(exp_exposures)
+
+    analyses = []
+    for metric_config in metric_configs:
+        agg_type = metric_config['aggregation']
+        window = metric_window(metric_config)
+        time_unit = _choose_time_unit(metric_config, exposure_span)
+        analysis = {}
+
+        if agg_type == 'quantile':
+            values = user_values[_quantile_sample_key(metric_config)]
+            if stats:
+                with timed('stats', agg_type):
+                    analysis = run_stat_tests(values, metric_config)
+            analysis.update(_quantile_sections(exp_exposures, values, metric_config, time_unit, sections, max_points))
+        else:
+            metric_df = metric_users(user_tables[window], agg_type)
+            if stats:
+                with timed('stats', agg_type):
+                    analysis = run_stat_tests(metric_df, metric_config)
+            analysis.update(_metric_sections(metric_df, metric_config, variants, time_unit, sections, max_points))
+
+        if segments is not None:
+            with timed('segments', agg_type):
+                analysis['segments'] = (
+                    quantile_segment_tests(bins_by_segment[_quantile_sample_key(metric_config)], segments, metric_config)
+                    if agg_type == 'quantile'
+                    else segment_tests(stats_by_segment[window], metric_config)
+                )
+
+        analyses.append(analysis)
+    return analyses
+
+
+def analyze_metric_sections(exp_exposures, events_df, metric_config, sections=ANALYSIS_SECTIONS, max_points=None):
+    """
+    Chart sections for one metric, keyed like the analysis result
+    (daily_timeseries, distribution, ...). With max_points, each series is
+    LTTB-downsampled to at most that many points per variant.
+    """
+    return analyze_metric_group(exp_exposures, events_df, [metric_config], max_points, sections, stats=False)[0]
+
+
+def analyze_single_metric(exp_exposures, events_df, metric_config, max_points=None, sections=ANALYSIS_SECTIONS):
+    """
+    Stat test plus the requested chart sections for one metric. Metrics are
+    independent of each other until the multiple-testing correction.
+    """
+    return analyze_metric_group(exp_exposures, events_df, [metric_config], max_points, sections)[0]
+
+
+def run_experiment_analysis(experiment_id, exposures_df, events_df, metrics_config, apply_correction=True, max_workers=None, max_points=None, sections=None,
+                            users_df=None, segment_by=None):
+    """
+    Analysis of user uploaded data (validated) - for every metric.
+    Perform appropriate statistical tests and return results.
+
+    With more than one worker available, metrics are analyzed in parallel
+    across a process pool (see services.parallel); max_workers overrides
+    ANALYSIS_WORKERS. max_points optionally downsamples every chart series
+    before serialization. sections limits the chart sections computed
+    (default: all of ANALYSIS_SECTIONS); an empty list gives a summary only.
+    With users_df, every metric is also broken down by the user attributes
+    in segment_by (default: all of the file's attribute columns).
+    """
+    exp_exposures, events = prepare_experiment_data(experiment_id, exposures_df, events_df, metrics_config)
+    segments = prepare_segments(exp_exposures, users_df, segment_by) if users_df is not None else None
+    return analyze_prepared_experiment(
+        exp_exposures, events, metrics_config, apply_correction, max_workers, max_points, sections, segments
+    )
+
+
+def prepare_segments(exp_exposures, users_df, segment_by=None):
+    """User attributes joined onto the first-exposure table once (see user_segments)"""
+    with timed('segments'):
+        return user_segments(exp_exposures, users_df, segment_attributes(users_df.columns, segment_by))
+
+
+def analyze_prepared_experiment(exp_exposures, events_df, metrics_config, apply_correction=True, max_workers=None, max_points=None, sections=None,
+                                segments=None):
+    """
+    run_experiment_analysis over a dataset from prepare_experiment_data,
+    with an optional user_segments table from prepare_segments.
+    """
+    metric_configs = list(metrics_config.values())
+    selected = ANALYSIS_SECTIONS if sections is None else tuple(s for s in ANALYSIS_SECTIONS if s in sections)
+
+    # metrics on one event are analyzed together, all their windows in one pass
+    groups = plan_event_groups(metric_configs)
+
+    from .parallel import should_parallelize, analyze_metrics_parallel
+    if should_parallelize(groups, events_df, max_workers):
+        analyses = analyze_metrics_parallel(
+            exp_exposures, events_df, metric_configs, groups, max_workers, max_points, selected, segments
+        )
+    else:
+        analyses = [None] * len(metric_configs)
+        done = 0
+        for group in groups:
+            group_configs = [metric_configs[position] for position in group]
+            group_analyses = analyze_metric_group(
+                exp_exposures, events_df, group_configs, max_points, selected, segments=segments
+            )
+            for position, analysis in zip(group, group_analyses):
+                done += 1
+                report_metric_done(done, len(metric_configs), metric_configs[position], analysis)
+                analyses[position] = analysis
+
+    return _experiment_results(
+        metric_configs, analyses, assignment_check(exp_exposures), apply_correction, sections, selected, segments
+    )
+
+
+def _experiment_results(metric_configs, analyses, assignment, apply_correction=True, sections=None,
+                        selected=ANALYSIS_SECTIONS, segments=None):
+    """Per-metric analyses keyed by metric_id with the assignment check, sections info and correction"""
     results = {}
     p_values = []
     metric_ids = []
-    
-    for _, metric_config in metrics_config.items():
+
+    for metric_config, analysis in zip(metric_configs, analyses):
         metric_id = metric_config['metric_id']
         metric_ids.append(metric_id)
-
-        # User-level analysis for stats
-        metric_df = analyze_metric(exp_exposures, events_df, metric_config)
-        analysis = run_stat_tests(metric_df, metric_config)
-        
         p_values.append(analysis['p-value'])
-
-        # Exposed-based daily time series
-        daily_df = analyze_metric_timeseries_exposed_daily(exp_exposures, events_df, metric_config)
-        analysis['daily_timeseries'] = daily_df.to_dict('records')
-        
-        # Exposed-based cumulative time series
-        cumulative_df = analyze_metric_timeseries_exposed_cumulative(exp_exposures, events_df, metric_config)
-        analysis['cumulative_timeseries'] = cumulative_df.to_dict('records')
-        
-        # Distribution analysis
-        distribution_data = analyze_metric_distribution(exp_exposures, events_df, metric_config)
-        analysis['distribution'] = distribution_data
-        
-        # Relative lift over time
-        lift_df = analyze_relative_lift_timeseries(exp_exposures, events_df, metric_config)
-        analysis['lift_timeseries'] = lift_df.to_dict('records')
-        
-        # Confidence intervals over time
-        ci_df = analyze_ci_timeseries(exp_exposures, events_df, metric_config)
-        analysis['ci_timeseries'] = ci_df.to_dict('records')
-        
         results[metric_id] = analysis
+
+    results['_assignment_check'] = assignment
+
+    if segments is not None:
+        apply_segment_corrections(results, metric_ids, pd.unique(segments['attribute']).tolist(), apply_correction)
+
+    if sections is not None:
+        results['_sections_info'] = {
+            'computed': list(selected),
+            'skipped': [s for s in ANALYSIS_SECTIONS if s not in selected],
+        }
     
+    return apply_correction_to_results(results, p_values, metric_ids, apply_correction)
+
+
+def apply_correction_to_results(results, p_values, metric_ids, apply_correction=True):
+    """
+    Apply Benjamini-Hochberg across metric p-values (3+ metrics) and record
+    what was done under results['_correction_info'].
+    """
     should_correct = apply_correction and len(p_values) >= 3
 
     if should_correct:
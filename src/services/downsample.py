@@ -0,0 +1,74 @@
+"""
+Shape-preserving downsampling of chart series (Largest-Triangle-Three-Buckets).
+"""
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Indices of the n_out points LTTB keeps from (x, y), sorted by x.
+    The first and last points are always kept.
+    """
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])[:max(n_out, 0)]
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # split the interior points into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket (or the last point for the final bucket)
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        area = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+
+    return selected
+
+
+def downsample_series(df: pd.DataFrame, max_points: int, x: str = 'date', y: str = 'metric_value', by: str | None = 'variant') -> pd.DataFrame:
+    """
+    Keep at most max_points rows per `by` group of a time series frame,
+    chosen with LTTB on (x, y).
+    """
+    if df.empty or max_points is None:
+        return df
+
+    groups = [df] if by is None or by not in df.columns else [group for _, group in df.groupby(by, sort=False)]
+    kept = []
+    for group in groups:
+        group = group.sort_values(x)
+        if len(group) <= max_points:
+            kept.append(group)
+            continue
+        x_values = group[x]
+        if not pd.api.types.is_numeric_dtype(x_values):
+            x_values = pd.to_datetime(x_values).astype('int64')
+        y_values = pd.to_numeric(group[y], errors='coerce').fillna(0.0).to_numpy()
+        kept.append(group.iloc[lttb_indices(x_values.to_numpy(), y_values, max_points)])
+
+    # restore the input's row order
+    return pd.concat(kept).sort_index()
+
+
+def series_records(df: pd.DataFrame, max_points: int | None = None, y: str = 'metric_value', by: str | None = 'variant') -> list:
+    """Series rows as records, LTTB-downsampled to max_points per series when set"""
+    if max_points:
+        df = downsample_series(df, max_points, y=y, by=by)
+    return df.to_dict('records')
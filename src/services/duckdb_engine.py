@@ -0,0 +1,660 @@
+"""
+Out-of-core analysis engine.
+
+Expresses the exposure/event window join and the binary/sum/count
+aggregations of metric_analysis as SQL over the uploaded files, executed by
+embedded DuckDB. DuckDB streams the files and spills intermediate state to
+disk once `memory_limit` is reached, so only per-variant and per-bucket
+aggregates (plus a bounded sample of user-level values for the distribution
+chart) are ever materialized in pandas. Quantile metrics come back as
+sketch bin counts (see services.sketches).
+"""
+import os
+import numpy as np
+import pandas as pd
+import duckdb
+from pandas.tseries.frequencies import to_offset
+
+from .metric_analysis import (
+    plan_metric_groups,
+    _choose_time_unit,
+    daily_from_bucket_stats,
+    cumulative_from_daily,
+    relative_lift_from_cumulative,
+    ci_timeseries_from_bucket_stats,
+    quantile_timeseries_from_bins,
+    quantile_ci_timeseries_from_bins,
+    quantile_distribution_from_bins,
+    quantile_user_value,
+)
+from .sketches import QuantileSketch, collapse_bins, LOG_GAMMA, KEY_BIAS, MIN_INDEXABLE_VALUE
+from .stat_tests import run_stat_tests_from_summary, run_quantile_test, sample_ratio_check
+from .segments import (
+    SEGMENT_KEYS,
+    SEGMENT_MAX_LEVELS,
+    MISSING_SEGMENT,
+    OTHER_SEGMENT,
+    segment_attributes,
+    segment_tests,
+    quantile_segment_tests,
+    apply_segment_corrections,
+)
+from .analysis import apply_correction_to_results, report_metric_done
+from .instrumentation import timed
+from .load import CSV_COMPRESSION, sniff_format
+from .downsample import series_records
+from .options import ANALYSIS_SECTIONS
+
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "1GB")
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", 0))
+
+# Upper bound on user-level values returned for the distribution histogram
+DISTRIBUTION_SAMPLE_SIZE = 10_000
+
+# SQL aggregate of each quantile user_value (see quantile_user_values)
+USER_VALUE_AGGREGATES = {'sum': 'SUM', 'mean': 'AVG'}
+
+
+def _quote(value: str) -> str:
+    """Quote a string literal for inlining into SQL"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _scan(con, path: str) -> str:
+    """
+    SQL relation scanning an uploaded file, chosen by sniffing its format.
+    Parquet and CSV are read by DuckDB itself, which pushes projections and
+    filters into the scan; Arrow IPC files are registered as a pyarrow
+    dataset over the memory-mapped file, which DuckDB pushes them into too.
+    """
+    file_format = sniff_format(path)
+    if file_format == 'parquet':
+        return f"read_parquet({_quote(path)})"
+    if file_format in ('arrow', 'arrow_stream'):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        if file_format == 'arrow':
+            data = ds.dataset(path, format='ipc')
+        else:
+            data = pa.ipc.open_stream(pa.memory_map(path)).read_all()
+        name = 'arrow_' + os.path.splitext(os.path.basename(path))[0]
+        con.register(name, data)
+        return name
+    compression = CSV_COMPRESSION[file_format]
+    options = f", compression={_quote(compression)}" if compression else ''
+    return f"read_csv({_quote(path)}, header=true{options})"
+
+
+def _interval(value) -> str:
+    """SQL interval literal for a window bound such as '0h' or '7d'"""
+    return f"INTERVAL '{pd.Timedelta(value).total_seconds()} seconds'"
+
+
+def _bucket(column: str, time_unit: str) -> str:
+    """SQL expression flooring a timestamp to time_unit, aligned like pandas' dt.floor"""
+    seconds = to_offset(time_unit).nanos / 1e9
+    return f"time_bucket(INTERVAL '{seconds} seconds', {column}, TIMESTAMP '1970-01-01')"
+
+
+def connect(temp_directory: str | None = None, memory_limit: str | None = None):
+    """Open an in-memory DuckDB connection that spills to temp_directory"""
+    con = duckdb.connect(database=':memory:')
+    con.execute(f"SET memory_limit = {_quote(memory_limit or DUCKDB_MEMORY_LIMIT)}")
+    con.execute("SET preserve_insertion_order = false")
+    if temp_directory:
+        con.execute(f"SET temp_directory = {_quote(temp_directory)}")
+    if DUCKDB_THREADS > 0:
+        con.execute(f"SET threads = {DUCKDB_THREADS}")
+    return con
+
+
+def file_columns(con, path: str) -> list:
+    """Column names of an uploaded file without reading its rows"""
+    return [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {_scan(con, path)}").fetchall()]
+
+
+def experiment_ids(con, path: str) -> list:
+    """Distinct experiment ids present in an exposures file"""
+    rows = con.execute(
+        f"SELECT DISTINCT CAST(experiment_id AS VARCHAR) FROM {_scan(con, path)} ORDER BY 1"
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _register_inputs(con, experiment_id, exposures_path: str, events_path: str):
+    """
+    Materialize the experiment's first-exposure table (one row per user, see
+    metric_analysis.first_exposures) and expose events as a view over the
+    file, so event scans stream and filters are pushed down.
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE exposures AS
+        WITH raw AS (
+            SELECT
+                user_id,
+                CAST(variant AS VARCHAR) AS variant,
+                CAST(exposure_time AS TIMESTAMP) AS exposure_time
+            FROM {_scan(con, exposures_path)}
+            WHERE CAST(experiment_id AS VARCHAR) = {_quote(experiment_id)}
+        )
+        SELECT
+            user_id,
+            first(variant ORDER BY exposure_time, variant) AS variant,
+            MIN(exposure_time) AS exposure_time,
+            COUNT(*) AS exposure_count,
+            COUNT(DISTINCT variant) > 1 AS multi_variant
+        FROM raw
+        GROUP BY user_id
+    """)
+
+    event_value = (
+        "TRY_CAST(event_value AS DOUBLE)"
+        if 'event_value' in file_columns(con, events_path) else "CAST(NULL AS DOUBLE)"
+    )
+    con.execute(f"""
+        CREATE OR REPLACE TEMP VIEW events AS
+        SELECT
+            user_id,
+            CAST(event_name AS VARCHAR) AS event_name,
+            CAST(event_time AS TIMESTAMP) AS event_time,
+            {event_value} AS event_value
+        FROM {_scan(con, events_path)}
+    """)
+
+
+def _in_window_sql(metric_config: dict) -> str:
+    """Windowed event/exposure join for one metric (see _filter_events_by_metric)"""
+    return f"""
+        SELECT
+            e.user_id,
+            x.variant,
+            x.exposure_time,
+            e.event_time,
+            e.event_value
+        FROM events e
+        JOIN exposures x ON e.user_id = x.user_id
+        WHERE e.event_name = {_quote(metric_config['event']['name'])}
+          AND e.event_time - x.exposure_time >= {_interval(metric_config['window']['start'])}
+          AND e.event_time - x.exposure_time <= {_interval(metric_config['window']['end'])}
+    """
+
+
+def _register_metric_group(con, metric_configs: list):
+    """
+    Windowed join and user-level table (see user_metric_table) shared by
+    metrics with the same event and window, kept inside DuckDB:
+      group_events: user_id, variant, exposure_time, event_time, event_value
+      group_users: user_id, variant, exposure_time, binary, count, sum
+    The join is materialized only when quantile metrics read it again.
+    """
+    kind = 'TABLE' if any(m['aggregation'] == 'quantile' for m in metric_configs) else 'VIEW'
+    existing = con.execute(
+        "SELECT table_type FROM information_schema.tables WHERE table_name = 'group_events'"
+    ).fetchone()
+    if existing is not None:
+        con.execute(f"DROP {'VIEW' if existing[0] == 'VIEW' else 'TABLE'} group_events")
+    con.execute(f"CREATE TEMP {kind} group_events AS {_in_window_sql(metric_configs[0])}")
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE group_users AS
+        WITH per_user AS (
+            SELECT user_id, COUNT(*) AS count, SUM(event_value) AS sum
+            FROM group_events
+            GROUP BY user_id
+        )
+        SELECT
+            x.user_id,
+            x.variant,
+            x.exposure_time,
+            CASE WHEN p.count > 0 THEN 1.0 ELSE 0.0 END AS "binary",
+            CAST(COALESCE(p.count, 0) AS DOUBLE) AS "count",
+            COALESCE(p.sum, 0.0) AS "sum"
+        FROM exposures x
+        LEFT JOIN per_user p ON x.user_id = p.user_id
+    """)
+
+
+def _select_metric_users(con, metric_config: dict):
+    """
+    Point metric_users at one metric's column of group_users (see metric_users):
+      user_id, variant, exposure_time, metric_value
+    """
+    agg_type = metric_config['aggregation']
+    if agg_type not in ('binary', 'sum', 'count'):
+        raise ValueError(f"Unsupported aggregation type: {agg_type}")
+    con.execute(f"""
+        CREATE OR REPLACE TEMP VIEW metric_users AS
+        SELECT user_id, variant, exposure_time, "{agg_type}" AS metric_value
+        FROM group_users
+    """)
+
+
+def _sketch_key_sql(column: str) -> str:
+    """sketches.sketch_keys as a SQL expression"""
+    return f"""
+        CASE WHEN abs({column}) <= {MIN_INDEXABLE_VALUE} THEN 0
+             ELSE sign({column}) * (CAST(ceil(ln(abs({column})) / {LOG_GAMMA!r}) AS BIGINT) + {KEY_BIAS})
+        END
+    """
+
+
+def _user_values_sql(metric_config: dict) -> str:
+    """quantile_user_values over group_events: user_id, variant, exposure_time, metric_value"""
+    aggregate = USER_VALUE_AGGREGATES[quantile_user_value(metric_config)]
+    return f"""
+        SELECT user_id, any_value(variant) AS variant, any_value(exposure_time) AS exposure_time,
+               {aggregate}(event_value) AS metric_value
+        FROM group_events
+        WHERE event_value IS NOT NULL
+        GROUP BY user_id
+    """
+
+
+def _quantile_bins(con, metric_config: dict, time_unit: str | None = None) -> pd.DataFrame:
+    """
+    Sketches of the group's user values (see quantile_user_values) per
+    variant (and per exposure bucket when time_unit is given), aggregated
+    inside DuckDB so only bin counts reach pandas: (date,) variant, key, count
+    """
+    by = ['date', 'variant'] if time_unit else ['variant']
+    date_sql = f"{_bucket('exposure_time', time_unit)} AS date, " if time_unit else ""
+    bins = con.execute(f"""
+        SELECT {date_sql}variant, {_sketch_key_sql('metric_value')} AS key, COUNT(*) AS count
+        FROM ({_user_values_sql(metric_config)})
+        GROUP BY ALL
+    """).df()
+    bins['key'] = bins['key'].astype(np.int64)
+    return collapse_bins(bins, by)
+
+
+def _summary(con) -> pd.DataFrame:
+    """Per-variant sufficient statistics (see stat_tests.summarize_metric)"""
+    return con.execute("""
+        SELECT
+            variant,
+            COUNT(*) AS n,
+            SUM(metric_value) AS sum,
+            SUM(metric_value * metric_value) AS sum_sq
+        FROM metric_users
+        GROUP BY variant
+    """).df().set_index('variant')
+
+
+def _daily_exposed(con, time_unit: str) -> pd.DataFrame:
+    return con.execute(f"""
+        SELECT {_bucket('exposure_time', time_unit)} AS date, variant, COUNT(DISTINCT user_id) AS exposed_users
+        FROM exposures
+        GROUP BY 1, 2
+    """).df()
+
+
+def _bucket_stats(con, time_unit: str) -> pd.DataFrame:
+    """Per exposure-bucket sufficient statistics of metric_users (see user_bucket_stats)"""
+    return con.execute(f"""
+        SELECT
+            {_bucket('exposure_time', time_unit)} AS date,
+            variant,
+            COUNT(*) AS n,
+            SUM(metric_value) AS sum,
+            SUM(metric_value * metric_value) AS sum_sq
+        FROM metric_users
+        GROUP BY 1, 2
+    """).df()
+
+
+def _distribution(con, metric_config: dict, variants: list) -> dict:
+    """
+    Per-variant distribution summary (see analyze_metric_distribution).
+    Histogram and percentiles are computed in DuckDB; 'values' holds a
+    reproducible sample of at most DISTRIBUTION_SAMPLE_SIZE user values.
+    """
+    agg_type = metric_config['aggregation']
+    distribution_data = {}
+
+    for variant in variants:
+        variant_filter = f"variant = {_quote(variant)}"
+
+        if agg_type == 'binary':
+            total, converted = con.execute(f"""
+                SELECT COUNT(*), COALESCE(SUM(CASE WHEN metric_value = 1 THEN 1 ELSE 0 END), 0)
+                FROM metric_users WHERE {variant_filter}
+            """).fetchone()
+            distribution_data[f'variant_{variant}'] = {
+                'type': 'binary',
+                'converted': int(converted),
+                'not_converted': int(total - converted),
+                'conversion_rate': float(converted / total) if total > 0 else 0.0
+            }
+            continue
+
+        (n, zero_count, mean, median, std, p25, p75, p95, v_min, v_max,
+         nz_n, nz_q25, nz_q75, nz_min, nz_max) = con.execute(f"""
+            SELECT
+                COUNT(*),
+                SUM(CASE WHEN metric_value = 0 THEN 1 ELSE 0 END),
+                AVG(metric_value),
+                quantile_cont(metric_value, 0.5),
+                stddev_pop(metric_value),
+                quantile_cont(metric_value, 0.25),
+                quantile_cont(metric_value, 0.75),
+                quantile_cont(metric_value, 0.95),
+                MIN(metric_value),
+                MAX(metric_value),
+                COUNT(*) FILTER (WHERE metric_value > 0),
+                quantile_cont(metric_value, 0.25) FILTER (WHERE metric_value > 0),
+                quantile_cont(metric_value, 0.75) FILTER (WHERE metric_value > 0),
+                MIN(metric_value) FILTER (WHERE metric_value > 0),
+                MAX(metric_value) FILTER (WHERE metric_value > 0)
+            FROM metric_users WHERE {variant_filter}
+        """).fetchone()
+
+        # Freedman-Diaconis rule on non-zero values, as in the pandas engine
+        if nz_n > 0:
+            iqr = nz_q75 - nz_q25
+            bin_width = 2 * iqr / (nz_n ** (1/3)) if iqr > 0 else 1
+            n_bins = int((nz_max - nz_min) / bin_width) if bin_width > 0 else 20
+            n_bins = min(max(n_bins, 10), 50)
+        else:
+            n_bins = 10
+
+        # np.histogram widens a degenerate range by 0.5 on each side
+        lo, hi = (v_min - 0.5, v_max + 0.5) if v_min == v_max else (v_min, v_max)
+        bin_edges = np.linspace(lo, hi, n_bins + 1)
+        binned = con.execute(f"""
+            SELECT LEAST(CAST(FLOOR((metric_value - {lo}) / {(hi - lo) / n_bins}) AS INTEGER), {n_bins - 1}) AS bin,
+                   COUNT(*) AS count
+            FROM metric_users WHERE {variant_filter}
+            GROUP BY 1
+        """).df()
+        counts = np.zeros(n_bins, dtype=int)
+        counts[binned['bin'].to_numpy()] = binned['count'].to_numpy()
+
+        values = con.execute(f"""
+            SELECT metric_value FROM metric_users WHERE {variant_filter}
+            USING SAMPLE reservoir({DISTRIBUTION_SAMPLE_SIZE} ROWS) REPEATABLE (42)
+        """).df()['metric_value']
+
+        distribution_data[f'variant_{variant}'] = {
+            'type': 'histogram',
+            'values': values.tolist(),
+            'bins': bin_edges.tolist(),
+            'counts': counts.tolist(),
+            'zero_count': int(zero_count),
+            'mean': float(mean),
+            'median': float(median),
+            'std': float(std),
+            'p25': float(p25),
+            'p75': float(p75),
+            'p95': float(p95)
+        }
+
+    return distribution_data
+
+
+def _experiment_shape(con):
+    """Variants and exposure span of the registered exposures"""
+    if con.execute("SELECT COUNT(*) FROM exposures").fetchone()[0] == 0:
+        return None, None
+    variants = [row[0] for row in con.execute(
+        "SELECT DISTINCT variant FROM exposures WHERE variant IS NOT NULL ORDER BY 1"
+    ).fetchall()]
+    exposure_span = pd.Timedelta(con.execute(
+        "SELECT MAX(exposure_time) - MIN(exposure_time) FROM exposures"
+    ).fetchone()[0])
+    return variants, exposure_span
+
+
+def _assignment_check(con) -> dict:
+    """Sample ratio mismatch check (see analysis.assignment_check)"""
+    variant_counts = dict(con.execute(
+        "SELECT variant, COUNT(*) FROM exposures WHERE variant IS NOT NULL GROUP BY variant"
+    ).fetchall())
+    users, multi_variant_users, exposures = con.execute(
+        "SELECT COUNT(*), COUNT(*) FILTER (WHERE multi_variant), SUM(exposure_count) FROM exposures"
+    ).fetchone()
+    result = sample_ratio_check(variant_counts)
+    result['users'] = int(users)
+    result['multi_variant_users'] = int(multi_variant_users)
+    result['repeat_exposures'] = int(exposures - users)
+    return result
+
+
+def _register_segments(con, users_path: str, attributes: list):
+    """
+    user_segments table (see segments.user_segments) joining the users
+    file's attributes onto the registered exposures once:
+      user_id, attribute, segment
+    """
+    users_sql = f"""
+        SELECT CAST(user_id AS VARCHAR) AS user_id, {', '.join(f'CAST("{a}" AS VARCHAR) AS "{a}"' for a in attributes)}
+        FROM {_scan(con, users_path)}
+        QUALIFY row_number() OVER (PARTITION BY user_id) = 1
+    """
+    long_sql = ' UNION ALL '.join(f"""
+        SELECT x.user_id, {_quote(a)} AS attribute, COALESCE(u."{a}", {_quote(MISSING_SEGMENT)}) AS segment
+        FROM exposures x LEFT JOIN users u ON CAST(x.user_id AS VARCHAR) = u.user_id
+    """ for a in attributes)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE user_segments AS
+        WITH users AS ({users_sql}),
+        long AS ({long_sql}),
+        ranked AS (
+            SELECT attribute, segment,
+                   row_number() OVER (PARTITION BY attribute ORDER BY COUNT(*) DESC, segment) AS rank
+            FROM long
+            GROUP BY attribute, segment
+        )
+        SELECT
+            l.user_id,
+            l.attribute,
+            CASE WHEN r.rank <= {SEGMENT_MAX_LEVELS} THEN l.segment ELSE {_quote(OTHER_SEGMENT)} END AS segment
+        FROM long l
+        JOIN ranked r ON l.attribute = r.attribute AND l.segment = r.segment
+    """)
+
+
+def _segment_stats(con, columns: list) -> pd.DataFrame:
+    """Per (attribute, segment, variant) sufficient statistics of group_users columns (see segment_stats)"""
+    aggregations = ', '.join(
+        f'SUM(g."{c}") AS {c}_sum, SUM(g."{c}" * g."{c}") AS {c}_sum_sq' for c in columns
+    )
+    return con.execute(f"""
+        SELECT s.attribute, s.segment, g.variant, COUNT(*) AS n, {aggregations}
+        FROM user_segments s
+        JOIN group_users g ON s.user_id = g.user_id
+        GROUP BY ALL
+    """).df()
+
+
+def _segment_bins(con, metric_config: dict) -> pd.DataFrame:
+    """Sketches of the group's user values per attribute, segment and variant (see segment_bins)"""
+    bins = con.execute(f"""
+        SELECT s.attribute, s.segment, v.variant, {_sketch_key_sql('v.metric_value')} AS key, COUNT(*) AS count
+        FROM ({_user_values_sql(metric_config)}) v
+        JOIN user_segments s ON v.user_id = s.user_id
+        GROUP BY ALL
+    """).df()
+    bins['key'] = bins['key'].astype(np.int64)
+    return collapse_bins(bins, SEGMENT_KEYS)
+
+
+def _quantile_sections(con, metric_config: dict, variants: list, time_unit: str, sections, max_points=None) -> dict:
+    """_metric_sections for quantile metrics, all derived from per-bucket sketches"""
+    agg_type = metric_config['aggregation']
+    analysis = {}
+
+    with timed('daily', agg_type):
+        bins = _quantile_bins(con, metric_config, time_unit)
+        daily_df, cumulative_df = quantile_timeseries_from_bins(
+            _daily_exposed(con, time_unit), bins, variants, time_unit, metric_config
+        )
+        if 'daily' in sections:
+            analysis['daily_timeseries'] = series_records(daily_df, max_points)
+
+    if 'cumulative' in sections:
+        with timed('cumulative', agg_type):
+            analysis['cumulative_timeseries'] = series_records(cumulative_df, max_points)
+
+    if 'distribution' in sections:
+        with timed('distribution', agg_type):
+            variant_bins = bins.groupby(['variant', 'key'], as_index=False)['count'].sum()
+            analysis['distribution'] = quantile_distribution_from_bins(variant_bins, variants, metric_config)
+
+    if 'lift' in sections:
+        with timed('lift', agg_type):
+            lift_df = relative_lift_from_cumulative(cumulative_df)
+            analysis['lift_timeseries'] = series_records(lift_df, max_points, y='lift', by=None)
+
+    if 'ci' in sections:
+        with timed('ci', agg_type):
+            ci_df = quantile_ci_timeseries_from_bins(bins, sorted(daily_df['date'].unique()), variants, metric_config)
+            analysis['ci_timeseries'] = series_records(ci_df, max_points)
+
+    return analysis
+
+
+def _metric_stats(con, metric_config: dict) -> dict:
+    """Stat test for one metric of the registered group; selects metric_users for the other sections"""
+    if metric_config['aggregation'] == 'quantile':
+        bins = _quantile_bins(con, metric_config)
+        sketch_a = QuantileSketch.from_bins(bins[bins['variant'] == 'A'])
+        sketch_b = QuantileSketch.from_bins(bins[bins['variant'] == 'B'])
+        return run_quantile_test(sketch_a, sketch_b, metric_config)
+    _select_metric_users(con, metric_config)
+    return run_stat_tests_from_summary(_summary(con), metric_config)
+
+
+def _metric_sections(con, metric_config: dict, variants: list, exposure_span, sections, max_points=None) -> dict:
+    """
+    Requested chart sections for the metric whose metric_users view is
+    selected. daily, cumulative, lift and ci all derive from one per-bucket
+    aggregation.
+    """
+    time_unit = _choose_time_unit(metric_config, exposure_span)
+    agg_type = metric_config['aggregation']
+    if agg_type == 'quantile':
+        return _quantile_sections(con, metric_config, variants, time_unit, sections, max_points)
+    analysis = {}
+
+    if set(sections) & {'daily', 'cumulative', 'lift', 'ci'}:
+        with timed('daily', agg_type):
+            bucket_stats = _bucket_stats(con, time_unit)
+            daily_df = daily_from_bucket_stats(bucket_stats, variants, time_unit)
+            if 'daily' in sections:
+                analysis['daily_timeseries'] = series_records(daily_df, max_points)
+
+        with timed('cumulative', agg_type):
+            cumulative_df = cumulative_from_daily(daily_df)
+            if 'cumulative' in sections:
+                analysis['cumulative_timeseries'] = series_records(cumulative_df, max_points)
+
+    if 'distribution' in sections:
+        with timed('distribution', agg_type):
+            analysis['distribution'] = _distribution(con, metric_config, variants)
+
+    if 'lift' in sections:
+        with timed('lift', agg_type):
+            lift_df = relative_lift_from_cumulative(cumulative_df)
+            analysis['lift_timeseries'] = series_records(lift_df, max_points, y='lift', by=None)
+
+    if 'ci' in sections:
+        with timed('ci', agg_type):
+            ci_df = ci_timeseries_from_bucket_stats(bucket_stats, sorted(daily_df['date'].unique()), variants, agg_type)
+            analysis['ci_timeseries'] = series_records(ci_df, max_points)
+
+    return analysis
+
+
+def run_experiment_analysis_duckdb(experiment_id, exposures_path, events_path, metrics_config,
+                                   apply_correction=True, temp_directory=None, memory_limit=None,
+                                   max_points=None, sections=None, users_path=None, segment_by=None):
+    """
+    Out-of-core counterpart of run_experiment_analysis: reads exposures and
+    events (and optionally users, for segment breakdowns) directly from
+    CSV/Parquet files and returns the same structure.
+    """
+    selected = ANALYSIS_SECTIONS if sections is None else tuple(s for s in ANALYSIS_SECTIONS if s in sections)
+
+    con = connect(temp_directory=temp_directory, memory_limit=memory_limit)
+    try:
+        _register_inputs(con, experiment_id, exposures_path, events_path)
+        variants, exposure_span = _experiment_shape(con)
+        if variants is None:
+            raise ValueError(f"No exposure data found for experiment_id: {experiment_id}")
+
+        metric_configs = list(metrics_config.values())
+        analyses = [None] * len(metric_configs)
+        done = 0
+
+        if users_path is not None:
+            with timed('segments'):
+                attributes = segment_attributes(file_columns(con, users_path), segment_by)
+                _register_segments(con, users_path, attributes)
+                segments = con.execute("SELECT DISTINCT attribute, segment FROM user_segments").df()
+
+        # metrics sharing an event and window are analyzed from one join
+        for group in plan_metric_groups(metric_configs):
+            group_configs = [metric_configs[position] for position in group]
+            with timed('join'):
+                _register_metric_group(con, group_configs)
+
+            if users_path is not None:
+                with timed('segments'):
+                    aggregations = sorted({m['aggregation'] for m in group_configs} - {'quantile'})
+                    stats_by_segment = _segment_stats(con, aggregations) if aggregations else None
+
+            for position in group:
+                metric_config = metric_configs[position]
+                agg_type = metric_config['aggregation']
+                with timed('stats', agg_type):
+                    analysis = _metric_stats(con, metric_config)
+                analysis.update(_metric_sections(con, metric_config, variants, exposure_span, selected, max_points))
+                if users_path is not None:
+                    with timed('segments', agg_type):
+                        analysis['segments'] = (
+                            quantile_segment_tests(_segment_bins(con, metric_config), segments, metric_config)
+                            if agg_type == 'quantile'
+                            else segment_tests(stats_by_segment, metric_config)
+                        )
+                done += 1
+                report_metric_done(done, len(metric_configs), metric_config, analysis)
+                analyses[position] = analysis
+
+        results = {}
+        p_values = []
+        metric_ids = []
+        for metric_config, analysis in zip(metric_configs, analyses):
+            metric_ids.append(metric_config['metric_id'])
+            p_values.append(analysis['p-value'])
+            results[metric_config['metric_id']] = analysis
+
+        results['_assignment_check'] = _assignment_check(con)
+        if users_path is not None:
+            apply_segment_corrections(results, metric_ids, attributes, apply_correction)
+    finally:
+        con.close()
+
+    if sections is not None:
+        results['_sections_info'] = {
+            'computed': list(selected),
+            'skipped': [s for s in ANALYSIS_SECTIONS if s not in selected],
+        }
+
+    return apply_correction_to_results(results, p_values, metric_ids, apply_correction)
+
+
+def analyze_metric_sections_duckdb(experiment_id, exposures_path, events_path, metric_config, sections,
+                                   temp_directory=None, memory_limit=None, max_points=None):
+    """Chart sections for a single metric, computed on demand from the files"""
+    con = connect(temp_directory=temp_directory, memory_limit=memory_limit)
+    try:
+        _register_inputs(con, experiment_id, exposures_path, events_path)
+        variants, exposure_span = _experiment_shape(con)
+        if variants is None:
+            raise ValueError(f"No exposure data found for experiment_id: {experiment_id}")
+
+        _register_metric_group(con, [metric_config])
+        if metric_config['aggregation'] != 'quantile':
+            _select_metric_users(con, metric_config)
+        return _metric_sections(con, metric_config, variants, exposure_span, sections, max_points)
+    finally:
+        con.close()
@@ -0,0 +1,88 @@
+"""
+Per-stage latency instrumentation.
+
+Pipeline stages are wrapped in `timed(stage, aggregation)`, which records
+into a Prometheus histogram labelled by stage, metric aggregation type and
+input size class. Inside `collect_timings(...)` the durations are also kept
+per request so the upload endpoint can return them as a Server-Timing header.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Histogram
+
+STAGE_SECONDS = Histogram(
+    'abexp_stage_duration_seconds',
+    'Duration of upload/analysis pipeline stages',
+    ['stage', 'aggregation', 'input_size'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+# Upper bounds (bytes) of the input size classes used as a label
+INPUT_SIZE_CLASSES = (
+    (1024 ** 2, '<1MB'),
+    (10 * 1024 ** 2, '1-10MB'),
+    (100 * 1024 ** 2, '10-100MB'),
+    (1024 ** 3, '100MB-1GB'),
+)
+
+_input_size: ContextVar[str] = ContextVar('input_size', default='unknown')
+_timings: ContextVar[list | None] = ContextVar('timings', default=None)
+
+
+def input_size_class(num_bytes: int | None) -> str:
+    """Low-cardinality label for an input size in bytes"""
+    if num_bytes is None:
+        return 'unknown'
+    for upper, label in INPUT_SIZE_CLASSES:
+        if num_bytes < upper:
+            return label
+    return '>=1GB'
+
+
+@contextmanager
+def collect_timings(input_bytes: int | None = None):
+    """Collect the stage timings recorded in this context into a list"""
+    timings = []
+    size_token = _input_size.set(input_size_class(input_bytes))
+    timings_token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(timings_token)
+        _input_size.reset(size_token)
+
+
+@contextmanager
+def timed(stage: str, aggregation: str = 'all'):
+    """Time a block as one pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage, aggregation, _input_size.get()).observe(duration)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, aggregation, duration))
+
+
+def server_timing_header(timings: list) -> str:
+    """
+    Format collected timings as a Server-Timing header value, summing
+    repeated stages (e.g. one 'daily' entry per metric of the same type).
+    """
+    totals = {}
+    for stage, aggregation, duration in timings:
+        name = stage if aggregation == 'all' else f'{stage}.{aggregation}'
+        totals[name] = totals.get(name, 0.0) + duration
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items())
+
+
+def record_timings(timings: list):
+    """Record stage timings measured elsewhere (e.g. in a worker process) in this context"""
+    for stage, aggregation, duration in timings:
+        STAGE_SECONDS.labels(stage, aggregation, _input_size.get()).observe(duration)
+        collected = _timings.get()
+        if collected is not None:
+            collected.append((stage, aggregation, duration))
@@ -0,0 +1,109 @@
+"""
+Fused window-filter and per-user aggregation kernels.
+
+Events are coded by the row of their user in the first-exposure table
+(-1 when the user was never exposed), and times are int64 nanoseconds with
+NaT as int64's minimum. user_window_totals then counts and sums each user's
+events falling in [start, end] after their exposure, for one or more
+windows at once, without building the joined frame, the time-since-exposure
+column or the window masks.
+
+With Numba installed the kernel is one compiled pass over the events;
+without it (or with NUMBA_KERNELS=0) a numpy path gives the same results.
+"""
+import os
+
+import numpy as np
+
+# Use the Numba kernel when Numba is installed; 0 forces the numpy path
+NUMBA_KERNELS = int(os.getenv("NUMBA_KERNELS", 1))
+
+NAT = np.iinfo(np.int64).min
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _window_totals_loop(codes, event_ns, values, exposure_ns, starts, ends, counts, sums):
+    for i in range(codes.shape[0]):
+        user = codes[i]
+        if user < 0 or event_ns[i] == NAT or exposure_ns[user] == NAT:
+            continue
+        delta = event_ns[i] - exposure_ns[user]
+        for w in range(starts.shape[0]):
+            if delta < starts[w] or delta > ends[w]:
+                continue
+            counts[w, user] += 1
+            if not np.isnan(values[i]):
+                sums[w, user] += values[i]
+
+
+_window_totals_jit = numba.njit(nogil=True, cache=True)(_window_totals_loop) if numba is not None else None
+
+
+def numba_enabled() -> bool:
+    """Whether user_window_totals runs the compiled kernel by default"""
+    return _window_totals_jit is not None and bool(NUMBA_KERNELS)
+
+
+def _window_totals_numpy(codes, event_ns, values, exposure_ns, starts, ends):
+    """
+    Every window bound is an edge between consecutive segments of
+    time-since-exposure (an end bound e as e + 1, windows being closed).
+    Each event is placed in its segment by searchsorted and counted once per
+    (segment, user); a window's totals are the sum of the segments it spans.
+    """
+    exposed = codes >= 0
+    exposure_at = exposure_ns[np.where(exposed, codes, 0)]
+    keep = exposed & (event_ns != NAT) & (exposure_at != NAT)
+    delta = event_ns - exposure_at
+
+    edges = np.unique(np.concatenate([starts, ends + 1]))
+    segment = np.searchsorted(edges, delta, side='right')
+    # segment 0 lies before the first edge and len(edges) after the last: outside every window
+    keep &= (segment > 0) & (segment < len(edges))
+
+    n_users = len(exposure_ns)
+    n_segments = len(edges) - 1
+    cell = (segment[keep] - 1) * n_users + codes[keep]
+    kept_values = values[keep]
+    segment_counts = np.bincount(cell, minlength=n_segments * n_users).reshape(n_segments, n_users)
+    segment_sums = np.bincount(
+        cell, weights=np.where(np.isnan(kept_values), 0.0, kept_values), minlength=n_segments * n_users
+    ).reshape(n_segments, n_users)
+
+    first = np.searchsorted(edges, starts)
+    last = np.searchsorted(edges, ends + 1)
+    counts = np.stack([segment_counts[a:b].sum(axis=0) for a, b in zip(first, last)]).astype(float)
+    sums = np.stack([segment_sums[a:b].sum(axis=0) for a, b in zip(first, last)])
+    return counts, sums
+
+
+def user_window_totals(codes: np.ndarray, event_ns: np.ndarray, values: np.ndarray, exposure_ns: np.ndarray,
+                       windows: list, use_numba: bool | None = None):
+    """
+    (counts, sums), each of shape (len(windows), len(exposure_ns)): for every
+    (start_ns, end_ns) window and user, how many of the user's events fall
+    in it and the sum of their non-NaN values. use_numba overrides
+    numba_enabled(); True without Numba raises RuntimeError.
+    """
+    codes = np.ascontiguousarray(codes, dtype=np.int64)
+    event_ns = np.ascontiguousarray(event_ns, dtype=np.int64)
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    exposure_ns = np.ascontiguousarray(exposure_ns, dtype=np.int64)
+    starts = np.array([start for start, _ in windows], dtype=np.int64)
+    ends = np.array([end for _, end in windows], dtype=np.int64)
+
+    if use_numba is None:
+        use_numba = numba_enabled()
+    if not use_numba:
+        return _window_totals_numpy(codes, event_ns, values, exposure_ns, starts, ends)
+    if _window_totals_jit is None:
+        raise RuntimeError("Numba is not installed")
+
+    counts = np.zeros((len(windows), len(exposure_ns)), dtype=np.float64)
+    sums = np.zeros((len(windows), len(exposure_ns)), dtype=np.float64)
+    _window_totals_jit(codes, event_ns, values, exposure_ns, starts, ends, counts, sums)
+    return counts, sums
@@ -1,44 +1,255 @@
 import pandas as pd
 import json
 import io
+import os
 
-def load_files(metrics_file, exposures_file, events_file, users_file=None):
+from .windows import expand_metric_windows
+
+# Leading bytes of each non-CSV upload format; anything else is read as plain CSV
+FILE_SIGNATURES = [
+    (b'PAR1', 'parquet'),
+    (b'ARROW1', 'arrow'),            # Arrow IPC file, which Feather v2 is
+    (b'\xff\xff\xff\xff', 'arrow_stream'),
+    (b'\x1f\x8b', 'csv.gz'),
+    (b'\x28\xb5\x2f\xfd', 'csv.zst'),
+]
+CSV_COMPRESSION = {'csv': None, 'csv.gz': 'gzip', 'csv.zst': 'zstd'}
+COLUMNAR_FORMATS = ('parquet', 'arrow', 'arrow_stream')
+
+# Columns prepare_experiment_data reads; other columns are skipped when loading for one experiment
+EXPOSURES_READ_COLUMNS = ['user_id', 'experiment_id', 'variant', 'exposure_time']
+EVENTS_READ_COLUMNS = ['user_id', 'event_name', 'event_time', 'event_value']
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+def _head(source, size: int = 8) -> bytes:
+    if _is_path(source):
+        with open(source, 'rb') as f:
+            return f.read(size)
+    if hasattr(source, 'read'):
+        position = source.tell()
+        head = source.read(size)
+        source.seek(position)
+        return head
+    return bytes(source[:size])
+
+def sniff_format(source) -> str:
+    """
+    Format of an uploaded table from its leading bytes: 'csv', 'csv.gz',
+    'csv.zst', 'parquet', 'arrow' (IPC file / Feather v2) or 'arrow_stream'
+    """
+    head = _head(source)
+    if head.startswith(b'FEA1'):
+        raise ValueError("Feather v1 files are not supported; write Feather v2 (Arrow IPC) instead")
+    for signature, file_format in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return file_format
+    return 'csv'
+
+def _read_csv(source, compression=None, columns=None):
+    """Read a CSV from a path (memory-mapped if uncompressed), file object or bytes"""
+    usecols = (lambda column: column in columns) if columns is not None else None
+    if _is_path(source):
+        return pd.read_csv(source, memory_map=compression is None, compression=compression, usecols=usecols)
+    if hasattr(source, 'read'):
+        return pd.read_csv(source, compression=compression, usecols=usecols)
+    return pd.read_csv(io.BytesIO(source), compression=compression, usecols=usecols)
+
+def _arrow_input(source):
+    """pyarrow input for a path (memory-mapped) or bytes"""
+    import pyarrow as pa
+    if _is_path(source):
+        return pa.memory_map(os.fspath(source))
+    return pa.BufferReader(source)
+
+def _pushdown_filter(schema, filters: dict | None):
+    """
+    Arrow expression keeping rows whose column is one of the allowed values.
+    Only string columns are filtered, where this matches the string
+    comparison prepare_experiment_data does afterwards; others are left to it.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    expression = None
+    for column, values in (filters or {}).items():
+        if column not in schema.names:
+            continue
+        column_type = schema.field(column).type
+        if not (pa.types.is_string(column_type) or pa.types.is_large_string(column_type)):
+            continue
+        condition = pc.field(column).isin([str(value) for value in values])
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def _read_columnar(source, file_format: str, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Read a Parquet or Arrow IPC table. Projection and filters are applied in
+    the reader: Parquet skips row groups whose statistics rule out the filter
+    and never decodes unprojected columns; Arrow files are memory-mapped, so
+    unprojected columns are never paged in.
+    """
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+
+    if hasattr(source, 'read'):
+        source = source.read()
+    if file_format == 'parquet':
+        schema = pq.read_schema(_arrow_input(source))
+        selected = [name for name in schema.names if columns is None or name in columns]
+        table = pq.read_table(
+            os.fspath(source) if _is_path(source) else _arrow_input(source),
+            columns=selected, filters=_pushdown_filter(schema, filters), memory_map=True
+        )
+    else:
+        reader = ipc.open_file(_arrow_input(source)) if file_format == 'arrow' else ipc.open_stream(_arrow_input(source))
+        table = reader.read_all()
+        if columns is not None:
+            table = table.select([name for name in table.schema.names if name in columns])
+        expression = _pushdown_filter(table.schema, filters)
+        if expression is not None:
+            table = table.filter(expression)
+    return table.to_pandas()
+
+def read_table(source, columns=None, filters: dict | None = None) -> pd.DataFrame:
+    """
+    Read an exposures, events or users table in any supported format (see
+    sniff_format) from a path, file object or bytes.
+    Args:
+        columns: Keep only these columns (those missing from the file are ignored)
+        filters: Column -> allowed values, pushed into Parquet/Arrow reads of
+            string columns. Rows are not guaranteed to be filtered, so callers
+            still apply their own filter.
+    """
+    file_format = sniff_format(source)
+    if file_format in COLUMNAR_FORMATS:
+        return _read_columnar(source, file_format, columns, filters)
+    return _read_csv(source, CSV_COMPRESSION[file_format], columns)
+
+def _batch_frame(batch, columns=None, expression=None) -> pd.DataFrame:
+    """An Arrow record batch as a DataFrame, projected and filtered like _read_columnar"""
+    import pyarrow as pa
+    table = pa.Table.from_batches([batch])
+    if columns is not None:
+        table = table.select([name for name in table.schema.names if name in columns])
+    if expression is not None:
+        table = table.filter(expression)
+    return table.to_pandas()
+
+def iter_table(path, columns=None, filters: dict | None = None, chunk_rows: int = 1_000_000):
+    """
+    read_table for a file too large to load at once: yields it as DataFrames
+    of at most chunk_rows rows (Arrow IPC files: one per record batch), in
+    file order. columns and filters work as in read_table; Parquet files are
+    scanned with the filter, so row groups whose statistics rule it out are
+    never read, and at least one (possibly empty) chunk is always yielded.
+    """
+    file_format = sniff_format(path)
+    if file_format == 'parquet':
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(os.fspath(path), format='parquet')
+        selected = [name for name in dataset.schema.names if columns is None or name in columns]
+        batches = dataset.to_batches(
+            columns=selected, filter=_pushdown_filter(dataset.schema, filters), batch_size=chunk_rows
+        )
+        empty = True
+        for batch in batches:
+            if batch.num_rows:
+                empty = False
+                yield _batch_frame(batch)
+        if empty:
+            yield dataset.schema.empty_table().select(selected).to_pandas()
+    elif file_format in COLUMNAR_FORMATS:
+        import pyarrow.ipc as ipc
+        if file_format == 'arrow':
+            reader = ipc.open_file(_arrow_input(path))
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        else:
+            reader = batches = ipc.open_stream(_arrow_input(path))
+        expression = _pushdown_filter(reader.schema, filters)
+        for batch in batches:
+            yield _batch_frame(batch, columns, expression)
+    else:
+        usecols = (lambda column: column in columns) if columns is not None else None
+        with pd.read_csv(path, compression=CSV_COMPRESSION[file_format], usecols=usecols, chunksize=chunk_rows) as reader:
+            yield from reader
+
+def read_sampled_table(source, fraction: float, columns=None, filters: dict | None = None) -> pd.DataFrame:
+    """
+    read_table keeping only the users in a deterministic hash sample (see
+    services.sampling). Files on disk are read in chunks, so no more than
+    one chunk plus the sample is held in memory.
     """
-    Load files from file objects (in-memory) instead of disk paths.
+    from .sampling import sample_users
+    if not _is_path(source):
+        return sample_users(read_table(source, columns, filters), fraction)
+    chunks = [sample_users(chunk, fraction) for chunk in iter_table(source, columns, filters)]
+    if not chunks:
+        return read_table(source, columns, filters)
+    return pd.concat(chunks, ignore_index=True)
+
+def table_columns(path) -> list:
+    """Column names of a table file, without reading its rows"""
+    file_format = sniff_format(path)
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(_arrow_input(path)).names
+    if file_format in COLUMNAR_FORMATS:
+        import pyarrow.ipc as ipc
+        reader = ipc.open_file(_arrow_input(path)) if file_format == 'arrow' else ipc.open_stream(_arrow_input(path))
+        return reader.schema.names
+    return pd.read_csv(path, compression=CSV_COMPRESSION[file_format], nrows=0).columns.tolist()
+
+def experiment_ids(exposures_file) -> list:
+    """Distinct experiment ids of an exposures table, reading only that column"""
+    ids = read_table(exposures_file, columns=['experiment_id'])['experiment_id']
+    return ids.astype(str).unique().tolist()
+
+def load_files(metrics_file, exposures_file, events_file, users_file=None, experiment_id=None, sample_fraction=None):
+    """
+    Load files from disk paths, file objects or in-memory bytes.
     Args:
-        metrics_file: File object or bytes for JSON metrics config
-        exposures_file: File object or bytes for exposures CSV
-        events_file: File object or bytes for events CSV
-        users_file: Optional file object or bytes for users CSV
+        metrics_file: Path, file object or bytes for JSON metrics config
+        exposures_file: Path, file object or bytes for exposures table
+        events_file: Path, file object or bytes for events table
+        users_file: Optional path, file object or bytes for users table
+        experiment_id: If given, only the columns prepare_experiment_data
+            needs are read, and exposures/events are filtered to this
+            experiment and the metrics' events where the format allows
+        sample_fraction: If given, only the users in this fraction's hash
+            sample are kept, while reading (see read_sampled_table)
     """
     # Handle JSON metrics config
-    if hasattr(metrics_file, 'read'):
+    if _is_path(metrics_file):
+        with open(metrics_file, 'rb') as f:
+            metrics_config = json.loads(f.read())
+    elif hasattr(metrics_file, 'read'):
         metrics_content = metrics_file.read()
         if isinstance(metrics_content, bytes):
             metrics_content = metrics_content.decode('utf-8')
         metrics_config = json.loads(metrics_content)
     else:
         metrics_config = json.loads(metrics_file)
-    
-    # Handle exposures CSV
-    if hasattr(exposures_file, 'read'):
-        exposures_df = pd.read_csv(exposures_file)
-    else:
-        exposures_df = pd.read_csv(io.BytesIO(exposures_file))
-    
-    # Handle events CSV
-    if hasattr(events_file, 'read'):
-        events_df = pd.read_csv(events_file)
+    metrics_config = expand_metric_windows(metrics_config)
+
+    if sample_fraction is None:
+        read = read_table
     else:
-        events_df = pd.read_csv(io.BytesIO(events_file))
-    
-    # Handle optional users CSV
-    if users_file:
-        if hasattr(users_file, 'read'):
-            users_df = pd.read_csv(users_file)
-        else:
-            users_df = pd.read_csv(io.BytesIO(users_file))
+        def read(source, columns=None, filters=None):
+            return read_sampled_table(source, sample_fraction, columns, filters)
+
+    if experiment_id is None:
+        exposures_df = read(exposures_file)
+        events_df = read(events_file)
     else:
-        users_df = None
-    
+        event_names = [
+            metric_config['event']['name'] for metric_config in metrics_config.values()
+            if isinstance(metric_config.get('event'), dict) and 'name' in metric_config['event']
+        ]
+        exposures_df = read(
+            exposures_file, columns=EXPOSURES_READ_COLUMNS, filters={'experiment_id': [experiment_id]}
+        )
+        events_df = read(events_file, columns=EVENTS_READ_COLUMNS, filters={'event_name': event_names})
+    users_df = read(users_file) if users_file else None
+
     return metrics_config, exposures_df, events_df, users_df
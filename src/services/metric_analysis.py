@@ -1,13 +1,49 @@
+import os
 import pandas as pd
 from pandas import NA
 import numpy as np
 from scipy import stats
+from .sketches import QuantileSketch, SKETCH_MAX_BINS, bin_counts, quantile_rank, quantile_ci_ranks, values_at_ranks
+from .kernels import user_window_totals
+from .options import QUANTILE_USER_VALUES
+
+# Upper bound on time buckets per series; bucket width grows with the exposure span
+MAX_SERIES_POINTS = int(os.getenv("MAX_SERIES_POINTS", 100))
+
+# Candidate fixed-width bucket sizes, finest first ('W' is anchored and can't be floored)
+TIME_UNITS = ['1h', '2h', '3h', '4h', '6h', '12h', '1D', '2D', '3D', '7D', '14D', '28D']
+
+def first_exposures(exposure_events: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per user from a raw exposure log: the user's first exposure and
+    the variant assigned there (ties broken by variant), in log order.
+
+    Output columns:
+      user_id, experiment_id, variant, exposure_time, exposure_count, multi_variant
+    """
+    ordered = exposure_events.sort_values(['user_id', 'exposure_time', 'variant'], kind='stable')
+    user_ids = ordered['user_id'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, user_ids[1:] != user_ids[:-1]])
+
+    # users are contiguous after the sort, so per-user reductions are reduceat calls
+    variant_codes, _ = pd.factorize(ordered['variant'])
+    first = ordered.iloc[starts][['user_id', 'experiment_id', 'variant', 'exposure_time']].copy()
+    first['exposure_count'] = np.diff(np.r_[starts, len(ordered)])
+    first['multi_variant'] = (
+        np.minimum.reduceat(variant_codes, starts) != np.maximum.reduceat(variant_codes, starts)
+    ) if len(ordered) else np.zeros(0, dtype=bool)
+
+    return first.sort_index()
+
 
 def _filter_events_by_metric(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict) -> pd.DataFrame:
     """
     Filter and window events according to metric config.
     Returns merged, windowed event data containing:
       user_id, variant, exposure_time, event_time, (event_value), etc.
+
+    exposure_events should hold one row per user (see first_exposures);
+    repeat exposures would otherwise multiply the joined event rows.
     """
     exposure_events = exposure_events.copy()
     user_events = user_events.copy()
@@ -37,168 +73,542 @@ def _filter_events_by_metric(exposure_events: pd.DataFrame, user_events: pd.Data
     return in_window
 
 
-def _choose_time_unit(metric_config: dict) -> str:
+def windowed_joins(exposure_events: pd.DataFrame, user_events: pd.DataFrame, event_name: str, windows: list) -> list:
+    """
+    The windowed join (see _filter_events_by_metric) of an event for each
+    (start, end) window (see metric_window), all cut by time_since_exposure
+    from a single join over the span of the windows.
+    """
+    span = {'start': min(start for start, _ in windows), 'end': max(end for _, end in windows)}
+    joined = _filter_events_by_metric(exposure_events, user_events, {'event': {'name': event_name}, 'window': span})
+    if len(windows) == 1:
+        return [joined]
+    since = joined['time_since_exposure']
+    return [joined[(since >= start) & (since <= end)] for start, end in windows]
+
+
+def _event_values(in_window: pd.DataFrame) -> pd.DataFrame:
+    """In-window events with a numeric event_value, as metric_value"""
+    if 'event_value' not in in_window.columns:
+        return in_window.assign(metric_value=pd.Series(dtype=float)).iloc[:0]
+    values = pd.to_numeric(in_window['event_value'], errors='coerce')
+    return in_window.assign(metric_value=values)[values.notna()]
+
+
+def quantile_user_value(metric_config: dict) -> str:
+    """How a quantile metric reduces each user's event values, validated (see QUANTILE_USER_VALUES)"""
+    how = metric_config.get('user_value', 'sum')
+    if how not in QUANTILE_USER_VALUES:
+        raise ValueError(f"Unsupported user_value '{how}'. Choose one of: {', '.join(QUANTILE_USER_VALUES)}")
+    return how
+
+
+def quantile_user_values(in_window: pd.DataFrame, metric_config: dict) -> pd.DataFrame:
+    """
+    The sample a quantile metric is taken over: one row per user with a
+    numeric in-window event value, metric_value being the sum of the user's
+    values (their mean with "user_value": "mean"). Users are the
+    randomization unit, so quantiles and their order-statistic intervals are
+    over users; over events, users with many events would make the interval
+    too narrow.
+      user_id, variant, exposure_time, metric_value
+    """
+    how = quantile_user_value(metric_config)
+    values = _event_values(in_window)
+    return values.groupby('user_id', sort=False, as_index=False).agg(
+        variant=('variant', 'first'),
+        exposure_time=('exposure_time', 'first'),
+        metric_value=('metric_value', how),
+    )
+
+
+def _exposure_span(exposure_events: pd.DataFrame) -> pd.Timedelta:
+    exposure_times = pd.to_datetime(exposure_events['exposure_time'])
+    return exposure_times.max() - exposure_times.min()
+
+
+def _max_buckets(exposure_span: pd.Timedelta, time_unit: str) -> int:
+    """Most epoch-aligned time_unit buckets a span can touch, wherever it starts"""
+    return -(-exposure_span // pd.Timedelta(time_unit)) + 1
+
+
+def _choose_time_unit(metric_config: dict, exposure_span: pd.Timedelta | None = None, max_points: int = MAX_SERIES_POINTS) -> str:
+    """
+    Bucket size for time series. The metric window sets the finest size
+    (hourly for short windows, daily, weekly for long ones); given the
+    experiment's exposure span, the size is coarsened along TIME_UNITS
+    until the span fits in max_points buckets. Buckets are floored to
+    epoch-aligned boundaries, so a span starting mid-bucket touches up to
+    ceil(span / unit) + 1 of them (see _max_buckets).
+    """
     duration_days = (
         pd.to_timedelta(metric_config['window']['end']) - pd.to_timedelta(metric_config['window']['start'])
     ).days
 
     if duration_days < 3:
-        return 'H'
-    if duration_days > 60:
-        return 'W'
-    return 'D'
+        finest = '1h'
+    elif duration_days > 60:
+        finest = '7D'
+    else:
+        finest = '1D'
+
+    if exposure_span is None or pd.isna(exposure_span):
+        return finest
+
+    for time_unit in TIME_UNITS[TIME_UNITS.index(finest):]:
+        if _max_buckets(exposure_span, time_unit) <= max_points:
+            return time_unit
+    # whole days with ceil(span / unit) <= max_points - 1
+    return f"{max(1, int(np.ceil(exposure_span / pd.Timedelta('1D') / max(max_points - 1, 1))))}D"
+
+
+def metric_group_key(metric_config: dict) -> tuple:
+    """Metrics with equal keys share one windowed join: (event name, window start, window end)"""
+    return (metric_config['event']['name'], *metric_window(metric_config))
+
+
+def plan_metric_groups(metric_configs: list) -> list:
+    """
+    Positions of metric_configs grouped by metric_group_key, in order of
+    first appearance, so each distinct event/window pair is joined and
+    aggregated once however many metrics are defined on it.
+    """
+    groups = {}
+    for position, metric_config in enumerate(metric_configs):
+        groups.setdefault(metric_group_key(metric_config), []).append(position)
+    return list(groups.values())
+
+
+def plan_event_groups(metric_configs: list) -> list:
+    """
+    Positions of metric_configs grouped by event name, in order of first
+    appearance. Unlike plan_metric_groups, metrics on one event share a
+    group whatever their windows: all of the group's windows are aggregated
+    in one pass over its events (see windowed_user_tables).
+    """
+    groups = {}
+    for position, metric_config in enumerate(metric_configs):
+        groups.setdefault(metric_config['event']['name'], []).append(position)
+    return list(groups.values())
+
+
+def user_metric_table(exposure_events: pd.DataFrame, in_window: pd.DataFrame) -> pd.DataFrame:
+    """
+    Every user-level aggregation of one windowed join, from a single
+    multi-aggregation groupby. One row per exposed user:
+      user_id, variant, exposure_time, binary, count, sum
+    """
+    event_values = (
+        pd.to_numeric(in_window['event_value'], errors='coerce')
+        if 'event_value' in in_window.columns else pd.Series(0.0, index=in_window.index)
+    )
+    per_user = (
+        in_window[['user_id']].assign(event_value=event_values)
+        .groupby('user_id')
+        .agg(count=('event_value', 'size'), sum=('event_value', 'sum'))
+    )
+
+    users = exposure_events[['user_id', 'variant', 'exposure_time']].merge(
+        per_user, left_on='user_id', right_index=True, how='left'
+    )
+    users['exposure_time'] = pd.to_datetime(users['exposure_time'])
+    users['count'] = users['count'].fillna(0).astype(float)
+    users['sum'] = users['sum'].fillna(0.0).astype(float)
+    users['binary'] = (users['count'] > 0).astype(float)
+    return users[['user_id', 'variant', 'exposure_time', 'binary', 'count', 'sum']]
+
+
+def _ns(times: pd.Series) -> np.ndarray:
+    """Times as int64 nanoseconds, NaT as int64's minimum (see services.kernels)"""
+    if not pd.api.types.is_datetime64_dtype(times):
+        times = pd.to_datetime(times)
+    return times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def metric_window(metric_config: dict) -> tuple:
+    """(start, end) of a metric's window as Timedeltas"""
+    window = metric_config['window']
+    return pd.Timedelta(window['start']), pd.Timedelta(window['end'])
+
+
+def windowed_user_tables(exposure_events: pd.DataFrame, user_events: pd.DataFrame, event_name: str, windows: list) -> list:
+    """
+    user_metric_table of the event's windowed join for each (start, end)
+    window (see metric_window), without building any join: events are
+    coded by their user's row in exposure_events, then window-filtered and
+    counted/summed per user for every window in one fused pass (see
+    services.kernels). Falls back to a join per window when
+    exposure_events repeats a user.
+    """
+    user_ids = pd.Index(exposure_events['user_id'])
+    if not user_ids.is_unique:
+        return [
+            user_metric_table(exposure_events, _filter_events_by_metric(
+                exposure_events, user_events, {'event': {'name': event_name}, 'window': {'start': start, 'end': end}}
+            ))
+            for start, end in windows
+        ]
+
+    # plain arrays: comparing an object ndarray is several times faster than the Series comparison
+    relevant = user_events['event_name'].to_numpy() == event_name
+    values = (
+        pd.to_numeric(user_events['event_value'], errors='coerce').to_numpy(dtype=float)[relevant]
+        if 'event_value' in user_events.columns else np.zeros(int(relevant.sum()))
+    )
+    counts, sums = user_window_totals(
+        user_ids.get_indexer(user_events['user_id'].to_numpy()[relevant]),
+        _ns(user_events['event_time'])[relevant],
+        values,
+        _ns(exposure_events['exposure_time']),
+        [(pd.Timedelta(start).value, pd.Timedelta(end).value) for start, end in windows],
+    )
+
+    users = exposure_events[['user_id', 'variant', 'exposure_time']].reset_index(drop=True)
+    users['exposure_time'] = pd.to_datetime(users['exposure_time'])
+    return [
+        users.assign(binary=(window_counts > 0).astype(float), count=window_counts, sum=window_sums)
+        for window_counts, window_sums in zip(counts, sums)
+    ]
+
+
+def windowed_user_metrics(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict) -> pd.DataFrame:
+    """windowed_user_tables for one metric's event and window"""
+    return windowed_user_tables(exposure_events, user_events, metric_config['event']['name'], [metric_window(metric_config)])[0]
+
+
+def metric_users(user_metrics: pd.DataFrame, agg_type: str) -> pd.DataFrame:
+    """
+    One metric's user-level table from user_metric_table:
+      user_id, variant, exposure_time, metric_value
+    """
+    if agg_type not in ('binary', 'sum', 'count'):
+        raise ValueError(f"Unsupported aggregation type: {agg_type}")
+    return user_metrics[['user_id', 'variant', 'exposure_time', agg_type]].rename(columns={agg_type: 'metric_value'})
 
 
 def analyze_metric(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict) -> pd.DataFrame:
     """
     User-level metric table for stat tests:
       user_id, variant, metric_value
+    For quantile metrics it holds only users with in-window event values
+    (see quantile_user_values).
     """
-    in_window = _filter_events_by_metric(exposure_events, user_events, metric_config)
-
     agg_type = metric_config['aggregation']
-    all_users = exposure_events[['user_id', 'variant', 'experiment_id']].copy()
-
-    if agg_type == 'binary':
-        converted_users = in_window.groupby(['user_id', 'variant']).size().reset_index(name='metric_value')
-        converted_users['metric_value'] = 1
-        result = all_users.merge(converted_users, how='left', on=['user_id', 'variant'])
-        result['metric_value'] = result['metric_value'].fillna(0)
-
-    elif agg_type == 'sum':
-        in_window = in_window.copy()
-        # Make sure event_value exists and is numeric
-        if 'event_value' not in in_window.columns:
-            in_window['event_value'] = 0.0
-        in_window['event_value'] = pd.to_numeric(in_window['event_value'], errors='coerce').fillna(0.0)
-
-        purchased_users = (
-            in_window.groupby(['user_id', 'variant', 'experiment_id'])['event_value']
-            .sum()
-            .reset_index(name='metric_value')
-        )
-        result = all_users.merge(purchased_users, how='left', on=['user_id', 'variant'])
-        result['metric_value'] = result['metric_value'].fillna(0)
-
-    elif agg_type == 'count':
-        counted_users = in_window.groupby(['user_id', 'variant']).size().reset_index(name='metric_value')
-        result = all_users.merge(counted_users, how='left', on=['user_id', 'variant'])
-        result['metric_value'] = result['metric_value'].fillna(0)
+    if agg_type == 'quantile':
+        in_window = _filter_events_by_metric(exposure_events, user_events, metric_config)
+        return quantile_user_values(in_window, metric_config)[['user_id', 'variant', 'metric_value']]
 
-    else:
+    if agg_type not in ('binary', 'sum', 'count'):
         raise ValueError(f"Unsupported aggregation type: {agg_type}")
-
+    result = metric_users(windowed_user_metrics(exposure_events, user_events, metric_config), agg_type)
     return result[['user_id', 'variant', 'metric_value']]
 
 
-def analyze_metric_timeseries_exposed_daily(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict) -> pd.DataFrame:
+def _bucket_index(exposure_times: pd.Series, variant_values: pd.Series, time_unit: str):
     """
-    Exposed-based DAILY time series.
+    Flat bucket-major (bucket, variant) index of each row, with the bucket
+    dates (one per time_unit step from the earliest floored exposure time)
+    and the sorted variants. Rows without an exposure time or a variant get
+    -1, as groupby drops missing keys.
+    """
+    times = pd.to_datetime(exposure_times)
+    variant_codes, variants = pd.factorize(variant_values, sort=True)
+    valid = times.notna().to_numpy() & (variant_codes >= 0)
+    variants = variants.tolist()
+    if not valid.any():
+        return np.full(len(times), -1, dtype=np.int64), pd.DatetimeIndex([]), variants
+
+    # fixed-width floor on integer nanoseconds, as Series.dt.floor does
+    step = pd.Timedelta(time_unit).value
+    buckets = times.to_numpy(dtype='datetime64[ns]').astype(np.int64) // step
+    first = buckets[valid].min()
+    buckets -= first
+    dates = pd.date_range(pd.Timestamp(first * step), periods=int(buckets[valid].max()) + 1, freq=time_unit)
+    return np.where(valid, buckets * len(variants) + variant_codes, -1), dates, variants
+
+
+def _bucket_grid(frame: pd.DataFrame, columns: list, dates, variants: list) -> dict:
+    """
+    Dense (len(dates), len(variants)) float arrays of columns from a frame
+    keyed by date and variant, summing repeated keys and zero-filling the
+    rest. Rows outside dates or variants are dropped.
+    """
+    flat = pd.Index(dates).get_indexer(frame['date']) * len(variants) + pd.Index(variants).get_indexer(frame['variant'])
+    valid = flat >= 0
+    shape = (len(dates), len(variants))
+    return {
+        column: np.bincount(
+            flat[valid], weights=frame[column].to_numpy(dtype=float)[valid], minlength=shape[0] * shape[1]
+        ).reshape(shape)
+        for column in columns
+    }
+
+
+def _grid_keys(dates, variants: list, variant_major: bool = False) -> dict:
+    """date and variant columns enumerating a dense grid, bucket-major unless variant_major"""
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    variants = np.asarray(variants, dtype=object)
+    if variant_major:
+        return {'date': np.tile(dates, len(variants)), 'variant': np.repeat(variants, len(dates))}
+    return {'date': np.repeat(dates, len(variants)), 'variant': np.tile(variants, len(dates))}
+
+
+def _mean_or_zero(total: np.ndarray, n: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(n > 0, total / n, 0.0)
+
+
+def user_bucket_stats(metric_df: pd.DataFrame, time_unit: str) -> pd.DataFrame:
+    """
+    Per exposure-bucket user-level sufficient statistics of a metric table
+    with exposure times (see metric_users):
+      date, variant, n, sum, sum_sq
+    n counts exposed users, so the daily, cumulative and CI series all
+    derive from this one aggregation: a single bincount pass over integer
+    (bucket, variant) indexes, keeping the non-empty cells.
+    """
+    flat, dates, variants = _bucket_index(metric_df['exposure_time'], metric_df['variant'], time_unit)
+    valid = flat >= 0
+    flat = flat[valid]
+    values = metric_df['metric_value'].to_numpy(dtype=float)[valid]
+    values = np.where(np.isnan(values), 0.0, values)
+
+    size = len(dates) * len(variants)
+    n = np.bincount(flat, minlength=size)
+    present = n > 0
+    keys = _grid_keys(dates, variants)
+    return pd.DataFrame({
+        'date': keys['date'][present],
+        'variant': keys['variant'][present],
+        'n': n[present],
+        'sum': np.bincount(flat, weights=values, minlength=size)[present],
+        'sum_sq': np.bincount(flat, weights=values ** 2, minlength=size)[present],
+    })
+
+
+def daily_from_bucket_stats(bucket_stats: pd.DataFrame, variants: list, time_unit: str) -> pd.DataFrame:
+    """
+    Exposed-based daily series from user_bucket_stats: every user counts
+    toward the bucket of their exposure, with their in-window total.
 
     Output columns:
       date, variant, metric_value, exposed_users, metric_total
     """
-    exposure_events = exposure_events.copy()
-    exposure_events['exposure_time'] = pd.to_datetime(exposure_events['exposure_time'])
-    time_unit = _choose_time_unit(metric_config)
-
-    # bucket exposures
-    exposure_events['date'] = pd.to_datetime(exposure_events['exposure_time']).dt.floor(time_unit)
-    daily_exposed = (
-        exposure_events.groupby(['date', 'variant'])['user_id']
-        .nunique()
-        .reset_index(name='exposed_users')
+    return _complete_timeseries_grid(
+        bucket_stats.rename(columns={'n': 'exposed_users'}),
+        bucket_stats.rename(columns={'sum': 'metric_total'}),
+        variants, time_unit,
     )
 
-    in_window = _filter_events_by_metric(exposure_events, user_events, metric_config)
-    agg_type = metric_config['aggregation']
 
-    if in_window.empty:
-        result = daily_exposed.copy()
-        result['metric_total'] = 0.0
-        result['metric_value'] = 0.0
-        return result[['date', 'variant', 'metric_value', 'exposed_users', 'metric_total']]
+def analyze_metric_timeseries_exposed_daily(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict) -> pd.DataFrame:
+    """
+    Exposed-based DAILY time series.
 
-    in_window = in_window.copy()
+    Output columns:
+      date, variant, metric_value, exposed_users, metric_total
+    """
+    if metric_config['aggregation'] == 'quantile':
+        daily_exposed, bins, variants, time_unit = _quantile_bucket_bins(exposure_events, user_events, metric_config)
+        daily, _ = quantile_timeseries_from_bins(daily_exposed, bins, variants, time_unit, metric_config)
+        return daily
 
-    if agg_type == 'binary':
-        # first conversion per user (within window), then count by exposure date (not event date)
-        first_conv = (
-            in_window.sort_values('event_time')
-            .groupby(['user_id', 'variant'], as_index=False)
-            .first()[['user_id', 'variant', 'exposure_time']]
-        )
-        first_conv['date'] = pd.to_datetime(first_conv['exposure_time']).dt.floor(time_unit)
-        daily_metric = (
-            first_conv.groupby(['date', 'variant'])['user_id']
-            .nunique()
-            .reset_index(name='metric_total')
-        )
-        daily_metric['metric_total'] = daily_metric['metric_total'].astype(float)
-
-    elif agg_type == 'sum':
-        if 'event_value' not in in_window.columns:
-            in_window['event_value'] = 0.0
-        in_window['event_value'] = pd.to_numeric(in_window['event_value'], errors='coerce').fillna(0.0)
-        # Bucket by exposure_time (not event_time) to align with exposed_users
-        in_window['date'] = pd.to_datetime(in_window['exposure_time']).dt.floor(time_unit)
-        daily_metric = (
-            in_window.groupby(['date', 'variant'])['event_value']
-            .sum()
-            .reset_index(name='metric_total')
-        )
+    time_unit = _choose_time_unit(metric_config, _exposure_span(exposure_events))
+    metric_df = metric_users(windowed_user_metrics(exposure_events, user_events, metric_config), metric_config['aggregation'])
 
-    elif agg_type == 'count':
-        # Bucket by exposure_time (not event_time) to align with exposed_users
-        in_window['date'] = pd.to_datetime(in_window['exposure_time']).dt.floor(time_unit)
-        daily_metric = (
-            in_window.groupby(['date', 'variant'])
-            .size()
-            .reset_index(name='metric_total')
-        )
-        daily_metric['metric_total'] = daily_metric['metric_total'].astype(float)
+    variants = sorted(exposure_events['variant'].dropna().unique().tolist())
+    return daily_from_bucket_stats(user_bucket_stats(metric_df, time_unit), variants, time_unit)
 
-    else:
-        raise ValueError(f"Unsupported aggregation type: {agg_type}")
 
-    # Build a complete grid of (date x variant) from exposure timeline
-    variants = sorted(exposure_events['variant'].dropna().unique().tolist())
-    min_date = daily_exposed['date'].min()
-    max_date = daily_exposed['date'].max()
+def _complete_timeseries_grid(daily_exposed: pd.DataFrame, daily_metric: pd.DataFrame, variants: list, time_unit: str) -> pd.DataFrame:
+    """
+    Build a complete grid of (date x variant) from the exposure timeline and
+    fill in per-bucket exposed users (daily_exposed.exposed_users) and metric
+    totals (daily_metric.metric_total, summed over repeated keys).
+    """
+    all_dates = pd.date_range(start=daily_exposed['date'].min(), end=daily_exposed['date'].max(), freq=time_unit)
+    exposed = _bucket_grid(daily_exposed, ['exposed_users'], all_dates, variants)['exposed_users']
+    total = _bucket_grid(daily_metric, ['metric_total'], all_dates, variants)['metric_total']
+
+    return pd.DataFrame({
+        **_grid_keys(all_dates, variants),
+        'metric_value': _mean_or_zero(total, exposed).ravel(),
+        'exposed_users': exposed.ravel().astype(int),
+        'metric_total': total.ravel(),
+    })
 
-    all_dates = pd.date_range(start=min_date, end=max_date, freq=time_unit)
-    grid = pd.MultiIndex.from_product([all_dates, variants], names=['date', 'variant']).to_frame(index=False)
 
-    merged = (
-        grid.merge(daily_exposed, on=['date', 'variant'], how='left')
-            .merge(daily_metric, on=['date', 'variant'], how='left')
-    )
-    merged['exposed_users'] = merged['exposed_users'].fillna(0).astype(int)
-    merged['metric_total'] = merged['metric_total'].fillna(0.0).astype(float)
+def analyze_metric_timeseries_exposed_cumulative(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict) -> pd.DataFrame:
+    """
+    Exposed-based CUMULATIVE time series.
 
-    merged['metric_value'] = merged['metric_total'] / merged['exposed_users'].where(merged['exposed_users'] > 0, NA)
-    merged['metric_value'] = merged['metric_value'].fillna(0.0)
+    Output:
+      date, variant, metric_value, cum_exposed_users, cum_metric_total
+    """
+    if metric_config['aggregation'] == 'quantile':
+        daily_exposed, bins, variants, time_unit = _quantile_bucket_bins(exposure_events, user_events, metric_config)
+        _, cumulative = quantile_timeseries_from_bins(daily_exposed, bins, variants, time_unit, metric_config)
+        return cumulative
 
-    return merged[['date', 'variant', 'metric_value', 'exposed_users', 'metric_total']]
+    daily = analyze_metric_timeseries_exposed_daily(exposure_events, user_events, metric_config)
+    return cumulative_from_daily(daily)
 
 
-def analyze_metric_timeseries_exposed_cumulative(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict) -> pd.DataFrame:
+def cumulative_from_daily(daily: pd.DataFrame) -> pd.DataFrame:
     """
-    Exposed-based CUMULATIVE time series.
+    Accumulate a daily exposed-based series (see analyze_metric_timeseries_exposed_daily).
 
     Output:
       date, variant, metric_value, cum_exposed_users, cum_metric_total
     """
-    daily = analyze_metric_timeseries_exposed_daily(exposure_events, user_events, metric_config).copy()
-    daily = daily.sort_values(['variant', 'date'])
+    dates = np.sort(daily['date'].unique())
+    variants = sorted(daily['variant'].unique().tolist())
+    grid = _bucket_grid(daily, ['exposed_users', 'metric_total'], dates, variants)
+    # cells run bucket by bucket down axis 0, so accumulating is a cumsum per variant column
+    cum_exposed = grid['exposed_users'].cumsum(axis=0)
+    cum_total = grid['metric_total'].cumsum(axis=0)
+
+    return pd.DataFrame({
+        **_grid_keys(dates, variants, variant_major=True),
+        'metric_value': _mean_or_zero(cum_total, cum_exposed).T.ravel(),
+        'cum_exposed_users': cum_exposed.T.ravel().astype(int),
+        'cum_metric_total': cum_total.T.ravel(),
+    })
 
-    daily['cum_exposed_users'] = daily.groupby('variant')['exposed_users'].cumsum()
-    daily['cum_metric_total'] = daily.groupby('variant')['metric_total'].cumsum()
 
-    daily['metric_value'] = daily['cum_metric_total'] / daily['cum_exposed_users'].where(daily['cum_exposed_users'] > 0, NA)
-    daily['metric_value'] = daily['metric_value'].fillna(0.0)
+def _quantile_bucket_bins(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict):
+    """
+    Per-bucket exposed users and per-(bucket, variant) sketches of user
+    values (see quantile_user_values) for a quantile metric, both bucketed
+    by exposure time. Returns (daily_exposed, bins, variants, time_unit).
+    """
+    time_unit = _choose_time_unit(metric_config, _exposure_span(exposure_events))
+    in_window = _filter_events_by_metric(exposure_events, user_events, metric_config)
+    daily_exposed, bins, variants = quantile_bucket_bins(
+        exposure_events, quantile_user_values(in_window, metric_config), time_unit
+    )
+    return daily_exposed, bins, variants, time_unit
 
-    return daily[['date', 'variant', 'metric_value', 'cum_exposed_users', 'cum_metric_total']]
+
+def quantile_bucket_bins(exposure_events: pd.DataFrame, user_values: pd.DataFrame, time_unit: str,
+                         max_bins: int = SKETCH_MAX_BINS):
+    """
+    _quantile_bucket_bins over an already computed quantile_user_values
+    table. Returns (daily_exposed, bins, variants).
+    """
+    flat, dates, variants = _bucket_index(exposure_events['exposure_time'], exposure_events['variant'], time_unit)
+    exposed = np.bincount(flat[flat >= 0], minlength=len(dates) * len(variants))
+    daily_exposed = pd.DataFrame({**_grid_keys(dates, variants), 'exposed_users': exposed})
+    daily_exposed = daily_exposed[exposed > 0].reset_index(drop=True)
+
+    values = user_values.assign(date=pd.to_datetime(user_values['exposure_time']).dt.floor(time_unit))
+    bins = bin_counts(values, ['date', 'variant'], max_bins=max_bins)
+    return daily_exposed, bins, variants
+
+
+def _bucket_quantiles(bins: pd.DataFrame, dates: list, variants: list, q: float, cumulative: bool) -> pd.DataFrame:
+    """
+    Quantile with its order-statistic CI per (date, variant) from
+    per-bucket sketches, merging buckets up to each date when cumulative.
+
+    Output columns:
+      date, variant, metric_value, ci_lower, ci_upper, sample_size
+    """
+    frames = []
+    for variant in variants:
+        counts = (
+            bins[bins['variant'] == variant]
+            .pivot_table(index='date', columns='key', values='count', aggfunc='sum', fill_value=0)
+            .reindex(dates, fill_value=0)
+        )
+        matrix = counts.to_numpy(dtype=np.int64)
+        keys = counts.columns.to_numpy(dtype=np.int64)
+        if cumulative:
+            matrix = matrix.cumsum(axis=0)
+        n = matrix.sum(axis=1)
+        lower, upper = quantile_ci_ranks(n, q)
+        frames.append(pd.DataFrame({
+            'date': dates,
+            'variant': variant,
+            'metric_value': values_at_ranks(matrix, keys, quantile_rank(n, q)),
+            'ci_lower': values_at_ranks(matrix, keys, lower),
+            'ci_upper': values_at_ranks(matrix, keys, upper),
+            'sample_size': n,
+        }))
+    columns = ['date', 'variant', 'metric_value', 'ci_lower', 'ci_upper', 'sample_size']
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+def quantile_timeseries_from_bins(daily_exposed: pd.DataFrame, bins: pd.DataFrame, variants: list, time_unit: str, metric_config: dict):
+    """
+    Daily and cumulative series of a quantile metric from per-(date, variant)
+    sketches of per-user values (date, variant, key, count; see
+    quantile_user_values), dated by exposure. metric_total holds the number
+    of users with a value; metric_value is the quantile of their values
+    within the bucket, or up to it when cumulative.
+
+    Returns (daily, cumulative) shaped like analyze_metric_timeseries_exposed_daily
+    and cumulative_from_daily.
+    """
+    q = float(metric_config.get('quantile', 0.5))
+    daily = _complete_timeseries_grid(daily_exposed, bins.rename(columns={'count': 'metric_total'}), variants, time_unit)
+    cumulative = cumulative_from_daily(daily)
+
+    dates = sorted(daily['date'].unique())
+    for frame, accumulate in ((daily, False), (cumulative, True)):
+        quantiles = _bucket_quantiles(bins, dates, variants, q, accumulate)
+        values = frame[['date', 'variant']].merge(
+            quantiles[['date', 'variant', 'metric_value']], on=['date', 'variant'], how='left'
+        )['metric_value']
+        frame['metric_value'] = values.fillna(0.0).to_numpy()
+
+    return daily, cumulative
+
+
+def quantile_ci_timeseries_from_bins(bins: pd.DataFrame, dates: list, variants: list, metric_config: dict) -> pd.DataFrame:
+    """
+    Cumulative quantile and its order-statistic confidence interval per
+    date (see ci_timeseries_from_bucket_stats), over per-user values;
+    sample_size counts the users with a value.
+    """
+    ci = _bucket_quantiles(bins, list(dates), variants, float(metric_config.get('quantile', 0.5)), cumulative=True)
+    ci[['metric_value', 'ci_lower', 'ci_upper']] = ci[['metric_value', 'ci_lower', 'ci_upper']].fillna(0.0)
+    ci['sample_size'] = ci['sample_size'].astype(int)
+    return ci
+
+
+def quantile_distribution_from_bins(bins: pd.DataFrame, variants: list, metric_config: dict) -> dict:
+    """
+    Histogram and summary quantiles per variant from per-variant sketches
+    (variant, key, count). Raw values are not kept, so unlike the sum/count
+    distribution there is no 'values' list.
+    """
+    q = float(metric_config.get('quantile', 0.5))
+    distribution_data = {}
+    for variant in variants:
+        sketch = QuantileSketch.from_bins(bins[bins['variant'] == variant])
+        if sketch.n == 0:
+            counts, bin_edges = np.zeros(10, dtype=int), np.linspace(0, 1, 11)
+        else:
+            counts, bin_edges = sketch.histogram()
+        distribution_data[f'variant_{variant}'] = {
+            'type': 'histogram',
+            'bins': bin_edges.tolist(),
+            'counts': counts.tolist(),
+            'zero_count': sketch.zero_count(),
+            'n': sketch.n,
+            'mean': sketch.mean(),
+            'median': sketch.quantile(0.5),
+            'std': sketch.std(),
+            'p25': sketch.quantile(0.25),
+            'p75': sketch.quantile(0.75),
+            'p95': sketch.quantile(0.95),
+            'quantile': q,
+            'quantile_value': sketch.quantile(q),
+        }
+    return distribution_data
 
 
 def analyze_metric_distribution(exposure_events: pd.DataFrame, user_events: pd.DataFrame, metric_config: dict) -> dict:
@@ -216,10 +626,19 @@ def analyze_metric_distribution(exposure_events: pd.DataFrame, user_events: pd.D
         'variant_B': {...}
     }
     """
-    # Get user-level metric data
-    metric_df = analyze_metric(exposure_events, user_events, metric_config)
     agg_type = metric_config['aggregation']
-    
+    if agg_type == 'quantile':
+        _, bins, variants, _ = _quantile_bucket_bins(exposure_events, user_events, metric_config)
+        # sketches merge by adding counts, so per-bucket sketches roll up per variant
+        variant_bins = bins.groupby(['variant', 'key'], as_index=False)['count'].sum()
+        return quantile_distribution_from_bins(variant_bins, variants, metric_config)
+
+    metric_df = analyze_metric(exposure_events, user_events, metric_config)
+    return distribution_from_metric_users(metric_df, agg_type)
+
+
+def distribution_from_metric_users(metric_df: pd.DataFrame, agg_type: str) -> dict:
+    """Per-variant distribution (see analyze_metric_distribution) of a user-level metric table"""
     variants = sorted(metric_df['variant'].unique())
     distribution_data = {}
     
@@ -281,7 +700,16 @@ def analyze_relative_lift_timeseries(exposure_events: pd.DataFrame, user_events:
       date, lift, variant_a_value, variant_b_value
     """
     cumulative = analyze_metric_timeseries_exposed_cumulative(exposure_events, user_events, metric_config)
-    
+    return relative_lift_from_cumulative(cumulative)
+
+
+def relative_lift_from_cumulative(cumulative: pd.DataFrame) -> pd.DataFrame:
+    """
+    Relative lift of B over A from a cumulative series (see cumulative_from_daily).
+
+    Output columns:
+      date, lift, variant_a_value, variant_b_value, significant
+    """
     # Pivot to get A and B side by side
     pivot = cumulative.pivot(index='date', columns='variant', values='metric_value').reset_index()
     
@@ -314,74 +742,57 @@ def analyze_ci_timeseries(exposure_events: pd.DataFrame, user_events: pd.DataFra
     Output columns:
       date, variant, metric_value, ci_lower, ci_upper, sample_size
     """
-    cumulative = analyze_metric_timeseries_exposed_cumulative(exposure_events, user_events, metric_config)
-    
-    # Get user-level data to calculate CIs at each time point
-    metric_df = analyze_metric(exposure_events, user_events, metric_config)
-    exposure_events = exposure_events.copy()
-    exposure_events['exposure_time'] = pd.to_datetime(exposure_events['exposure_time'])
-    time_unit = _choose_time_unit(metric_config)
-    exposure_events['date'] = exposure_events['exposure_time'].dt.floor(time_unit)
-    
-    # Merge to get exposure date for each user
-    metric_with_date = metric_df.merge(
-        exposure_events[['user_id', 'date']].drop_duplicates('user_id'),
-        on='user_id',
-        how='left'
-    )
-    
-    agg_type = metric_config['aggregation']
-    variants = sorted(cumulative['variant'].unique())
-    dates = sorted(cumulative['date'].unique())
-    
-    ci_results = []
-    
-    for variant in variants:
-        variant_data = metric_with_date[metric_with_date['variant'] == variant].copy()
-        variant_data = variant_data.sort_values('date')
-        
-        for current_date in dates:
-            # Get all users exposed up to this date
-            users_to_date = variant_data[variant_data['date'] <= current_date]['metric_value']
-            
-            if len(users_to_date) < 2:
-                ci_results.append({
-                    'date': current_date,
-                    'variant': variant,
-                    'metric_value': 0.0,
-                    'ci_lower': 0.0,
-                    'ci_upper': 0.0,
-                    'sample_size': len(users_to_date)
-                })
-                continue
-            
-            n = len(users_to_date)
-            
-            if agg_type == 'binary':
-                # Binomial confidence interval
-                conversions = users_to_date.sum()
-                rate = conversions / n
-                ci = stats.binom.interval(0.95, n, rate)
-                ci_lower = ci[0] / n
-                ci_upper = ci[1] / n
-                metric_value = rate
-                
-            else:  # sum or count
-                # T-distribution confidence interval
-                mean = users_to_date.mean()
-                se = stats.sem(users_to_date)
-                ci = stats.t.interval(0.95, n-1, mean, se)
-                ci_lower = ci[0]
-                ci_upper = ci[1]
-                metric_value = mean
-            
-            ci_results.append({
-                'date': current_date,
-                'variant': variant,
-                'metric_value': metric_value,
-                'ci_lower': ci_lower,
-                'ci_upper': ci_upper,
-                'sample_size': n
-            })
-    
-    return pd.DataFrame(ci_results)
+    if metric_config['aggregation'] == 'quantile':
+        daily_exposed, bins, variants, time_unit = _quantile_bucket_bins(exposure_events, user_events, metric_config)
+        dates = pd.date_range(daily_exposed['date'].min(), daily_exposed['date'].max(), freq=time_unit)
+        return quantile_ci_timeseries_from_bins(bins, dates, variants, metric_config)
+
+    time_unit = _choose_time_unit(metric_config, _exposure_span(exposure_events))
+    metric_df = metric_users(windowed_user_metrics(exposure_events, user_events, metric_config), metric_config['aggregation'])
+    bucket_stats = user_bucket_stats(metric_df, time_unit)
+
+    variants = sorted(exposure_events['variant'].dropna().unique().tolist())
+    dates = pd.date_range(bucket_stats['date'].min(), bucket_stats['date'].max(), freq=time_unit)
+
+    return ci_timeseries_from_bucket_stats(bucket_stats, dates, variants, metric_config['aggregation'])
+
+
+def ci_timeseries_from_bucket_stats(bucket_stats: pd.DataFrame, dates: list, variants: list, agg_type: str) -> pd.DataFrame:
+    """
+    Cumulative confidence intervals from per-bucket user-level sufficient
+    statistics (date, variant, n, sum, sum_sq), bucketed by exposure date.
+
+    Output columns:
+      date, variant, metric_value, ci_lower, ci_upper, sample_size
+    """
+    columns = ['date', 'variant', 'metric_value', 'ci_lower', 'ci_upper', 'sample_size']
+    if len(dates) == 0 or len(variants) == 0:
+        return pd.DataFrame(columns=columns)
+
+    grid = _bucket_grid(bucket_stats, ['n', 'sum', 'sum_sq'], dates, variants)
+    # variant-major rows: each variant's buckets in date order
+    n, total, total_sq = (grid[column].cumsum(axis=0).T.ravel() for column in ('n', 'sum', 'sum_sq'))
+    enough = n >= 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(enough, total / n, 0.0)
+        if agg_type == 'binary':
+            # Binomial confidence interval
+            ci = stats.binom.interval(0.95, n, mean)
+            ci_lower = ci[0] / n
+            ci_upper = ci[1] / n
+        else:  # sum or count
+            # T-distribution confidence interval
+            var = np.maximum(total_sq - total * mean, 0.0) / (n - 1)
+            se = np.sqrt(var / n)
+            ci = stats.t.interval(0.95, n - 1, mean, se)
+            ci_lower = ci[0]
+            ci_upper = ci[1]
+
+    return pd.DataFrame({
+        **_grid_keys(dates, variants, variant_major=True),
+        'metric_value': mean,
+        'ci_lower': np.where(enough, ci_lower, 0.0),
+        'ci_upper': np.where(enough, ci_upper, 0.0),
+        'sample_size': n.astype(int),
+    })[columns]
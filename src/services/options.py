@@ -0,0 +1,25 @@
+"""
+Analysis option names shared by the API and the analysis services. Kept
+free of pandas/scipy imports so requests can be validated before the
+analysis stack is loaded.
+"""
+
+# Chart sections computed on top of the summary stat test for each metric
+ANALYSIS_SECTIONS = ('daily', 'cumulative', 'distribution', 'lift', 'ci')
+# Sections derived from per-bucket sufficient statistics alone
+BUCKET_SECTIONS = ('daily', 'cumulative', 'lift', 'ci')
+# Key of each section in a metric's analysis result
+SECTION_RESULT_KEYS = {
+    'daily': 'daily_timeseries',
+    'cumulative': 'cumulative_timeseries',
+    'distribution': 'distribution',
+    'lift': 'lift_timeseries',
+    'ci': 'ci_timeseries',
+}
+# Sections holding a time series, and their columnar encodings (see services.series)
+SERIES_SECTIONS = ('daily', 'cumulative', 'lift', 'ci')
+SERIES_FORMATS = ('json', 'arrow')
+# How a quantile metric reduces each user's in-window event values to one value
+QUANTILE_USER_VALUES = ('sum', 'mean')
+# Shapes of pre-aggregated uploads (see services.aggregated)
+AGGREGATED_INPUT_MODES = ('users', 'buckets')
@@ -0,0 +1,213 @@
+"""
+Parallel per-metric execution.
+
+Metrics are independent until the multiple-testing correction, so
+run_experiment_analysis can fan them out across a process pool, one task per
+group of metrics sharing an event (see plan_event_groups). The
+exposures and events columns are encoded once into numeric arrays placed in
+shared memory; each task only pickles a small manifest (segment names,
+dtypes and the few category labels), and workers rebuild the frames on top
+of the shared buffers instead of receiving a pickled copy per metric.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+
+from .instrumentation import collect_timings, record_timings
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", os.cpu_count() or 1))
+# Below this many event rows, process start-up and transfer cost more than they save
+PARALLEL_MIN_EVENTS = int(os.getenv("PARALLEL_MIN_EVENTS", 100_000))
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool shared by all requests, created on first use"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            _executor_workers = max_workers
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    """Drop a pool whose worker died, so the next analysis starts a fresh one"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+            _executor_workers = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def should_parallelize(groups: list, events_df: pd.DataFrame, max_workers=None) -> bool:
+    workers = ANALYSIS_WORKERS if max_workers is None else max_workers
+    return workers > 1 and len(groups) > 1 and len(events_df) >= PARALLEL_MIN_EVENTS
+
+
+class SharedColumns:
+    """
+    DataFrame columns copied once into shared memory segments.
+
+    Numeric and datetime columns are stored as-is, except that tz-aware
+    datetimes are stored as UTC with their timezone kept in the manifest;
+    string-like columns are
+    stored as integer codes with their (small) category labels kept in the
+    manifest. Columns given precomputed codes keep just the codes, which is
+    enough for columns only used as join/group keys, such as user_id.
+    """
+
+    def __init__(self):
+        self.segments = []
+        self.manifest = {}
+
+    def _put(self, array: np.ndarray) -> dict:
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            # the buffer would hold pointers into this process's heap
+            raise TypeError('object arrays cannot be placed in shared memory')
+        segment = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[:] = array
+        self.segments.append(segment)
+        return {'name': segment.name, 'dtype': array.dtype.str, 'length': len(array)}
+
+    def add_frame(self, key: str, df: pd.DataFrame, codes: dict | None = None):
+        """
+        Share df's columns under key. codes maps column -> precomputed integer
+        codes to store instead of the column values (labels are not kept).
+        """
+        codes = codes or {}
+        columns = {}
+        for column in df.columns:
+            series = df[column]
+            if column in codes:
+                columns[column] = {'kind': 'codes', **self._put(codes[column])}
+            elif isinstance(series.dtype, pd.DatetimeTZDtype):
+                utc = series.dt.tz_convert('UTC').dt.tz_localize(None)
+                columns[column] = {'kind': 'values', 'tz': str(series.dt.tz), **self._put(utc.to_numpy())}
+            elif pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_numeric_dtype(series):
+                columns[column] = {'kind': 'values', **self._put(series.to_numpy())}
+            else:
+                column_codes, labels = pd.factorize(series)
+                columns[column] = {
+                    'kind': 'labels',
+                    'labels': labels.tolist(),
+                    **self._put(column_codes),
+                }
+        self.manifest[key] = columns
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+
+
+def _load_frame(columns: dict, segments: list) -> pd.DataFrame:
+    """Rebuild a DataFrame over attached shared segments"""
+    data = {}
+    for column, spec in columns.items():
+        # spawned workers share the parent's resource tracker, which unlinks the segment
+        segment = SharedMemory(name=spec['name'])
+        segments.append(segment)
+        values = np.ndarray((spec['length'],), dtype=np.dtype(spec['dtype']), buffer=segment.buf)
+        if spec['kind'] == 'labels':
+            values = np.asarray(spec['labels'], dtype=object)[values]
+        elif spec.get('tz'):
+            values = pd.DatetimeIndex(values).tz_localize('UTC').tz_convert(spec['tz'])
+        data[column] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def _run_metric_task(manifest: dict, metric_configs: list, max_points=None, sections=None):
+    """Worker entry point: analyze one metric group over the shared frames"""
+    from .analysis import analyze_metric_group
+
+    segments = []
+    try:
+        exp_exposures = _load_frame(manifest['exposures'], segments)
+        events_df = _load_frame(manifest['events'], segments)
+        user_segments = _load_frame(manifest['user_segments'], segments) if 'user_segments' in manifest else None
+        with collect_timings() as timings:
+            analyses = analyze_metric_group(
+                exp_exposures, events_df, metric_configs, max_points, sections, segments=user_segments
+            )
+        del exp_exposures, events_df, user_segments
+    finally:
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # a view is still referenced; the mapping is released with it
+                pass
+    return analyses, timings
+
+
+def analyze_metrics_parallel(exp_exposures: pd.DataFrame, events_df: pd.DataFrame, metric_configs: list, groups: list,
+                             max_workers=None, max_points=None, sections=None, user_segments=None) -> list:
+    """
+    Run analyze_metric_group for every group of metric positions (see
+    plan_event_groups) across the process pool and return the analyses in
+    metric order. Progress is reported per metric as groups complete.
+    """
+    from .analysis import report_metric_done
+
+    workers = min(ANALYSIS_WORKERS if max_workers is None else max_workers, len(groups))
+
+    # frames come from prepare_experiment_data: parsed, and events limited to the metrics' names
+    exposures = exp_exposures[['user_id', 'experiment_id', 'variant', 'exposure_time']]
+    events = events_df
+
+    # Workers only need user_id for joins and grouping, so share codes
+    # factorized jointly across the frames instead of the ids themselves
+    frames = {'exposures': exposures, 'events': events}
+    if user_segments is not None:
+        frames['user_segments'] = user_segments
+    user_codes, _ = pd.factorize(pd.concat([frame['user_id'] for frame in frames.values()], ignore_index=True))
+
+    shared = SharedColumns()
+    try:
+        offset = 0
+        for key, frame in frames.items():
+            shared.add_frame(key, frame, codes={'user_id': user_codes[offset:offset + len(frame)]})
+            offset += len(frame)
+
+        executor = _get_executor(workers)
+        try:
+            futures = {
+                executor.submit(
+                    _run_metric_task, shared.manifest, [metric_configs[position] for position in group], max_points,
+                    sections
+                ): group
+                for group in groups
+            }
+            analyses = [None] * len(metric_configs)
+            done = 0
+            for future in as_completed(futures):
+                group_analyses, timings = future.result()
+                record_timings(timings)
+                for position, analysis in zip(futures[future], group_analyses):
+                    done += 1
+                    report_metric_done(done, len(metric_configs), metric_configs[position], analysis)
+                    analyses[position] = analysis
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            raise
+    finally:
+        shared.close()
+
+    return analyses
@@ -0,0 +1,543 @@
+"""
+Postgres-resident raw data and in-database analysis engine.
+
+Raw exposures and events are bulk-loaded with COPY into the partitioned
+tables raw_exposures and raw_events, one list partition per raw dataset (a
+single experiment's upload). Each partition is loaded as a plain table and
+attached afterwards, so its indexes, on (user_id) for both tables and on
+(event_name, event_time) for events, are built once over the loaded rows
+rather than maintained row by row. user_id is stored as text, each id's
+canonical key (see services.user_ids), so an id read as 1 from one file and
+1.0 from the other still joins.
+
+The analysis expresses the first-exposure table, the exposure/event window
+join and the binary/sum/count aggregations as SQL over a dataset's
+partitions, like services.duckdb_engine does over files: only per-variant
+and per-bucket aggregates, sketch bin counts of quantile metrics and a
+bounded sample of user-level values for the distribution chart come back to
+pandas. A dataset can be re-analyzed with any metrics config without
+uploading it again. Segment breakdowns are not supported.
+
+Functions take a SQLAlchemy connection to a PostgreSQL database (14 or
+later, for date_bin) and run inside its current transaction; temporary
+tables are dropped when it ends.
+"""
+import io
+import os
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+from .load import iter_table, EXPOSURES_READ_COLUMNS, EVENTS_READ_COLUMNS
+from .metric_analysis import plan_metric_groups, quantile_user_value, _choose_time_unit
+from .sketches import QuantileSketch, collapse_bins, LOG_GAMMA, KEY_BIAS, MIN_INDEXABLE_VALUE
+from .stat_tests import run_stat_tests_from_summary, run_quantile_test, sample_ratio_check
+from .analysis import (
+    report_metric_done,
+    _bucket_sections,
+    _quantile_bin_sections,
+    _experiment_results,
+)
+from .instrumentation import timed
+from .options import ANALYSIS_SECTIONS, BUCKET_SECTIONS
+from .progress import report_progress
+from .user_ids import canonical_user_ids
+
+# Rows per COPY batch while loading a dataset
+POSTGRES_COPY_CHUNK_ROWS = int(os.getenv("POSTGRES_COPY_CHUNK_ROWS", 500_000))
+# work_mem for the analysis transaction: sorts and hash aggregates above it spill to disk
+POSTGRES_WORK_MEM = os.getenv("POSTGRES_WORK_MEM", "256MB")
+
+# Upper bound on user-level values returned for the distribution histogram
+DISTRIBUTION_SAMPLE_SIZE = 10_000
+
+RAW_TABLES_DDL = """
+    CREATE TABLE IF NOT EXISTS raw_exposures (
+        dataset_id integer NOT NULL,
+        user_id text,
+        variant text,
+        exposure_time timestamp
+    ) PARTITION BY LIST (dataset_id);
+    CREATE INDEX IF NOT EXISTS ix_raw_exposures_user_id ON raw_exposures (user_id);
+
+    CREATE TABLE IF NOT EXISTS raw_events (
+        dataset_id integer NOT NULL,
+        user_id text,
+        event_name text,
+        event_time timestamp,
+        event_value double precision
+    ) PARTITION BY LIST (dataset_id);
+    CREATE INDEX IF NOT EXISTS ix_raw_events_user_id ON raw_events (user_id);
+    CREATE INDEX IF NOT EXISTS ix_raw_events_event_name_event_time ON raw_events (event_name, event_time);
+"""
+# Arbitrary advisory lock key serializing the creation of the raw tables
+RAW_TABLES_LOCK = 0x0AB0EA7A
+
+
+def _quote(value: str) -> str:
+    """Quote a string literal for inlining into SQL"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _interval(value) -> str:
+    """SQL interval literal for a window bound such as '0h' or '7d'"""
+    return f"INTERVAL '{pd.Timedelta(value).total_seconds()} seconds'"
+
+
+def _bucket(column: str, time_unit: str) -> str:
+    """SQL expression flooring a timestamp to time_unit, aligned like pandas' dt.floor"""
+    seconds = to_offset(time_unit).nanos / 1e9
+    return f"date_bin(INTERVAL '{seconds} seconds', {column}, TIMESTAMP '1970-01-01')"
+
+
+def _partition(table: str, dataset_id: int) -> str:
+    return f"{table}_{int(dataset_id)}"
+
+
+def _df(con, sql: str) -> pd.DataFrame:
+    result = con.exec_driver_sql(sql)
+    return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+def ensure_raw_tables(con):
+    """Create the partitioned raw tables and their indexes if they don't exist yet"""
+    if con.exec_driver_sql("SELECT to_regclass('raw_events')").scalar() is None:
+        con.exec_driver_sql(f"SELECT pg_advisory_xact_lock({RAW_TABLES_LOCK})")
+        con.exec_driver_sql(RAW_TABLES_DDL)
+
+
+def _copy_chunks(con, table: str, columns: list, chunks) -> int:
+    """COPY DataFrame chunks with the given columns into table; returns the rows copied"""
+    cursor = con.connection.cursor()
+    rows = 0
+    try:
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            buffer = io.StringIO()
+            chunk[columns].to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            rows += len(chunk)
+    finally:
+        cursor.close()
+    return rows
+
+
+def _load_partition(con, table: str, dataset_id: int, columns: list, chunks) -> int:
+    """
+    Load a dataset's partition of table as a standalone table, then attach
+    it: the CHECK constraint lets ATTACH skip its validation scan, and the
+    parent's indexes are built on the attached rows in one pass.
+    """
+    partition = _partition(table, dataset_id)
+    con.exec_driver_sql(f"CREATE TABLE {partition} (LIKE {table})")
+    con.exec_driver_sql(f"ALTER TABLE {partition} ALTER COLUMN dataset_id SET DEFAULT {int(dataset_id)}")
+    rows = _copy_chunks(con, partition, columns, chunks)
+    con.exec_driver_sql(f"ALTER TABLE {partition} ADD CHECK (dataset_id = {int(dataset_id)})")
+    con.exec_driver_sql(f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES IN ({int(dataset_id)})")
+    con.exec_driver_sql(f"ANALYZE {partition}")
+    return rows
+
+
+def _exposure_chunks(exposures_path, experiment_id, chunk_rows: int):
+    chunks = iter_table(
+        exposures_path, columns=EXPOSURES_READ_COLUMNS, filters={'experiment_id': [experiment_id]}, chunk_rows=chunk_rows
+    )
+    for chunk in chunks:
+        chunk = chunk[chunk['experiment_id'].astype(str) == str(experiment_id)]
+        yield chunk.assign(
+            user_id=canonical_user_ids(chunk['user_id']), exposure_time=pd.to_datetime(chunk['exposure_time'])
+        )
+
+
+def _event_chunks(events_path, chunk_rows: int):
+    for chunk in iter_table(events_path, columns=EVENTS_READ_COLUMNS, chunk_rows=chunk_rows):
+        chunk = chunk.assign(user_id=canonical_user_ids(chunk['user_id']), event_time=pd.to_datetime(chunk['event_time']))
+        if 'event_value' in chunk.columns:
+            chunk['event_value'] = pd.to_numeric(chunk['event_value'], errors='coerce')
+        yield chunk
+
+
+def ingest_raw_data(con, dataset_id: int, experiment_id, exposures_path, events_path, has_event_value: bool,
+                    chunk_rows: int = POSTGRES_COPY_CHUNK_ROWS) -> dict:
+    """
+    Load the experiment's exposures and every event of the files (later
+    metrics configs may refer to any of them) into dataset_id's partitions.
+    Returns the rows loaded; raises ValueError if the experiment has no
+    exposures.
+    """
+    ensure_raw_tables(con)
+    with timed('copy_exposures'):
+        exposures_rows = _load_partition(
+            con, 'raw_exposures', dataset_id, ['user_id', 'variant', 'exposure_time'],
+            _exposure_chunks(exposures_path, experiment_id, chunk_rows)
+        )
+    if exposures_rows == 0:
+        raise ValueError(f"No exposure data found for experiment_id: {experiment_id}")
+    report_progress('copied', table='exposures', rows=exposures_rows)
+
+    with timed('copy_events'):
+        events_rows = _load_partition(
+            con, 'raw_events', dataset_id,
+            ['user_id', 'event_name', 'event_time'] + (['event_value'] if has_event_value else []),
+            _event_chunks(events_path, chunk_rows)
+        )
+    report_progress('copied', table='events', rows=events_rows)
+    return {'exposures_rows': exposures_rows, 'events_rows': events_rows}
+
+
+def drop_raw_data(con, dataset_id: int):
+    """Drop a dataset's partitions"""
+    for table in ('raw_exposures', 'raw_events'):
+        con.exec_driver_sql(f"DROP TABLE IF EXISTS {_partition(table, dataset_id)}")
+
+
+def _register_exposures(con, dataset_id: int):
+    """First-exposure table of the dataset (see metric_analysis.first_exposures)"""
+    con.exec_driver_sql(f"SET LOCAL work_mem = {_quote(POSTGRES_WORK_MEM)}")
+    con.exec_driver_sql("DROP TABLE IF EXISTS exp_exposures")
+    con.exec_driver_sql(f"""
+        CREATE TEMP TABLE exp_exposures ON COMMIT DROP AS
+        SELECT
+            user_id,
+            (array_agg(variant ORDER BY exposure_time, variant))[1] AS variant,
+            MIN(exposure_time) AS exposure_time,
+            COUNT(*) AS exposure_count,
+            COUNT(DISTINCT variant) > 1 AS multi_variant
+        FROM raw_exposures
+        WHERE dataset_id = {int(dataset_id)}
+        GROUP BY user_id
+    """)
+    con.exec_driver_sql("CREATE INDEX ON exp_exposures (user_id)")
+    con.exec_driver_sql("ANALYZE exp_exposures")
+
+
+def _in_window_sql(dataset_id: int, metric_config: dict) -> str:
+    """Windowed event/exposure join for one metric (see _filter_events_by_metric)"""
+    return f"""
+        SELECT
+            e.user_id,
+            x.variant,
+            x.exposure_time,
+            e.event_time,
+            e.event_value
+        FROM raw_events e
+        JOIN exp_exposures x ON e.user_id = x.user_id
+        WHERE e.dataset_id = {int(dataset_id)}
+          AND e.event_name = {_quote(metric_config['event']['name'])}
+          AND e.event_time - x.exposure_time >= {_interval(metric_config['window']['start'])}
+          AND e.event_time - x.exposure_time <= {_interval(metric_config['window']['end'])}
+    """
+
+
+def _register_metric_group(con, dataset_id: int, metric_configs: list) -> str:
+    """
+    Windowed join and user-level table (see user_metric_table) shared by
+    metrics with the same event and window, kept in the database:
+      group_users: user_id, variant, exposure_time, binary, count, sum
+    The join is materialized as group_events only when quantile metrics
+    read it again. Returns the relation quantile queries select from.
+    """
+    in_window = _in_window_sql(dataset_id, metric_configs[0])
+    con.exec_driver_sql("DROP TABLE IF EXISTS group_events")
+    if any(m['aggregation'] == 'quantile' for m in metric_configs):
+        con.exec_driver_sql(f"CREATE TEMP TABLE group_events ON COMMIT DROP AS {in_window}")
+        group_events = 'group_events'
+    else:
+        group_events = f"({in_window}) AS group_events"
+
+    con.exec_driver_sql("DROP TABLE IF EXISTS group_users")
+    if any(m['aggregation'] != 'quantile' for m in metric_configs):
+        con.exec_driver_sql(f"""
+            CREATE TEMP TABLE group_users ON COMMIT DROP AS
+            WITH per_user AS (
+                SELECT user_id, COUNT(*) AS count, SUM(event_value) AS sum
+                FROM {group_events}
+                GROUP BY user_id
+            )
+            SELECT
+                x.user_id,
+                x.variant,
+                x.exposure_time,
+                CASE WHEN p.count > 0 THEN 1.0 ELSE 0.0 END::double precision AS "binary",
+                COALESCE(p.count, 0)::double precision AS "count",
+                COALESCE(p.sum, 0.0) AS "sum"
+            FROM exp_exposures x
+            LEFT JOIN per_user p ON x.user_id = p.user_id
+        """)
+    return group_events
+
+
+def _metric_column(metric_config: dict) -> str:
+    agg_type = metric_config['aggregation']
+    if agg_type not in ('binary', 'sum', 'count'):
+        raise ValueError(f"Unsupported aggregation type: {agg_type}")
+    return f'"{agg_type}"'
+
+
+def _sketch_key_sql(column: str) -> str:
+    """sketches.sketch_keys as a SQL expression"""
+    return f"""
+        CASE WHEN abs({column}) <= {MIN_INDEXABLE_VALUE} THEN 0
+             ELSE (sign({column}) * (ceil(ln(abs({column})) / {LOG_GAMMA!r}) + {KEY_BIAS}))::bigint
+        END
+    """
+
+
+# SQL aggregate of each quantile user_value (see quantile_user_values)
+USER_VALUE_AGGREGATES = {'sum': 'SUM', 'mean': 'AVG'}
+
+
+def _quantile_bins(con, group_events: str, metric_config: dict, time_unit: str | None = None) -> pd.DataFrame:
+    """
+    Sketches of the group's user values (see quantile_user_values) per
+    variant (and per exposure bucket when time_unit is given):
+    (date,) variant, key, count
+    """
+    by = ['date', 'variant'] if time_unit else ['variant']
+    date_sql = f"{_bucket('exposure_time', time_unit)} AS date, " if time_unit else ""
+    aggregate = USER_VALUE_AGGREGATES[quantile_user_value(metric_config)]
+    bins = _df(con, f"""
+        WITH user_values AS (
+            SELECT user_id, MIN(variant) AS variant, MIN(exposure_time) AS exposure_time,
+                   {aggregate}(event_value) AS metric_value
+            FROM {group_events}
+            WHERE event_value IS NOT NULL
+            GROUP BY user_id
+        )
+        SELECT {date_sql}variant, {_sketch_key_sql('metric_value')} AS key, COUNT(*) AS count
+        FROM user_values
+        GROUP BY {', '.join(str(i) for i in range(1, len(by) + 2))}
+    """)
+    bins = bins.astype({'key': np.int64, 'count': np.int64})
+    return collapse_bins(bins, by)
+
+
+def _summary(con, column: str) -> pd.DataFrame:
+    """Per-variant sufficient statistics of a group_users column (see stat_tests.summarize_metric)"""
+    return _df(con, f"""
+        SELECT variant, COUNT(*) AS n, SUM({column}) AS sum, SUM({column} * {column}) AS sum_sq
+        FROM group_users
+        GROUP BY variant
+    """).set_index('variant')
+
+
+def _daily_exposed(con, time_unit: str) -> pd.DataFrame:
+    return _df(con, f"""
+        SELECT {_bucket('exposure_time', time_unit)} AS date, variant, COUNT(DISTINCT user_id) AS exposed_users
+        FROM exp_exposures
+        GROUP BY 1, 2
+    """)
+
+
+def _bucket_stats(con, column: str, time_unit: str) -> pd.DataFrame:
+    """Per exposure-bucket sufficient statistics of a group_users column (see user_bucket_stats)"""
+    return _df(con, f"""
+        SELECT
+            {_bucket('exposure_time', time_unit)} AS date,
+            variant,
+            COUNT(*) AS n,
+            SUM({column}) AS sum,
+            SUM({column} * {column}) AS sum_sq
+        FROM group_users
+        GROUP BY 1, 2
+    """)
+
+
+def _distribution(con, metric_config: dict, variants: list) -> dict:
+    """
+    Per-variant distribution summary (see distribution_from_metric_users),
+    computed in the database; 'values' holds a reproducible sample of at
+    most DISTRIBUTION_SAMPLE_SIZE user values.
+    """
+    agg_type = metric_config['aggregation']
+    column = _metric_column(metric_config)
+    distribution_data = {}
+
+    for variant in variants:
+        variant_filter = f"variant = {_quote(variant)}"
+
+        if agg_type == 'binary':
+            total, converted = con.exec_driver_sql(f"""
+                SELECT COUNT(*), COUNT(*) FILTER (WHERE {column} = 1)
+                FROM group_users WHERE {variant_filter}
+            """).one()
+            distribution_data[f'variant_{variant}'] = {
+                'type': 'binary',
+                'converted': int(converted),
+                'not_converted': int(total - converted),
+                'conversion_rate': float(converted / total) if total > 0 else 0.0
+            }
+            continue
+
+        (zero_count, mean, median, std, p25, p75, p95, v_min, v_max,
+         nz_n, nz_q25, nz_q75, nz_min, nz_max) = con.exec_driver_sql(f"""
+            SELECT
+                COUNT(*) FILTER (WHERE {column} = 0),
+                AVG({column}),
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY {column}),
+                stddev_pop({column}),
+                percentile_cont(0.25) WITHIN GROUP (ORDER BY {column}),
+                percentile_cont(0.75) WITHIN GROUP (ORDER BY {column}),
+                percentile_cont(0.95) WITHIN GROUP (ORDER BY {column}),
+                MIN({column}),
+                MAX({column}),
+                COUNT(*) FILTER (WHERE {column} > 0),
+                percentile_cont(0.25) WITHIN GROUP (ORDER BY {column}) FILTER (WHERE {column} > 0),
+                percentile_cont(0.75) WITHIN GROUP (ORDER BY {column}) FILTER (WHERE {column} > 0),
+                MIN({column}) FILTER (WHERE {column} > 0),
+                MAX({column}) FILTER (WHERE {column} > 0)
+            FROM group_users WHERE {variant_filter}
+        """).one()
+
+        # Freedman-Diaconis rule on non-zero values, as in the pandas engine
+        if nz_n > 0:
+            iqr = nz_q75 - nz_q25
+            bin_width = 2 * iqr / (nz_n ** (1/3)) if iqr > 0 else 1
+            n_bins = int((nz_max - nz_min) / bin_width) if bin_width > 0 else 20
+            n_bins = min(max(n_bins, 10), 50)
+        else:
+            n_bins = 10
+
+        # np.histogram widens a degenerate range by 0.5 on each side
+        lo, hi = (v_min - 0.5, v_max + 0.5) if v_min == v_max else (v_min, v_max)
+        bin_edges = np.linspace(lo, hi, n_bins + 1)
+        binned = _df(con, f"""
+            SELECT LEAST(floor(({column} - {lo!r}) / {(hi - lo) / n_bins!r})::integer, {n_bins - 1}) AS bin,
+                   COUNT(*) AS count
+            FROM group_users WHERE {variant_filter}
+            GROUP BY 1
+        """)
+        counts = np.zeros(n_bins, dtype=int)
+        counts[binned['bin'].to_numpy(dtype=int)] = binned['count'].to_numpy(dtype=int)
+
+        values = _df(con, f"""
+            SELECT {column} AS metric_value FROM group_users WHERE {variant_filter}
+            ORDER BY md5(user_id) LIMIT {DISTRIBUTION_SAMPLE_SIZE}
+        """)['metric_value']
+
+        distribution_data[f'variant_{variant}'] = {
+            'type': 'histogram',
+            'values': values.tolist(),
+            'bins': bin_edges.tolist(),
+            'counts': counts.tolist(),
+            'zero_count': int(zero_count),
+            'mean': float(mean),
+            'median': float(median),
+            'std': float(std),
+            'p25': float(p25),
+            'p75': float(p75),
+            'p95': float(p95)
+        }
+
+    return distribution_data
+
+
+def _experiment_shape(con):
+    """Variants and exposure span of the registered exposures"""
+    variants = [row[0] for row in con.exec_driver_sql(
+        "SELECT DISTINCT variant FROM exp_exposures WHERE variant IS NOT NULL ORDER BY 1"
+    ).fetchall()]
+    if not variants:
+        return None, None
+    exposure_span = pd.Timedelta(con.exec_driver_sql(
+        "SELECT MAX(exposure_time) - MIN(exposure_time) FROM exp_exposures"
+    ).scalar())
+    return variants, exposure_span
+
+
+def _assignment_check(con) -> dict:
+    """Sample ratio mismatch check (see analysis.assignment_check)"""
+    variant_counts = dict(con.exec_driver_sql(
+        "SELECT variant, COUNT(*) FROM exp_exposures WHERE variant IS NOT NULL GROUP BY variant"
+    ).fetchall())
+    users, multi_variant_users, exposures = con.exec_driver_sql(
+        "SELECT COUNT(*), COUNT(*) FILTER (WHERE multi_variant), SUM(exposure_count)::bigint FROM exp_exposures"
+    ).one()
+    result = sample_ratio_check(variant_counts)
+    result['users'] = int(users)
+    result['multi_variant_users'] = int(multi_variant_users)
+    result['repeat_exposures'] = int(exposures - users)
+    return result
+
+
+def _metric_stats(con, group_events: str, metric_config: dict) -> dict:
+    """Stat test for one metric of the registered group"""
+    if metric_config['aggregation'] == 'quantile':
+        bins = _quantile_bins(con, group_events, metric_config)
+        sketch_a = QuantileSketch.from_bins(bins[bins['variant'] == 'A'])
+        sketch_b = QuantileSketch.from_bins(bins[bins['variant'] == 'B'])
+        return run_quantile_test(sketch_a, sketch_b, metric_config)
+    return run_stat_tests_from_summary(_summary(con, _metric_column(metric_config)), metric_config)
+
+
+def _metric_sections(con, group_events: str, metric_config: dict, variants: list, exposure_span, sections,
+                     max_points=None) -> dict:
+    """Requested chart sections for one metric of the registered group"""
+    time_unit = _choose_time_unit(metric_config, exposure_span)
+    agg_type = metric_config['aggregation']
+    if agg_type == 'quantile':
+        if not sections:
+            return {}
+        with timed('daily', agg_type):
+            daily_exposed = _daily_exposed(con, time_unit)
+            bins = _quantile_bins(con, group_events, metric_config, time_unit)
+        return _quantile_bin_sections(daily_exposed, bins, variants, metric_config, time_unit, sections, max_points)
+
+    bucket_stats = None
+    if set(sections) & set(BUCKET_SECTIONS):
+        with timed('bucket_stats', agg_type):
+            bucket_stats = _bucket_stats(con, _metric_column(metric_config), time_unit)
+    analysis = _bucket_sections(bucket_stats, metric_config, variants, time_unit, sections, max_points)
+
+    if 'distribution' in sections:
+        with timed('distribution', agg_type):
+            analysis['distribution'] = _distribution(con, metric_config, variants)
+
+    return analysis
+
+
+def run_experiment_analysis_postgres(con, dataset_id: int, metrics_config: dict, apply_correction=True,
+                                     max_points=None, sections=None) -> dict:
+    """
+    run_experiment_analysis over a loaded dataset (see ingest_raw_data),
+    returning the same structure.
+    """
+    selected = ANALYSIS_SECTIONS if sections is None else tuple(s for s in ANALYSIS_SECTIONS if s in sections)
+
+    with timed('first_exposures'):
+        _register_exposures(con, dataset_id)
+    variants, exposure_span = _experiment_shape(con)
+    if variants is None:
+        raise ValueError(f"No exposure data found for dataset {dataset_id}")
+
+    metric_configs = list(metrics_config.values())
+    analyses = [None] * len(metric_configs)
+    done = 0
+
+    # metrics sharing an event and window are analyzed from one join
+    for group in plan_metric_groups(metric_configs):
+        with timed('join'):
+            group_events = _register_metric_group(con, dataset_id, [metric_configs[position] for position in group])
+
+        for position in group:
+            metric_config = metric_configs[position]
+            with timed('stats', metric_config['aggregation']):
+                analysis = _metric_stats(con, group_events, metric_config)
+            analysis.update(_metric_sections(con, group_events, metric_config, variants, exposure_span, selected, max_points))
+            done += 1
+            report_metric_done(done, len(metric_configs), metric_config, analysis)
+            analyses[position] = analysis
+
+    return _experiment_results(metric_configs, analyses, _assignment_check(con), apply_correction, sections, selected)
+
+
+def analyze_metric_sections_postgres(con, dataset_id: int, metric_config: dict, sections, max_points=None) -> dict:
+    """Chart sections for a single metric, computed on demand from a loaded dataset"""
+    _register_exposures(con, dataset_id)
+    variants, exposure_span = _experiment_shape(con)
+    if variants is None:
+        raise ValueError(f"No exposure data found for dataset {dataset_id}")
+    group_events = _register_metric_group(con, dataset_id, [metric_config])
+    return _metric_sections(con, group_events, metric_config, variants, exposure_span, sections, max_points)
@@ -0,0 +1,300 @@
+"""
+Simulation-based power analysis.
+
+calculate_sample_size assumes a two-proportion normal approximation, which
+misjudges zero-inflated, heavy-tailed metrics such as revenue. Here power is
+estimated by simulating many experiments per sample size: both variants are
+drawn from the baseline distribution, the treatment scaled by the relative
+effect, and each experiment is tested with the test run_stat_tests would run
+(chi-square for 0/1 metrics, t-test otherwise), vectorized across all
+experiments of a sample size. Users are drawn as batched numpy arrays of at
+most POWER_SIM_CHUNK_VALUES values and reduced to per-experiment sufficient
+statistics, so memory stays bounded whatever the sample size; users with a
+zero value are only counted, which is most of them for revenue metrics.
+Bernoulli and normal baselines draw the statistics directly from their exact
+sampling distributions instead of simulating users.
+"""
+import os
+import numpy as np
+from scipy import stats
+
+from .sample_size import calculate_sample_size
+
+# Values generated per array when simulating user-level draws
+POWER_SIM_CHUNK_VALUES = int(os.getenv("POWER_SIM_CHUNK_VALUES", 2_000_000))
+# Upper bound on user-level values one request may simulate, to keep it to seconds
+POWER_SIM_MAX_VALUES = int(os.getenv("POWER_SIM_MAX_VALUES", 200_000_000))
+
+# Baseline distributions and their parameters
+DISTRIBUTIONS = {
+    'bernoulli': ('p',),
+    'normal': ('mean', 'std'),
+    'lognormal': ('mu', 'sigma'),
+    'zero_inflated_lognormal': ('zero_prob', 'mu', 'sigma'),
+    'poisson': ('lam',),
+    'empirical': ('values',),
+}
+# Distributions whose experiments are drawn as sufficient statistics, not users
+EXACT_DISTRIBUTIONS = ('bernoulli', 'normal')
+# Sample sizes around the normal approximation simulated when none are given
+DEFAULT_GRID_FACTORS = (0.25, 0.5, 0.75, 1, 1.5, 2)
+MIN_SAMPLE_SIZE = 2
+
+
+def _check_distribution(distribution: dict) -> dict:
+    """Validated copy of a distribution spec ({'name': ..., **parameters})"""
+    name = distribution.get('name')
+    if name not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution '{name}'. Choose one of: {', '.join(DISTRIBUTIONS)}")
+    missing = [param for param in DISTRIBUTIONS[name] if param not in distribution]
+    if missing:
+        raise ValueError(f"Distribution '{name}' needs parameters: {', '.join(missing)}")
+
+    if name == 'empirical':
+        values = np.asarray(distribution['values'], dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) < 2:
+            raise ValueError("An empirical distribution needs at least 2 finite values")
+        return {'name': name, 'values': values}
+
+    spec = {'name': name, **{param: float(distribution[param]) for param in DISTRIBUTIONS[name]}}
+    if name == 'bernoulli' and not 0 < spec['p'] < 1:
+        raise ValueError("p must be between 0 and 1")
+    if name == 'zero_inflated_lognormal' and not 0 <= spec['zero_prob'] < 1:
+        raise ValueError("zero_prob must be at least 0 and below 1")
+    if name == 'poisson' and spec['lam'] <= 0:
+        raise ValueError("lam must be positive")
+    if spec.get('std', 1) <= 0 or spec.get('sigma', 1) <= 0:
+        raise ValueError("std and sigma must be positive")
+    return spec
+
+
+def _with_effect(spec: dict, mde: float) -> dict:
+    """The treatment distribution: the baseline with its mean scaled by 1 + mde"""
+    factor = 1 + mde
+    name = spec['name']
+    if name == 'bernoulli':
+        if spec['p'] * factor >= 1:
+            raise ValueError(
+                f"With a baseline rate of {spec['p']*100:.1f}% and MDE of {mde*100:.1f}%, "
+                f"the expected rate would be {spec['p']*factor*100:.1f}%. "
+                f"Please reduce either the baseline rate or the MDE."
+            )
+        return {**spec, 'p': spec['p'] * factor}
+    if name == 'normal':
+        return {**spec, 'mean': spec['mean'] * factor}
+    if name in ('lognormal', 'zero_inflated_lognormal'):
+        return {**spec, 'mu': spec['mu'] + np.log(factor)}
+    if name == 'poisson':
+        return {**spec, 'lam': spec['lam'] * factor}
+    return {**spec, 'values': spec['values'] * factor}
+
+
+def _moments(spec: dict) -> tuple:
+    """Mean and standard deviation of a distribution"""
+    name = spec['name']
+    if name == 'bernoulli':
+        return spec['p'], np.sqrt(spec['p'] * (1 - spec['p']))
+    if name == 'normal':
+        return spec['mean'], spec['std']
+    if name == 'poisson':
+        return spec['lam'], np.sqrt(spec['lam'])
+    if name == 'empirical':
+        return spec['values'].mean(), spec['values'].std()
+    nonzero = 1 - spec.get('zero_prob', 0.0)
+    mean_lognormal = np.exp(spec['mu'] + spec['sigma'] ** 2 / 2)
+    second_moment = nonzero * np.exp(2 * spec['mu'] + 2 * spec['sigma'] ** 2)
+    mean = nonzero * mean_lognormal
+    return mean, np.sqrt(second_moment - mean ** 2)
+
+
+def _is_binary(spec: dict) -> bool:
+    """Whether values are 0/1, which run_stat_tests treats as a binary (chi-square) metric"""
+    if spec['name'] == 'bernoulli':
+        return True
+    return spec['name'] == 'empirical' and bool(np.isin(spec['values'], (0.0, 1.0)).all())
+
+
+def _zero_prob(spec: dict) -> float:
+    """Share of users with a zero value that is simulated separately from the rest"""
+    if spec['name'] == 'zero_inflated_lognormal':
+        return spec['zero_prob']
+    if spec['name'] == 'empirical':
+        return float(np.mean(spec['values'] == 0))
+    return 0.0
+
+
+def _draw_nonzero(rng: np.random.Generator, spec: dict, size: int) -> np.ndarray:
+    """Values of users outside the zero share (see _zero_prob)"""
+    name = spec['name']
+    if name == 'empirical':
+        nonzero = spec['values'][spec['values'] != 0]
+        return nonzero[rng.integers(0, len(nonzero), size=size)]
+    if name == 'poisson':
+        return rng.poisson(spec['lam'], size=size).astype(float)
+    # in place, which is faster than Generator.lognormal
+    values = rng.standard_normal(size)
+    values *= spec['sigma']
+    values += spec['mu']
+    return np.exp(values, out=values)
+
+
+def _simulate_sums(rng: np.random.Generator, spec: dict, n: int, experiments: int) -> tuple:
+    """Per-experiment sum and sum of squares of n users drawn from spec"""
+    name = spec['name']
+    if name == 'bernoulli':
+        total = rng.binomial(n, spec['p'], size=experiments).astype(float)
+        return total, total
+    if name == 'normal':
+        # the sample mean and variance of normal draws are independent
+        mean = rng.normal(spec['mean'], spec['std'] / np.sqrt(n), size=experiments)
+        var = spec['std'] ** 2 * rng.chisquare(n - 1, size=experiments) / (n - 1)
+        return n * mean, (n - 1) * var + n * mean ** 2
+
+    # Zeros add nothing to either sum, so only each experiment's nonzero users
+    # are drawn: one flat stream, generated and reduced a chunk at a time
+    zero_prob = _zero_prob(spec)
+    if zero_prob > 0:
+        counts = rng.binomial(n, 1 - zero_prob, size=experiments)
+    else:
+        counts = np.full(experiments, n)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+
+    total = np.zeros(experiments)
+    total_sq = np.zeros(experiments)
+    for start in range(0, int(ends[-1]), POWER_SIM_CHUNK_VALUES):
+        stop = min(start + POWER_SIM_CHUNK_VALUES, int(ends[-1]))
+        first = np.searchsorted(ends, start, side='right')
+        last = np.searchsorted(starts, stop, side='left')
+        offsets = np.maximum(starts[first:last], start) - start
+        # reduceat can't express empty segments; those experiments have nothing to add
+        present = np.flatnonzero(np.minimum(ends[first:last], stop) - start > offsets)
+        values = _draw_nonzero(rng, spec, stop - start)
+        total[first + present] += np.add.reduceat(values, offsets[present])
+        total_sq[first + present] += np.add.reduceat(values * values, offsets[present])
+    return total, total_sq
+
+
+def chi_square_p_values(n_a, conversions_a, n_b, conversions_b) -> np.ndarray:
+    """
+    Vectorized p-values of the 2x2 chi-square test with Yates' correction,
+    as scipy.stats.chi2_contingency computes it in run_stat_tests. Tables
+    with an all-zero row or column, where that test fails, get NaN.
+    """
+    observed = np.stack([
+        np.stack([conversions_a, n_a - conversions_a], axis=-1),
+        np.stack([conversions_b, n_b - conversions_b], axis=-1),
+    ], axis=-2)
+    total = observed.sum(axis=(-2, -1), keepdims=True)
+    expected = observed.sum(axis=-1, keepdims=True) * observed.sum(axis=-2, keepdims=True) / total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = np.maximum(np.abs(observed - expected) - 0.5, 0.0)
+        chi2 = (deviation ** 2 / expected).sum(axis=(-2, -1))
+        chi2[(expected == 0).any(axis=(-2, -1))] = np.nan
+    return stats.chi2.sf(chi2, 1)
+
+
+def t_test_p_values(n_a, sum_a, sum_sq_a, n_b, sum_b, sum_sq_b) -> np.ndarray:
+    """
+    Vectorized p-values of the pooled two-sample t-test from sufficient
+    statistics, as run_stat_tests_from_summary computes it
+    """
+    mean_a, mean_b = sum_a / n_a, sum_b / n_b
+    var_a = np.maximum((sum_sq_a - sum_a * mean_a) / (n_a - 1), 0.0)
+    var_b = np.maximum((sum_sq_b - sum_b * mean_b) / (n_b - 1), 0.0)
+    dof = n_a + n_b - 2
+    pooled_var = ((n_a - 1) * var_a + (n_b - 1) * var_b) / dof
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stat = (mean_a - mean_b) / np.sqrt(pooled_var * (1 / n_a + 1 / n_b))
+    return 2 * stats.t.sf(np.abs(t_stat), dof)
+
+
+def normal_approximation_size(spec: dict, mde: float, alpha: float, power: float) -> int:
+    """Per-variant sample size of the usual normal approximation, for comparison"""
+    if spec['name'] == 'bernoulli':
+        return calculate_sample_size(spec['p'], mde, alpha, power)
+    mean, std = _moments(spec)
+    delta = mean * mde
+    if delta == 0 or std == 0:
+        return MIN_SAMPLE_SIZE
+    z = stats.norm.ppf(1 - alpha / 2) + stats.norm.ppf(power)
+    return max(MIN_SAMPLE_SIZE, int(np.ceil(2 * (z * std / delta) ** 2)))
+
+
+def simulate_power(distribution: dict, mde: float, alpha: float = 0.05, power: float = 0.80,
+                   sample_sizes: list | None = None, simulations: int = 1000, seed: int | None = None) -> dict:
+    """
+    Power of detecting a relative lift of mde at each per-variant sample
+    size, from simulations experiments per size. Without sample_sizes, sizes
+    around the normal approximation are simulated. Raises ValueError for an
+    invalid distribution, an empty sample_sizes or a request above
+    POWER_SIM_MAX_VALUES.
+    """
+    baseline = _check_distribution(distribution)
+    treatment = _with_effect(baseline, mde)
+    binary = _is_binary(baseline)
+    approximation = normal_approximation_size(baseline, mde, alpha, power)
+
+    if sample_sizes is None:
+        sample_sizes = {max(MIN_SAMPLE_SIZE, int(round(approximation * f))) for f in DEFAULT_GRID_FACTORS}
+    sample_sizes = sorted({int(n) for n in sample_sizes})
+    if not sample_sizes:
+        raise ValueError("Give at least one sample size")
+    if sample_sizes[0] < MIN_SAMPLE_SIZE:
+        raise ValueError(f"Sample sizes must be at least {MIN_SAMPLE_SIZE}")
+    if baseline['name'] not in EXACT_DISTRIBUTIONS:
+        per_simulation = 2 * sum(sample_sizes) * (1 - _zero_prob(baseline))
+        if simulations * per_simulation > POWER_SIM_MAX_VALUES:
+            raise ValueError(
+                f"This would simulate {int(simulations * per_simulation):,} user values "
+                f"(limit {POWER_SIM_MAX_VALUES:,}); use at most {int(POWER_SIM_MAX_VALUES // per_simulation):,} "
+                f"simulations or smaller sample sizes"
+            )
+
+    rng = np.random.default_rng(seed)
+    curve = []
+    for n in sample_sizes:
+        sum_a, sum_sq_a = _simulate_sums(rng, baseline, n, simulations)
+        sum_b, sum_sq_b = _simulate_sums(rng, treatment, n, simulations)
+        if binary:
+            p_values = chi_square_p_values(n, sum_a, n, sum_b)
+        else:
+            p_values = t_test_p_values(n, sum_a, sum_sq_a, n, sum_b, sum_sq_b)
+        # NaN p-values (degenerate samples) count as not significant
+        estimate = float(np.mean(p_values < alpha))
+        margin = stats.norm.ppf(0.975) * np.sqrt(estimate * (1 - estimate) / simulations)
+        curve.append({
+            'sample_size_per_variant': n,
+            'power': estimate,
+            'power_ci': [max(0.0, estimate - margin), min(1.0, estimate + margin)],
+        })
+
+    mean, std = _moments(baseline)
+    return {
+        'test': 'chi-square' if binary else 't-test',
+        'distribution': baseline['name'],
+        'baseline_mean': float(mean),
+        'baseline_std': float(std),
+        'treatment_mean': float(_moments(treatment)[0]),
+        'simulations': simulations,
+        'curve': curve,
+        'sample_size_per_variant': next((p['sample_size_per_variant'] for p in curve if p['power'] >= power), None),
+        'normal_approximation': approximation,
+    }
+
+
+def distribution_from_results(metric_result: dict, variant: str = 'A') -> dict:
+    """
+    Empirical baseline distribution of a metric from an upload's stored
+    distribution section: per-user values for sum/count metrics (a sample of
+    them for the DuckDB engine), the conversion rate for binary ones.
+    """
+    distribution = (metric_result.get('distribution') or {}).get(f'variant_{variant}')
+    if distribution is None:
+        raise ValueError(f"No stored distribution for variant {variant}; analyze the upload with the distribution section")
+    if distribution.get('type') == 'binary':
+        return {'name': 'bernoulli', 'p': distribution['conversion_rate']}
+    if 'values' not in distribution:
+        raise ValueError("Per-user values are not stored for quantile metrics")
+    return {'name': 'empirical', 'values': distribution['values']}
@@ -0,0 +1,100 @@
+"""
+Prepared datasets for on-demand analysis sections.
+
+When an upload is analyzed with only some chart sections, the parsed inputs
+are kept on disk under PREPARED_DIR so the remaining sections can be computed
+later for a single metric without re-uploading. The pandas engine stores the
+frames returned by prepare_experiment_data; the DuckDB engine keeps the
+uploaded files themselves.
+"""
+import json
+import os
+import shutil
+import pandas as pd
+
+PREPARED_DIR = os.getenv("PREPARED_DIR", os.path.join("uploads", "prepared"))
+
+
+def _dataset_dir(key: str, directory: str | None = None) -> str:
+    return os.path.join(directory or PREPARED_DIR, key)
+
+
+def prepared_dataset_exists(key: str, directory: str | None = None) -> bool:
+    return os.path.exists(os.path.join(_dataset_dir(key, directory), 'meta.json'))
+
+
+def save_prepared_dataset(key: str, experiment_id, metrics_config: dict, engine: str,
+                          exp_exposures: pd.DataFrame | None = None, events_df: pd.DataFrame | None = None,
+                          exposures_path: str | None = None, events_path: str | None = None,
+                          directory: str | None = None):
+    """
+    Store a dataset under key. Pass the prepared frames for engine 'pandas',
+    or the file paths for engine 'duckdb' (the files are moved, not copied).
+    """
+    path = _dataset_dir(key, directory)
+    if prepared_dataset_exists(key, directory):
+        return path
+    os.makedirs(path, exist_ok=True)
+
+    if engine == 'duckdb':
+        files = {
+            'exposures': 'exposures' + os.path.splitext(exposures_path)[1],
+            'events': 'events' + os.path.splitext(events_path)[1],
+        }
+        shutil.move(exposures_path, os.path.join(path, files['exposures']))
+        shutil.move(events_path, os.path.join(path, files['events']))
+    else:
+        files = {'exposures': 'exposures.pkl', 'events': 'events.pkl'}
+        exp_exposures.to_pickle(os.path.join(path, files['exposures']))
+        events_df.to_pickle(os.path.join(path, files['events']))
+
+    # meta.json is written last: its presence marks a complete dataset
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({
+            'engine': engine,
+            'experiment_id': str(experiment_id),
+            'metrics_config': metrics_config,
+            'files': files,
+        }, f)
+    return path
+
+
+def load_prepared_dataset(key: str, directory: str | None = None) -> dict:
+    """Metadata of a stored dataset, with absolute file paths; FileNotFoundError if missing"""
+    path = _dataset_dir(key, directory)
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    meta['files'] = {name: os.path.join(path, filename) for name, filename in meta['files'].items()}
+    return meta
+
+
+def analyze_prepared_sections(key: str, metric_id: str, sections, max_points=None, directory: str | None = None) -> dict:
+    """
+    Compute the given chart sections for one metric of a stored dataset.
+    Raises FileNotFoundError if the dataset is gone and ValueError for an
+    unknown metric.
+    """
+    meta = load_prepared_dataset(key, directory)
+    metric_config = next(
+        (config for config in meta['metrics_config'].values() if config.get('metric_id') == metric_id),
+        None,
+    )
+    if metric_config is None:
+        raise ValueError(f"Unknown metric_id: {metric_id}")
+
+    if meta['engine'] == 'duckdb':
+        from .duckdb_engine import analyze_metric_sections_duckdb
+        return analyze_metric_sections_duckdb(
+            meta['experiment_id'],
+            meta['files']['exposures'],
+            meta['files']['events'],
+            metric_config,
+            sections,
+            temp_directory=_dataset_dir(key, directory),
+            max_points=max_points,
+        )
+
+    from .analysis import analyze_metric_sections
+    exp_exposures = pd.read_pickle(meta['files']['exposures'])
+    events_df = pd.read_pickle(meta['files']['events'])
+    return analyze_metric_sections(exp_exposures, events_df, metric_config, sections, max_points)
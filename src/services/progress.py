@@ -0,0 +1,29 @@
+"""
+Progress reporting for long-running analyses.
+
+Pipeline code calls `report_progress(stage, **details)` as stages finish.
+Inside `progress_callback(callback)` each report is passed to the callback;
+elsewhere it is a no-op. Like the stage timings in instrumentation, the
+callback lives in a contextvar, so it follows a request into
+run_in_threadpool.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_callback: ContextVar = ContextVar('progress_callback', default=None)
+
+
+@contextmanager
+def progress_callback(callback):
+    """Send progress reports made in this context to callback(stage, details)"""
+    token = _callback.set(callback)
+    try:
+        yield
+    finally:
+        _callback.reset(token)
+
+
+def report_progress(stage: str, **details):
+    callback = _callback.get()
+    if callback is not None:
+        callback(stage, details)
@@ -0,0 +1,77 @@
+"""
+Deterministic user samples for approximate previews.
+
+A user is in the sample at fraction f when a hash of their user_id, mapped
+to [0, 1), is below f. The hash key is fixed, so the same ids give the same
+sample on every upload and in every process, and a smaller sample is
+contained in a larger one. Ids are hashed by their canonical key (see
+services.user_ids), so a user is sampled alike whether their id is read as
+an integer, a float or a string.
+"""
+import numpy as np
+import pandas as pd
+
+from .user_ids import user_id_hashes
+
+# Estimate key of each test's result, whose confidence intervals get projected
+ESTIMATE_KEYS = ('rate', 'mean', 'quantile')
+
+
+def user_hash_unit(user_ids) -> np.ndarray:
+    """Each user_id hashed to a float in [0, 1)"""
+    # the top 53 bits fill a double's mantissa exactly
+    return (user_id_hashes(user_ids) >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+
+
+def in_user_sample(user_ids, fraction: float) -> np.ndarray:
+    """Boolean mask of the user_ids in the fraction sample"""
+    return user_hash_unit(user_ids) < fraction
+
+
+def sample_users(frame: pd.DataFrame, fraction: float) -> pd.DataFrame:
+    """Rows of frame whose user_id is in the fraction sample; frames without user_id are left to validation"""
+    if 'user_id' not in frame.columns:
+        return frame
+    return frame[in_user_sample(frame['user_id'], fraction)]
+
+
+def _projected(interval, estimate, scale: float) -> list:
+    return [estimate - (estimate - interval[0]) * scale, estimate + (interval[1] - estimate) * scale]
+
+
+def project_preview_results(results: dict, fraction: float) -> dict:
+    """
+    Mark an analysis of a fraction sample of users as approximate. Confidence
+    intervals stay as computed on the sample; alongside each one,
+    *_ci_projected is the interval expected on all users: standard errors
+    shrink with the square root of the user count, so each bound's distance
+    from the estimate is scaled by sqrt(fraction). A '_preview' entry
+    describes the sample.
+    """
+    scale = float(np.sqrt(fraction))
+    for metric_id, analysis in results.items():
+        if metric_id.startswith('_') or not isinstance(analysis, dict):
+            continue
+        analysis['approximate'] = True
+        for variant in ('variant_a', 'variant_b'):
+            estimate = next(
+                (analysis[f'{variant}_{key}'] for key in ESTIMATE_KEYS if f'{variant}_{key}' in analysis), None
+            )
+            if estimate is not None and f'{variant}_ci' in analysis:
+                analysis[f'{variant}_ci_projected'] = _projected(analysis[f'{variant}_ci'], estimate, scale)
+        if 'difference_ci' in analysis:
+            analysis['difference_ci_projected'] = _projected(analysis['difference_ci'], analysis['difference'], scale)
+
+    sampled_users = (results.get('_assignment_check') or {}).get('users')
+    results['_preview'] = {
+        'approximate': True,
+        'fraction': fraction,
+        'sampling': 'user_id hash',
+        'sampled_users': sampled_users,
+        'estimated_users': round(sampled_users / fraction) if sampled_users is not None else None,
+        'description': (
+            f'Analysis of a deterministic {fraction:.1%} sample of users; '
+            '*_ci_projected are the confidence intervals expected on all users'
+        ),
+    }
+    return results
@@ -0,0 +1,180 @@
+"""
+Segment breakdowns from users-file attributes.
+
+User attributes (device, country, ...) are joined onto the first-exposure
+table once, as a long (user_id, attribute, segment) table. For each group of
+metrics sharing a windowed join, one grouped aggregation over
+(attribute, segment, variant) gives the sufficient statistics of every
+metric in every segment; the segment tests are run from those (see
+run_stat_tests_from_summary) and Benjamini-Hochberg corrected across each
+metric's segments.
+"""
+import os
+import re
+import numpy as np
+import pandas as pd
+from .sketches import QuantileSketch, bin_counts
+from .stat_tests import run_stat_tests_from_summary, run_quantile_test, apply_multiple_testing_correction
+
+# Levels kept per attribute, largest first; the rest are pooled as OTHER_SEGMENT
+SEGMENT_MAX_LEVELS = int(os.getenv("SEGMENT_MAX_LEVELS", 20))
+# Segments with fewer users than this in either variant are reported but not tested
+SEGMENT_MIN_USERS = int(os.getenv("SEGMENT_MIN_USERS", 30))
+
+OTHER_SEGMENT = 'other'
+MISSING_SEGMENT = 'unknown'
+SEGMENT_KEYS = ['attribute', 'segment', 'variant']
+# Header-less index columns, as named by pandas and DuckDB
+UNNAMED_COLUMN = re.compile(r'^(Unnamed: \d+|column\d+)$')
+
+
+def segment_attributes(columns, requested: list | None = None) -> list:
+    """
+    Attribute columns of a users table to break results down by: every
+    column except user_id and unnamed index columns, or the requested ones.
+    """
+    available = [str(column) for column in columns if column != 'user_id' and not UNNAMED_COLUMN.match(str(column))]
+    if requested is None:
+        return available
+    missing = [attribute for attribute in requested if attribute not in available]
+    if missing:
+        raise ValueError(f"Users file has no attribute columns: {', '.join(missing)}")
+    return list(requested)
+
+
+def top_levels(counts: pd.Series) -> list:
+    """The SEGMENT_MAX_LEVELS levels with most users (ties by name)"""
+    ordered = counts.sort_index().sort_values(ascending=False, kind='stable')
+    return ordered.index[:SEGMENT_MAX_LEVELS].tolist()
+
+
+def user_segments(exp_exposures: pd.DataFrame, users_df: pd.DataFrame, attributes: list) -> pd.DataFrame:
+    """
+    Every exposed user's segment per attribute, as a long table:
+      user_id, attribute, segment
+    Users missing from the users file fall in MISSING_SEGMENT; levels past
+    the SEGMENT_MAX_LEVELS largest of an attribute are pooled in OTHER_SEGMENT.
+    """
+    users = users_df.drop_duplicates('user_id')[['user_id'] + attributes]
+    user_ids = exp_exposures['user_id']
+    if users['user_id'].dtype != user_ids.dtype:
+        users = users.assign(user_id=users['user_id'].astype(str))
+        keys = user_ids.astype(str)
+    else:
+        keys = user_ids
+    joined = pd.DataFrame({'user_id': keys.to_numpy()}).merge(users, on='user_id', how='left')
+
+    frames = []
+    for attribute in attributes:
+        segment = joined[attribute].astype(str).where(joined[attribute].notna(), MISSING_SEGMENT)
+        segment = segment.where(segment.isin(top_levels(segment.value_counts())), OTHER_SEGMENT)
+        frames.append(pd.DataFrame({
+            'user_id': user_ids.to_numpy(),
+            'attribute': attribute,
+            'segment': segment.to_numpy(),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def segment_stats(user_metrics: pd.DataFrame, segments: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    Per (attribute, segment, variant) sufficient statistics of user-level
+    metric columns (see user_metric_table), in one grouped aggregation:
+      attribute, segment, variant, n, <column>_sum, <column>_sum_sq, ...
+    """
+    joined = segments.merge(user_metrics[['user_id', 'variant'] + columns], on='user_id')
+    aggregations = {'n': ('variant', 'size')}
+    for column in columns:
+        joined[f'{column}_sq'] = joined[column] ** 2
+        aggregations[f'{column}_sum'] = (column, 'sum')
+        aggregations[f'{column}_sum_sq'] = (f'{column}_sq', 'sum')
+    return joined.groupby(SEGMENT_KEYS).agg(**aggregations).reset_index()
+
+
+def segment_bins(user_values: pd.DataFrame, segments: pd.DataFrame) -> pd.DataFrame:
+    """Quantile sketches of user values (see quantile_user_values) per attribute, segment and variant"""
+    joined = segments.merge(user_values[['user_id', 'variant', 'metric_value']], on='user_id')
+    return bin_counts(joined, SEGMENT_KEYS)
+
+
+def _segment_users(summary: pd.DataFrame) -> dict:
+    return {variant: int(summary.loc[variant, 'n']) if variant in summary.index else 0 for variant in ('A', 'B')}
+
+
+def _segment_test(sizes: dict, test):
+    """
+    Result of one segment: its users per variant, plus the test if both
+    variants reach SEGMENT_MIN_USERS
+    """
+    if min(sizes.values()) < SEGMENT_MIN_USERS:
+        return {'users': sizes, 'tested': False, 'reason': f"Fewer than {SEGMENT_MIN_USERS} users in a variant"}
+    try:
+        result = test()
+    except ValueError as e:
+        return {'users': sizes, 'tested': False, 'reason': str(e)}
+    return {**result, 'users': sizes, 'tested': True}
+
+
+def segment_tests(stats: pd.DataFrame, metric_config: dict) -> dict:
+    """
+    Test results of one binary/sum/count metric per attribute and segment,
+    from segment_stats: {attribute: {segment: result}}
+    """
+    agg_type = metric_config['aggregation']
+    results = {}
+    for (attribute, segment), rows in stats.groupby(['attribute', 'segment'], sort=True):
+        summary = rows.set_index('variant').rename(columns={f'{agg_type}_sum': 'sum', f'{agg_type}_sum_sq': 'sum_sq'})
+        summary = summary[['n', 'sum', 'sum_sq']]
+        results.setdefault(attribute, {})[segment] = _segment_test(
+            _segment_users(summary), lambda: run_stat_tests_from_summary(summary, metric_config)
+        )
+    return results
+
+
+def quantile_segment_tests(bins: pd.DataFrame, segments: pd.DataFrame, metric_config: dict) -> dict:
+    """
+    Test results of one quantile metric per attribute and segment, from
+    segment_bins. Sample sizes count users with a value.
+    """
+    levels = segments[['attribute', 'segment']].drop_duplicates().sort_values(['attribute', 'segment'])
+    results = {}
+    for attribute, segment in levels.itertuples(index=False):
+        rows = bins[(bins['attribute'] == attribute) & (bins['segment'] == segment)]
+        sketches = {variant: QuantileSketch.from_bins(rows[rows['variant'] == variant]) for variant in ('A', 'B')}
+        results.setdefault(attribute, {})[segment] = _segment_test(
+            {variant: sketch.n for variant, sketch in sketches.items()},
+            lambda: run_quantile_test(sketches['A'], sketches['B'], metric_config),
+        )
+    return results
+
+
+def correct_segment_tests(metric_segments: dict, apply_correction: bool = True):
+    """Benjamini-Hochberg across one metric's tested segments, in place"""
+    tested = [
+        result
+        for segments in metric_segments.values()
+        for result in segments.values()
+        if result['tested'] and not np.isnan(result['p-value'])
+    ]
+    if not apply_correction or len(tested) < 2:
+        return
+
+    correction_results = apply_multiple_testing_correction([result['p-value'] for result in tested], method='fdr_bh')
+    for i, result in enumerate(tested):
+        result['p_value_raw'] = result['p-value']
+        result['p-value'] = correction_results['corrected_p_values'][i]
+        result['significance'] = 'YES' if correction_results['significant'][i] else 'NO'
+        result['correction_applied'] = True
+        result['correction_method'] = correction_results['method']
+
+
+def apply_segment_corrections(results: dict, metric_ids: list, attributes: list, apply_correction: bool = True):
+    """Correct every metric's segment tests and record the breakdown under results['_segments_info']"""
+    for metric_id in metric_ids:
+        correct_segment_tests(results[metric_id]['segments'], apply_correction)
+    results['_segments_info'] = {
+        'attributes': attributes,
+        'max_levels': SEGMENT_MAX_LEVELS,
+        'min_users': SEGMENT_MIN_USERS,
+        'correction': "Benjamini-Hochberg (FDR) across each metric's segments" if apply_correction else None,
+    }
@@ -0,0 +1,87 @@
+"""
+Columnar encodings of a metric's stored chart series.
+
+Analysis results keep every time series as records (one dict per point,
+with ISO date strings). For charts, a series is sent as parallel column
+arrays instead, with dates as epoch milliseconds: as JSON, or as an Arrow
+IPC stream the browser can read without parsing. A date range and a point
+budget (LTTB per series, see services.downsample) are applied first.
+"""
+import numpy as np
+import pandas as pd
+
+from .downsample import downsample_series
+
+# (y, by) of each of SERIES_SECTIONS for downsampling: the plotted value and the column splitting it into lines
+SERIES_AXES = {
+    'daily': ('metric_value', 'variant'),
+    'cumulative': ('metric_value', 'variant'),
+    'lift': ('lift', None),
+    'ci': ('metric_value', 'variant'),
+}
+
+
+def series_frame(records: list, section: str, start=None, end=None, max_points: int | None = None) -> pd.DataFrame:
+    """
+    A stored series' records as a frame sorted by date (then variant),
+    limited to start <= date <= end and LTTB-downsampled to max_points per
+    line. Raises ValueError for a malformed range.
+    """
+    df = pd.DataFrame.from_records(records)
+    if df.empty:
+        return df
+    df['date'] = pd.to_datetime(df['date'])
+    try:
+        if start is not None:
+            df = df[df['date'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['date'] <= pd.Timestamp(end)]
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid date range: {e}")
+
+    y, by = SERIES_AXES[section]
+    if max_points:
+        df = downsample_series(df, max_points, y=y, by=by)
+    order = ['date', by] if by in df.columns else ['date']
+    return df.sort_values(order, kind='stable').reset_index(drop=True)
+
+
+def _epoch_ms(dates: pd.Series) -> np.ndarray:
+    return dates.to_numpy(dtype='datetime64[ms]').astype(np.int64)
+
+
+def series_columns(df: pd.DataFrame) -> dict:
+    """Column name -> list of values, dates as epoch milliseconds and NaN as None"""
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if name == 'date':
+            columns[name] = _epoch_ms(values).tolist()
+        elif pd.api.types.is_float_dtype(values):
+            columns[name] = [None if np.isnan(v) else v for v in values.tolist()]
+        else:
+            columns[name] = values.astype(object).where(values.notna(), None).tolist()
+    return columns
+
+
+def series_arrow(df: pd.DataFrame) -> bytes:
+    """The frame as an Arrow IPC stream: dates as timestamp[ms], variants dictionary-encoded"""
+    import pyarrow as pa
+
+    arrays, names = [], []
+    for name in df.columns:
+        values = df[name]
+        if name == 'date':
+            array = pa.array(values.to_numpy(dtype='datetime64[ms]'), type=pa.timestamp('ms'))
+        elif name == 'variant':
+            array = pa.array(values.astype(str)).dictionary_encode()
+        else:
+            array = pa.array(values, from_pandas=True)
+        arrays.append(array)
+        names.append(name)
+    table = pa.Table.from_arrays(arrays, names=names)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,457 @@
+"""
+Sharded map-reduce execution of run_experiment_analysis.
+
+Exposures and events are partitioned by a hash of user_id into shards on
+disk, streaming the input files in chunks, so every user's rows land in the
+same shard and no process holds the whole experiment. Each shard is
+processed independently by a worker in two map steps:
+  prepare    first exposures and the metrics' events of the shard (as
+             prepare_experiment_data makes them), kept in the shard
+             directory; returns the shard's exposure time range and
+             assignment counts, from which every metric's time bucket is
+             chosen as in the single-process path
+  aggregate  the windowed join of each metric group, reduced to mergeable
+             partials: per-variant and per-bucket sufficient statistics
+             (n, sum, sum_sq) of binary and count metrics, and uncollapsed
+             per-variant and per-bucket sketch bins of quantile metrics
+The reduce step adds the partials up and runs the single-process stat tests
+and section builders on them. Sums of 0/1 and count values are exact in any
+order, so the output is bit-for-bit that of the single-process path. Float
+sums are not: for groups with a sum metric, and for the distribution section
+(which lists user values), shards instead return the group's user-level
+table with each user's original row position, and the reducer rebuilds it in
+single-process order. Segment breakdowns are not supported.
+
+Workers are a local process pool ('process') or queue-driven workers
+('queue') that take tasks from a broker and publish their results back.
+LocalBroker is an in-process stand-in for a networked queue; workers on other
+nodes only need the shard directory on shared storage.
+"""
+import os
+import glob
+import queue
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+from .load import iter_table, EXPOSURES_READ_COLUMNS, EVENTS_READ_COLUMNS
+from .metric_analysis import (
+    plan_metric_groups,
+    windowed_user_metrics,
+    metric_users,
+    user_bucket_stats,
+    quantile_bucket_bins,
+    quantile_user_values,
+    _filter_events_by_metric,
+    _choose_time_unit,
+)
+from .sketches import QuantileSketch, bin_counts, collapse_bins
+from .stat_tests import (
+    run_stat_tests,
+    run_stat_tests_from_summary,
+    run_quantile_test,
+    sample_ratio_check,
+    summarize_metric,
+)
+from .analysis import (
+    prepare_experiment_data,
+    report_metric_done,
+    _bucket_sections,
+    _metric_sections,
+    _quantile_bin_sections,
+    _experiment_results,
+)
+from .instrumentation import collect_timings, record_timings, timed
+from .options import ANALYSIS_SECTIONS, BUCKET_SECTIONS
+from .progress import report_progress
+from .user_ids import user_id_hashes
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 8))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", os.cpu_count() or 1))
+SHARD_BACKEND = os.getenv("SHARD_BACKEND", "process")
+SHARD_BACKENDS = ('process', 'queue')
+# Rows read at a time while partitioning the input files
+SHARD_CHUNK_ROWS = int(os.getenv("SHARD_CHUNK_ROWS", 1_000_000))
+# Seconds between checks that queue workers are still alive
+WORKER_POLL_SECONDS = 1.0
+
+# Shard partials keep every sketch bin; the reducer collapses the merged ones
+UNCOLLAPSED = np.iinfo(np.int64).max
+POSITION = '_position'
+SUM_COLUMNS = ['n', 'sum', 'sum_sq']
+
+
+def shard_ids(user_ids: pd.Series, shards: int) -> np.ndarray:
+    """
+    Shard of each user id: a stable hash of its canonical key (see
+    services.user_ids), so ids read as integers, floats or strings in
+    different files or chunks agree, on any node.
+    """
+    return (user_id_hashes(user_ids) % np.uint64(shards)).astype(np.int64)
+
+
+def _shard_dir(directory: str, shard: int) -> str:
+    return os.path.join(directory, f'shard-{shard:04d}')
+
+
+def partition_inputs(experiment_id, exposures_path, events_path, metrics_config: dict, shards: int,
+                     directory: str, chunk_rows: int = SHARD_CHUNK_ROWS) -> list:
+    """
+    Write each shard's exposures of the experiment and events of the
+    metrics under directory, a chunk file per input chunk. Exposures keep
+    their row position in the file as index, which fixes the user order the
+    single-process path would have. Returns the shard directories.
+    """
+    shard_dirs = [_shard_dir(directory, shard) for shard in range(shards)]
+    for shard_dir in shard_dirs:
+        os.makedirs(shard_dir, exist_ok=True)
+
+    rows = 0
+    chunks = iter_table(
+        exposures_path, columns=EXPOSURES_READ_COLUMNS, filters={'experiment_id': [experiment_id]}, chunk_rows=chunk_rows
+    )
+    for index, chunk in enumerate(chunks):
+        chunk.index = pd.RangeIndex(rows, rows + len(chunk))
+        rows += len(chunk)
+        chunk = chunk[chunk['experiment_id'].astype(str) == str(experiment_id)]
+        _write_shards(chunk, shard_ids(chunk['user_id'], shards), shard_dirs, f'exposures-{index:06d}.pkl')
+
+    event_names = [metric_config['event']['name'] for metric_config in metrics_config.values()]
+    chunks = iter_table(events_path, columns=EVENTS_READ_COLUMNS, filters={'event_name': event_names}, chunk_rows=chunk_rows)
+    for index, chunk in enumerate(chunks):
+        chunk = chunk[chunk['event_name'].isin(event_names)]
+        _write_shards(chunk, shard_ids(chunk['user_id'], shards), shard_dirs, f'events-{index:06d}.pkl')
+
+    return shard_dirs
+
+
+def _write_shards(chunk: pd.DataFrame, shards: np.ndarray, shard_dirs: list, filename: str):
+    # empty slices are written too, so every shard knows the table's columns
+    for shard, shard_dir in enumerate(shard_dirs):
+        chunk[shards == shard].to_pickle(os.path.join(shard_dir, filename))
+
+
+def _read_shard(shard_dir: str, table: str) -> pd.DataFrame | None:
+    paths = sorted(glob.glob(os.path.join(shard_dir, f'{table}-*.pkl')))
+    if not paths:
+        return None
+    return pd.concat([pd.read_pickle(path) for path in paths])
+
+
+def _prepare_shard(shard_dir: str, experiment_id, metrics_config: dict):
+    """Map step 1: prepare the shard's data and summarize its exposures (None for a shard without any)"""
+    exposures = _read_shard(shard_dir, 'exposures')
+    if exposures is None or exposures.empty:
+        return None
+    events = _read_shard(shard_dir, 'events')
+    if events is None:
+        events = pd.DataFrame(columns=EVENTS_READ_COLUMNS)
+
+    exp_exposures, events = prepare_experiment_data(experiment_id, exposures, events, metrics_config)
+    exp_exposures.to_pickle(os.path.join(shard_dir, 'prepared-exposures.pkl'))
+    events.to_pickle(os.path.join(shard_dir, 'prepared-events.pkl'))
+
+    exposure_times = pd.to_datetime(exp_exposures['exposure_time'])
+    return {
+        'variant_counts': exp_exposures['variant'].value_counts().to_dict(),
+        'users': len(exp_exposures),
+        'multi_variant_users': int(exp_exposures['multi_variant'].sum()),
+        'exposures': int(exp_exposures['exposure_count'].sum()),
+        'first_exposure': exposure_times.min(),
+        'last_exposure': exposure_times.max(),
+        'variants': exp_exposures['variant'].dropna().unique().tolist(),
+    }
+
+
+def _group_needs_users(metric_configs: list, sections) -> bool:
+    """Whether a group's partials are its user-level table rather than sums (see module docstring)"""
+    aggregations = {metric_config['aggregation'] for metric_config in metric_configs}
+    return bool(aggregations - {'quantile'}) and ('sum' in aggregations or 'distribution' in sections)
+
+
+def _aggregate_shard(shard_dir: str, metric_configs: list, groups: list, time_units: list, sections) -> list:
+    """Map step 2: partial aggregates of every metric group over the shard"""
+    exp_exposures = pd.read_pickle(os.path.join(shard_dir, 'prepared-exposures.pkl'))
+    events = pd.read_pickle(os.path.join(shard_dir, 'prepared-events.pkl'))
+
+    partials = []
+    for group in groups:
+        group_configs = [metric_configs[position] for position in group]
+        aggregations = {metric_config['aggregation'] for metric_config in group_configs}
+        partial = {'users': None, 'metrics': {}}
+
+        with timed('join'):
+            if 'quantile' in aggregations:
+                in_window = _filter_events_by_metric(exp_exposures, events, group_configs[0])
+            if aggregations - {'quantile'}:
+                user_metrics = windowed_user_metrics(exp_exposures, events, group_configs[0])
+
+        if _group_needs_users(group_configs, sections):
+            # left join on the first-exposure table: rows are in exp_exposures order
+            partial['users'] = user_metrics.assign(**{POSITION: exp_exposures.index.to_numpy()})
+
+        for position, metric_config in zip(group, group_configs):
+            agg_type = metric_config['aggregation']
+            time_unit = time_units[position]
+            if agg_type == 'quantile':
+                with timed('bucket_stats', agg_type):
+                    # users are whole within a shard, so their values are too
+                    user_values = quantile_user_values(in_window, metric_config)
+                    metric_partial = {'bins': bin_counts(user_values, ['variant'], max_bins=UNCOLLAPSED)}
+                    if sections:
+                        daily_exposed, bins, _ = quantile_bucket_bins(
+                            exp_exposures, user_values, time_unit, max_bins=UNCOLLAPSED
+                        )
+                        metric_partial.update(daily_exposed=daily_exposed, bucket_bins=bins)
+            elif partial['users'] is None:
+                metric_df = metric_users(user_metrics, agg_type)
+                with timed('bucket_stats', agg_type):
+                    metric_partial = {
+                        'summary': summarize_metric(metric_df).reset_index(),
+                        'buckets': user_bucket_stats(metric_df, time_unit) if set(sections) & set(BUCKET_SECTIONS) else None,
+                    }
+            else:
+                continue
+            partial['metrics'][position] = metric_partial
+        partials.append(partial)
+    return partials
+
+
+SHARD_STEPS = {
+    'prepare': _prepare_shard,
+    'aggregate': _aggregate_shard,
+}
+
+
+def run_shard_step(step: str, args: tuple):
+    """Run a map step, returning (result, stage timings)"""
+    with collect_timings() as timings:
+        result = SHARD_STEPS[step](*args)
+    return result, timings
+
+
+class LocalBroker:
+    """
+    In-process stand-in for a message broker: a task queue workers consume
+    and a result queue they publish to. A networked broker only needs the
+    same four calls.
+    """
+
+    def __init__(self, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+
+    def put_task(self, task):
+        self.tasks.put(task)
+
+    def get_task(self):
+        return self.tasks.get()
+
+    def put_result(self, result):
+        self.results.put(result)
+
+    def get_result(self, timeout=None):
+        return self.results.get(timeout=timeout)
+
+
+def run_worker(broker):
+    """
+    Queue worker loop: run (task_id, step, args) tasks from broker and
+    publish (task_id, error, (result, timings)) until a None task arrives.
+    """
+    while True:
+        task = broker.get_task()
+        if task is None:
+            return
+        task_id, step, args = task
+        try:
+            broker.put_result((task_id, None, run_shard_step(step, args)))
+        except Exception as e:
+            broker.put_result((task_id, e, None))
+
+
+@contextmanager
+def _queue_workers(workers: int):
+    context = multiprocessing.get_context('spawn')
+    broker = LocalBroker(context)
+    processes = [context.Process(target=run_worker, args=(broker,), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    def run(step: str, tasks: list) -> list:
+        for task_id, args in enumerate(tasks):
+            broker.put_task((task_id, step, args))
+        results = [None] * len(tasks)
+        for _ in tasks:
+            while True:
+                try:
+                    task_id, error, result = broker.get_result(timeout=WORKER_POLL_SECONDS)
+                    break
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        raise RuntimeError("All shard workers exited before finishing their tasks")
+            if error is not None:
+                raise error
+            results[task_id] = result
+        return results
+
+    try:
+        yield run
+    finally:
+        for _ in processes:
+            broker.put_task(None)
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+
+@contextmanager
+def _pool_workers(workers: int):
+    from .parallel import _get_executor
+    executor = _get_executor(workers)
+
+    def run(step: str, tasks: list) -> list:
+        return list(executor.map(run_shard_step, [step] * len(tasks), tasks))
+
+    yield run
+
+
+def _sum_partials(frames: list, keys: list, columns: list) -> pd.DataFrame:
+    return pd.concat(frames, ignore_index=True).groupby(keys, as_index=False)[columns].sum()
+
+
+def _reduce_assignment(infos: list) -> dict:
+    """assignment_check over every shard's users"""
+    variant_counts = {}
+    for info in infos:
+        for variant, count in info['variant_counts'].items():
+            variant_counts[variant] = variant_counts.get(variant, 0) + count
+    result = sample_ratio_check(variant_counts)
+    result['users'] = sum(info['users'] for info in infos)
+    result['multi_variant_users'] = sum(info['multi_variant_users'] for info in infos)
+    result['repeat_exposures'] = sum(info['exposures'] for info in infos) - result['users']
+    return result
+
+
+def _reduce_quantile(partials: list, metric_config: dict, variants: list, time_unit: str, sections, max_points=None):
+    agg_type = metric_config['aggregation']
+    with timed('stats', agg_type):
+        bins = collapse_bins(_sum_partials([p['bins'] for p in partials], ['variant', 'key'], ['count']), ['variant'])
+        sketches = {variant: QuantileSketch.from_bins(bins[bins['variant'] == variant]) for variant in ('A', 'B')}
+        analysis = run_quantile_test(sketches['A'], sketches['B'], metric_config)
+    if sections:
+        with timed('daily', agg_type):
+            daily_exposed = _sum_partials([p['daily_exposed'] for p in partials], ['date', 'variant'], ['exposed_users'])
+            bins = _sum_partials([p['bucket_bins'] for p in partials], ['date', 'variant', 'key'], ['count'])
+            bins = collapse_bins(bins, ['date', 'variant'])
+        analysis.update(_quantile_bin_sections(daily_exposed, bins, variants, metric_config, time_unit, sections, max_points))
+    return analysis
+
+
+def _reduce_group(group: list, partials: list, metric_configs: list, variants: list, time_units: list,
+                  sections, max_points=None) -> list:
+    """Analyses of a metric group from every shard's partials of it"""
+    users = None
+    if partials[0]['users'] is not None:
+        with timed('join'):
+            users = (
+                pd.concat([partial['users'] for partial in partials])
+                .sort_values(POSITION, kind='stable')
+                .drop(columns=POSITION)
+                .reset_index(drop=True)
+            )
+
+    analyses = []
+    for position in group:
+        metric_config = metric_configs[position]
+        agg_type = metric_config['aggregation']
+        time_unit = time_units[position]
+        if agg_type == 'quantile':
+            metric_partials = [partial['metrics'][position] for partial in partials]
+            analysis = _reduce_quantile(metric_partials, metric_config, variants, time_unit, sections, max_points)
+        elif users is not None:
+            metric_df = metric_users(users, agg_type)
+            with timed('stats', agg_type):
+                analysis = run_stat_tests(metric_df, metric_config)
+            analysis.update(_metric_sections(metric_df, metric_config, variants, time_unit, sections, max_points))
+        else:
+            metric_partials = [partial['metrics'][position] for partial in partials]
+            with timed('stats', agg_type):
+                summary = _sum_partials([p['summary'] for p in metric_partials], ['variant'], SUM_COLUMNS)
+                analysis = run_stat_tests_from_summary(summary.set_index('variant'), metric_config)
+            bucket_stats = None
+            if set(sections) & set(BUCKET_SECTIONS):
+                bucket_stats = _sum_partials([p['buckets'] for p in metric_partials], ['date', 'variant'], SUM_COLUMNS)
+            analysis.update(_bucket_sections(bucket_stats, metric_config, variants, time_unit, sections, max_points))
+        analyses.append(analysis)
+    return analyses
+
+
+def run_sharded_analysis(experiment_id, exposures_path, events_path, metrics_config: dict, apply_correction=True,
+                         shards: int | None = None, workers: int | None = None, backend: str | None = None,
+                         max_points=None, sections=None, work_dir: str | None = None) -> dict:
+    """
+    run_experiment_analysis over exposures and events files split into
+    shards (default SHARD_COUNT) by user, mapped by workers (default
+    SHARD_WORKERS) of backend 'process' or 'queue' (default SHARD_BACKEND)
+    and reduced in this process. Shard files go to a temporary directory
+    under work_dir, removed afterwards.
+    """
+    shards = SHARD_COUNT if shards is None else shards
+    workers = min(SHARD_WORKERS if workers is None else workers, shards)
+    backend = SHARD_BACKEND if backend is None else backend
+    if backend not in SHARD_BACKENDS:
+        raise ValueError(f"Unknown shard backend '{backend}'. Choose one of: {', '.join(SHARD_BACKENDS)}")
+    if shards < 1 or workers < 1:
+        raise ValueError("shards and workers must be at least 1")
+
+    metric_configs = list(metrics_config.values())
+    selected = ANALYSIS_SECTIONS if sections is None else tuple(s for s in ANALYSIS_SECTIONS if s in sections)
+    groups = plan_metric_groups(metric_configs)
+    start_workers = _queue_workers if backend == 'queue' else _pool_workers
+
+    with tempfile.TemporaryDirectory(prefix='shards-', dir=work_dir) as directory, start_workers(workers) as run:
+        with timed('partition'):
+            shard_dirs = partition_inputs(experiment_id, exposures_path, events_path, metrics_config, shards, directory)
+        report_progress('partitioned', shards=shards)
+
+        prepared = []
+        for shard_dir, (info, timings) in zip(shard_dirs, run('prepare', [(d, experiment_id, metrics_config) for d in shard_dirs])):
+            record_timings(timings)
+            if info is not None:
+                prepared.append((shard_dir, info))
+        if not prepared:
+            raise ValueError(f"No exposure data found for experiment_id: {experiment_id}")
+        infos = [info for _, info in prepared]
+        report_progress('parsed', shards=len(prepared), users=sum(info['users'] for info in infos))
+
+        exposure_span = (
+            pd.Series([info['last_exposure'] for info in infos]).max()
+            - pd.Series([info['first_exposure'] for info in infos]).min()
+        )
+        time_units = [_choose_time_unit(metric_config, exposure_span) for metric_config in metric_configs]
+        variants = sorted({variant for info in infos for variant in info['variants']})
+
+        shard_partials = []
+        tasks = [(shard_dir, metric_configs, groups, time_units, selected) for shard_dir, _ in prepared]
+        for partials, timings in run('aggregate', tasks):
+            record_timings(timings)
+            shard_partials.append(partials)
+
+    analyses = [None] * len(metric_configs)
+    done = 0
+    for index, group in enumerate(groups):
+        group_partials = [partials[index] for partials in shard_partials]
+        group_analyses = _reduce_group(group, group_partials, metric_configs, variants, time_units, selected, max_points)
+        for position, analysis in zip(group, group_analyses):
+            done += 1
+            report_metric_done(done, len(metric_configs), metric_configs[position], analysis)
+            analyses[position] = analysis
+
+    return _experiment_results(
+        metric_configs, analyses, _reduce_assignment(infos), apply_correction, sections, selected
+    )
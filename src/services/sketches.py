@@ -0,0 +1,163 @@
+"""
+Mergeable quantile sketches for `quantile` metrics.
+
+A sketch is a log-bucketed histogram with relative accuracy (as in
+DDSketch): a value v is counted in bin ceil(log_gamma(|v|)) with
+gamma = (1 + a) / (1 - a), so any quantile read back is within a relative
+error a of a value at that rank. Bin keys are signed integers ordered like
+the values they cover (negative values mirror positive ones, 0 holds
+zeros), so sketches are plain (key, count) tables: merging is adding counts,
+which makes them buildable per variant, per time bucket or per chunk/shard
+and combinable afterwards. At most SKETCH_MAX_BINS bins are kept per sketch
+(the lowest collapse together), so memory per sketch does not grow with the
+number of users or events.
+"""
+import os
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+SKETCH_RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", 0.01))
+SKETCH_MAX_BINS = int(os.getenv("SKETCH_MAX_BINS", 2048))
+
+GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+LOG_GAMMA = float(np.log(GAMMA))
+# Magnitudes at or below this count as zero
+MIN_INDEXABLE_VALUE = 1e-9
+# Offset keeping bin indices of values below 1 away from the zero key
+KEY_BIAS = 1 << 30
+
+
+def sketch_keys(values) -> np.ndarray:
+    """Bin key of each value (NaNs must be dropped beforehand)"""
+    values = np.asarray(values, dtype=float)
+    keys = np.zeros(len(values), dtype=np.int64)
+    nonzero = np.abs(values) > MIN_INDEXABLE_VALUE
+    magnitude = np.ceil(np.log(np.abs(values[nonzero])) / LOG_GAMMA).astype(np.int64) + KEY_BIAS
+    keys[nonzero] = np.where(values[nonzero] > 0, magnitude, -magnitude)
+    return keys
+
+
+def key_values(keys) -> np.ndarray:
+    """Representative value of each bin key (within the relative accuracy of its values)"""
+    keys = np.asarray(keys, dtype=np.int64)
+    magnitude = np.abs(keys) - KEY_BIAS
+    values = 2 * np.power(GAMMA, magnitude.astype(float)) / (GAMMA + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * values)
+
+
+def collapse_bins(bins: pd.DataFrame, by: list, max_bins: int = SKETCH_MAX_BINS) -> pd.DataFrame:
+    """Fold the lowest bins of every sketch in a (by..., key, count) table so each keeps at most max_bins"""
+    if bins.empty or bins.groupby(by, sort=False).size().max() <= max_bins:
+        return bins
+    ordered = bins.sort_values(by + ['key'], ascending=[True] * len(by) + [False])
+    rank = ordered.groupby(by, sort=False).cumcount().to_numpy()
+    floor = ordered[rank == max_bins - 1][by + ['key']].rename(columns={'key': 'floor_key'})
+    ordered = ordered.merge(floor, on=by, how='left')
+    ordered['key'] = np.where(ordered['floor_key'].notna() & (ordered['key'] < ordered['floor_key']),
+                              ordered['floor_key'], ordered['key']).astype(np.int64)
+    return ordered.groupby(by + ['key'], as_index=False)['count'].sum()
+
+
+def bin_counts(df: pd.DataFrame, by: list, value: str = 'metric_value', max_bins: int = SKETCH_MAX_BINS) -> pd.DataFrame:
+    """
+    Sketches of df[value] for every group of df[by], built in one vectorized
+    pass, as a table with columns: *by, key, count
+    """
+    values = df[value].to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    frame = df.loc[valid, by].assign(key=sketch_keys(values[valid]))
+    bins = frame.groupby(by + ['key'], observed=True).size().reset_index(name='count')
+    return collapse_bins(bins, by, max_bins)
+
+
+def quantile_rank(n, q: float):
+    """0-based rank of the q-quantile among n values"""
+    return np.floor(q * (np.asarray(n, dtype=float) - 1))
+
+
+def quantile_ci_ranks(n, q: float, confidence: float = 0.95):
+    """
+    0-based ranks of the distribution-free order-statistic confidence
+    interval for the q-quantile: the number of values below the true
+    quantile is Binomial(n, q), so no resampling is needed.
+    """
+    n = np.asarray(n, dtype=float)
+    alpha = 1 - confidence
+    lower = np.maximum(stats.binom.ppf(alpha / 2, n, q) - 1, 0)
+    upper = np.minimum(stats.binom.ppf(1 - alpha / 2, n, q), n - 1)
+    return lower, upper
+
+
+def values_at_ranks(counts: np.ndarray, keys: np.ndarray, ranks) -> np.ndarray:
+    """
+    Values at 0-based ranks for several sketches over the same sorted keys.
+    counts is (sketches x keys); ranks has one entry per sketch.
+    """
+    ranks = np.asarray(ranks, dtype=float)
+    if len(keys) == 0:
+        return np.full(len(ranks), np.nan)
+    cumulative = np.cumsum(counts, axis=1)
+    position = np.minimum((cumulative <= ranks[:, None]).sum(axis=1), len(keys) - 1)
+    values = key_values(keys[position])
+    return np.where(cumulative[:, -1] > 0, values, np.nan)
+
+
+class QuantileSketch:
+    """A single sketch: sorted bin keys and their counts"""
+
+    def __init__(self, keys=None, counts=None):
+        self.keys = np.asarray([] if keys is None else keys, dtype=np.int64)
+        self.counts = np.asarray([] if counts is None else counts, dtype=np.int64)
+
+    @classmethod
+    def from_values(cls, values, max_bins: int = SKETCH_MAX_BINS):
+        values = np.asarray(values, dtype=float)
+        frame = pd.DataFrame({'group': 0, 'metric_value': values})
+        return cls.from_bins(bin_counts(frame, ['group'], max_bins=max_bins))
+
+    @classmethod
+    def from_bins(cls, bins: pd.DataFrame):
+        """Sketch from a (key, count) table, e.g. one group of bin_counts"""
+        merged = bins.groupby('key')['count'].sum().sort_index()
+        return cls(merged.index.to_numpy(), merged.to_numpy())
+
+    def merge(self, other: 'QuantileSketch', max_bins: int = SKETCH_MAX_BINS) -> 'QuantileSketch':
+        bins = pd.DataFrame({
+            'group': 0,
+            'key': np.concatenate([self.keys, other.keys]),
+            'count': np.concatenate([self.counts, other.counts]),
+        })
+        bins = collapse_bins(bins.groupby(['group', 'key'], as_index=False)['count'].sum(), ['group'], max_bins)
+        return QuantileSketch.from_bins(bins)
+
+    @property
+    def n(self) -> int:
+        return int(self.counts.sum())
+
+    def quantile(self, q: float) -> float:
+        return float(values_at_ranks(self.counts[None, :], self.keys, [quantile_rank(self.n, q)])[0])
+
+    def quantile_ci(self, q: float, confidence: float = 0.95) -> tuple:
+        lower, upper = quantile_ci_ranks(self.n, q, confidence)
+        values = values_at_ranks(np.vstack([self.counts, self.counts]), self.keys, [lower, upper])
+        return float(values[0]), float(values[1])
+
+    def mean(self) -> float:
+        """Mean of the bin representatives (approximate)"""
+        return float(np.average(key_values(self.keys), weights=self.counts)) if self.n else np.nan
+
+    def std(self) -> float:
+        if self.n < 2:
+            return np.nan
+        values = key_values(self.keys)
+        mean = np.average(values, weights=self.counts)
+        return float(np.sqrt(np.average((values - mean) ** 2, weights=self.counts)))
+
+    def zero_count(self) -> int:
+        return int(self.counts[self.keys == 0].sum())
+
+    def histogram(self, n_bins: int = 30) -> tuple:
+        """(counts, bin_edges) over the sketch's range, like np.histogram"""
+        values = key_values(self.keys)
+        return np.histogram(values, bins=n_bins, weights=self.counts)
@@ -1,7 +1,12 @@
+import os
 from scipy import stats
 from typing import cast, Any
 import numpy as np
 
+# p-value below which a sample ratio mismatch is reported; kept strict since
+# the check runs on every analysis
+SRM_ALPHA = float(os.getenv("SRM_ALPHA", 0.001))
+
 def calculate_cohens_h(p1, p2):
     """Cohen's h for proportions (chi-square test)"""
     return 2 * (np.arcsin(np.sqrt(p2)) - np.arcsin(np.sqrt(p1)))
@@ -53,25 +58,148 @@ def apply_multiple_testing_correction(p_values: list[float], method: str = 'fdr_
         'num_tests': len(p_values)
     }
 
+def sample_ratio_check(variant_counts: dict, expected_shares: dict | None = None, alpha: float = SRM_ALPHA) -> dict:
+    """
+    Chi-square goodness-of-fit test of assigned users per variant against
+    the expected split (equal by default). A small p-value means a sample
+    ratio mismatch: assignment or logging is broken and the metric results
+    can't be trusted.
+    """
+    variants = sorted(variant_counts)
+    observed = np.array([variant_counts[v] for v in variants], dtype=float)
+    if expected_shares is None:
+        shares = np.full(len(variants), 1.0 / len(variants)) if variants else np.zeros(0)
+    else:
+        shares = np.array([expected_shares.get(v, 0.0) for v in variants], dtype=float)
+        shares = shares / shares.sum()
+
+    if len(variants) < 2 or observed.sum() == 0:
+        statistic, p_value = np.nan, np.nan
+    else:
+        statistic, p_value = stats.chisquare(observed, observed.sum() * shares)
+
+    return {
+        'test': 'chi-square goodness-of-fit',
+        'variant_counts': {v: int(c) for v, c in zip(variants, observed)},
+        'expected_shares': {v: float(s) for v, s in zip(variants, shares)},
+        'statistic': statistic,
+        'p-value': p_value,
+        'alpha': alpha,
+        'mismatch': bool(p_value < alpha) if not np.isnan(p_value) else False,
+    }
+
+def summarize_metric(metric_df):
+    """
+    Per-variant sufficient statistics of a user-level metric table.
+
+    Returns a DataFrame indexed by variant with columns:
+      n, sum, sum_sq
+    """
+    values = metric_df['metric_value'].astype(float)
+    summary = (
+        metric_df.assign(metric_value=values, metric_sq=values ** 2)
+        .groupby('variant')
+        .agg(
+            n=('metric_value', 'size'),
+            sum=('metric_value', 'sum'),
+            sum_sq=('metric_sq', 'sum'),
+        )
+    )
+    return summary
+
+
+def _variant_stats(summary, variant):
+    """n, total, mean and sample std of one variant from its sufficient statistics"""
+    if variant not in summary.index:
+        return np.int64(0), np.float64(0.0), np.float64(np.nan), np.float64(np.nan)
+    row = summary.loc[variant]
+    n = np.int64(row['n'])
+    total = np.float64(row['sum'])
+    mean = total / n if n > 0 else np.float64(np.nan)
+    if n > 1:
+        var = (np.float64(row['sum_sq']) - total * mean) / (n - 1)
+        std = np.sqrt(max(var, 0.0))
+    else:
+        std = np.float64(np.nan)
+    return n, total, mean, std
+
+
 def run_stat_tests(metric_df, metric_config):
     """
     Given metric values, run appropriate statistical test
     """
-    variant_a = metric_df[metric_df['variant'] == 'A']['metric_value']
-    variant_b = metric_df[metric_df['variant'] == 'B']['metric_value']
-    
-    variant_a_data = metric_df[metric_df['variant'] == 'A']['metric_value']
-    variant_b_data = metric_df[metric_df['variant'] == 'B']['metric_value']
+    if metric_config['aggregation'] == 'quantile':
+        from .sketches import QuantileSketch
+        sketches = {
+            variant: QuantileSketch.from_values(metric_df.loc[metric_df['variant'] == variant, 'metric_value'])
+            for variant in ('A', 'B')
+        }
+        return run_quantile_test(sketches['A'], sketches['B'], metric_config)
+    return run_stat_tests_from_summary(summarize_metric(metric_df), metric_config)
+
+
+def run_quantile_test(sketch_a, sketch_b, metric_config):
+    """
+    Test the difference of a quantile between variants from sketches of
+    their per-user values (see quantile_user_values). Each quantile's
+    standard error is read off its distribution-free order-statistic
+    interval, and the difference is tested with a normal approximation, so
+    no bootstrap is needed. When neither interval has any width (e.g. too
+    few users) there is no evidence either way: the p-value is 1.
+    """
+    q = float(metric_config.get('quantile', 0.5))
+    z_crit = stats.norm.ppf(0.975)
+
+    quantile_a, quantile_b = sketch_a.quantile(q), sketch_b.quantile(q)
+    ci_a, ci_b = sketch_a.quantile_ci(q), sketch_b.quantile_ci(q)
+    se_a = (ci_a[1] - ci_a[0]) / (2 * z_crit)
+    se_b = (ci_b[1] - ci_b[0]) / (2 * z_crit)
+    se = np.sqrt(se_a ** 2 + se_b ** 2)
 
-    n_a = len(variant_a)
-    n_b = len(variant_b)
+    difference = quantile_b - quantile_a
+    if se > 0:
+        z_stat = difference / se
+        p_value = float(2 * stats.norm.sf(abs(z_stat)))
+    else:
+        z_stat = np.nan
+        p_value = 1.0
+
+    return {
+        'test': 'quantile z-test',
+        'quantile': q,
+        'statistic': z_stat,
+        'p-value': p_value,
+        'variant_a_quantile': quantile_a,
+        'variant_b_quantile': quantile_b,
+        'variant_a_ci': list(ci_a),
+        'variant_b_ci': list(ci_b),
+        'variant_a_n': sketch_a.n,
+        'variant_b_n': sketch_b.n,
+        'difference': difference,
+        'difference_ci': [difference - z_crit * se, difference + z_crit * se],
+        'lift': (quantile_b / quantile_a) - 1 if quantile_a > 0 else None,
+        'significance': 'YES' if p_value < 0.05 else 'NO',
+        'effect_size': calculate_cohens_d(
+            quantile_a, quantile_b, sketch_a.std(), sketch_b.std(), sketch_a.n, sketch_b.n
+        ),
+    }
+
+
+def run_stat_tests_from_summary(summary, metric_config):
+    """
+    Run the statistical test for a metric from per-variant sufficient
+    statistics (see summarize_metric), so engines that aggregate outside
+    pandas only need to hand back one row per variant.
+    """
+    n_a, total_a, mean_a, std_a = _variant_stats(summary, 'A')
+    n_b, total_b, mean_b, std_b = _variant_stats(summary, 'B')
 
     agg_type = metric_config['aggregation']
 
     if agg_type == 'binary':
         # chi-square test for conversion rate
-        conversions_a = variant_a.sum()
-        conversions_b = variant_b.sum()
+        conversions_a = total_a
+        conversions_b = total_b
 
         rate_a = conversions_a / n_a
         rate_b = conversions_b / n_b
@@ -106,18 +234,14 @@ def run_stat_tests(metric_df, metric_config):
     
     else:  # sum or count
         # two-sample t-test
-        t_stat, p_value = stats.ttest_ind(variant_a, variant_b)
+        t_stat, p_value = stats.ttest_ind_from_stats(mean_a, std_a, n_a, mean_b, std_b, n_b)
         
         # Confidence intervals
-        mean_a = variant_a.mean()
-        mean_b = variant_b.mean()
-        std_a = variant_a_data.std()
-        std_b = variant_b_data.std()
-        se_a = stats.sem(variant_a)
-        se_b = stats.sem(variant_b)
+        se_a = std_a / np.sqrt(n_a)
+        se_b = std_b / np.sqrt(n_b)
         
-        ci_a = stats.t.interval(0.95, len(variant_a)-1, mean_a, se_a)
-        ci_b = stats.t.interval(0.95, len(variant_b)-1, mean_b, se_b)
+        ci_a = stats.t.interval(0.95, n_a-1, mean_a, se_a)
+        ci_b = stats.t.interval(0.95, n_b-1, mean_b, se_b)
         
         effect_size = calculate_cohens_d(mean_a, mean_b, std_a, std_b, n_a, n_b)
 
@@ -125,11 +249,11 @@ def run_stat_tests(metric_df, metric_config):
             'test': 't-test',
             'statistic': t_stat,
             'p-value': p_value,
-            'variant_a_mean': variant_a.mean(),
-            'variant_b_mean': variant_b.mean(),
+            'variant_a_mean': mean_a,
+            'variant_b_mean': mean_b,
             'variant_a_ci': list(ci_a),
             'variant_b_ci': list(ci_b),
-            'lift': (mean_b / mean_a) - 1 if variant_a.mean() > 0 else None,
+            'lift': (mean_b / mean_a) - 1 if mean_a > 0 else None,
             'significance': 'YES' if cast(float, p_value) < 0.05 else 'NO',
             'effect_size': effect_size,
         }
@@ -0,0 +1,53 @@
+"""
+Canonical user id keys.
+
+The same user id can be read as different dtypes: 1 in an integer column,
+1.0 in a column that also holds a missing value (or in a CSV chunk the
+reader inferred as float), '1' in a string column. Whatever splits or
+samples users by id must key these alike, or a user's exposures and events
+end up apart. Ids with an integral value are keyed by that integer; all
+other ids by their string form, and missing ids by ''.
+"""
+import numpy as np
+import pandas as pd
+
+# Floats represent every integer up to this magnitude exactly
+MAX_EXACT_FLOAT_INT = 2 ** 53
+
+
+def _integral_values(user_ids: pd.Series):
+    """(mask, values): which ids have an integral value, and those values as int64 (0 elsewhere)"""
+    if not pd.api.types.is_integer_dtype(user_ids.dtype) and not pd.api.types.is_float_dtype(user_ids.dtype):
+        # strings; all-integer text comes back as int64, anything else as float64
+        user_ids = pd.to_numeric(user_ids, errors='coerce')
+    if pd.api.types.is_integer_dtype(user_ids.dtype):
+        return user_ids.notna().to_numpy(), user_ids.to_numpy(dtype=np.int64, na_value=0)
+    values = user_ids.to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        integral = np.isfinite(values) & (values == np.round(values)) & (np.abs(values) <= MAX_EXACT_FLOAT_INT)
+    return integral, np.where(integral, values, 0).astype(np.int64)
+
+
+def _text_keys(user_ids: pd.Series) -> np.ndarray:
+    return user_ids.astype(str).where(user_ids.notna(), '').to_numpy(dtype=object)
+
+
+def user_id_hashes(user_ids) -> np.ndarray:
+    """Stable uint64 hash of each user id's canonical key, the same in every process"""
+    user_ids = pd.Series(user_ids).reset_index(drop=True)
+    integral, values = _integral_values(user_ids)
+    hashes = pd.util.hash_array(values)
+    if not integral.all():
+        others = ~integral
+        hashes[others] = pd.util.hash_array(_text_keys(user_ids[others]))
+    return hashes
+
+
+def canonical_user_ids(user_ids) -> pd.Series:
+    """Each user id's canonical key as text (None where missing), for storage that compares ids as strings"""
+    user_ids = pd.Series(user_ids)
+    integral, values = _integral_values(user_ids)
+    keys = pd.Series(_text_keys(user_ids), index=user_ids.index, dtype=object)
+    keys[integral] = values[integral].astype(str)
+    keys[user_ids.isna().to_numpy()] = None
+    return keys
@@ -4,5 +4,11 @@ def validate_csv_structure(df: pd.DataFrame, required_columns: list):
     """
     Validate files are valid CSV with required columns
     """
-    missing = set(required_columns) - set(df.columns)
+    return validate_columns(df.columns, required_columns)
+
+def validate_columns(columns, required_columns: list):
+    """
+    Return required columns missing from a list of column names
+    """
+    missing = set(required_columns) - set(columns)
     return missing
@@ -0,0 +1,67 @@
+"""
+Metrics with several attribution windows.
+
+Instead of one "window", a metric config may list "windows" (each a
+{"start", "end"} object with an optional "label"), e.g. day-1, day-7 and
+day-28 conversion of one event. expand_metric_windows turns such a metric
+into one ordinary metric per window, so each window gets its own tests,
+series and multiple-testing slot; the pandas engine still aggregates all
+windows of an event in one pass (see plan_event_groups). Kept free of
+pandas so uploads can be validated before the analysis stack is loaded.
+"""
+
+
+def _window_label(window: dict, same_start: bool) -> str:
+    if window.get('label'):
+        return str(window['label'])
+    return str(window['end']) if same_start else f"{window['start']}_{window['end']}"
+
+
+def expand_metric_windows(metrics_config: dict) -> dict:
+    """
+    metrics_config with each multi-window metric replaced, in place order,
+    by one metric per window: metric_id and display_name get the window's
+    label (default: its end, or start_end when the windows start at
+    different times) and window_of keeps the original metric_id. Configs
+    without "windows" are kept as they are, so expanding twice is harmless.
+    Raises ValueError for a malformed window list or a clashing metric_id.
+    """
+    expanded = {}
+    added_ids = set()
+    for key, metric_config in metrics_config.items():
+        windows = metric_config.get('windows') if isinstance(metric_config, dict) else None
+        if windows is None:
+            expanded[key] = metric_config
+            continue
+
+        metric_id = metric_config.get('metric_id')
+        if 'window' in metric_config:
+            raise ValueError(f"Metric '{metric_id}' has both 'window' and 'windows'")
+        if not isinstance(windows, list) or not windows or not all(
+            isinstance(window, dict) and 'start' in window and 'end' in window for window in windows
+        ):
+            raise ValueError(f"Metric '{metric_id}' windows must be a non-empty list of objects with start and end")
+
+        same_start = len({str(window['start']) for window in windows}) == 1
+        base = {name: value for name, value in metric_config.items() if name != 'windows'}
+        for window in windows:
+            label = _window_label(window, same_start)
+            window_key, window_id = f"{key}_{label}", f"{metric_id}_{label}"
+            if window_key in metrics_config or window_key in expanded or window_id in added_ids:
+                raise ValueError(f"Metric '{metric_id}' window label '{label}' is not unique")
+            expanded[window_key] = {
+                **base,
+                'metric_id': window_id,
+                'display_name': f"{base.get('display_name', metric_id)} ({label})",
+                'window': {'start': window['start'], 'end': window['end']},
+                'window_of': metric_id,
+            }
+            added_ids.add(window_id)
+
+    clashes = sorted(
+        str(metric_config.get('metric_id')) for metric_config in expanded.values()
+        if isinstance(metric_config, dict) and 'window_of' not in metric_config and metric_config.get('metric_id') in added_ids
+    )
+    if clashes:
+        raise ValueError(f"Metric ids clash with expanded windows: {', '.join(clashes)}")
+    return expanded
@@ -0,0 +1,177 @@
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC)
+
+# The app reads its settings at import, so point it at throwaway storage first
+_TMP = tempfile.mkdtemp(prefix='ab-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ['UPLOAD_DIR'] = os.path.join(_TMP, 'uploads')
+os.environ['PREPARED_DIR'] = os.path.join(_TMP, 'prepared')
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('ALGORITHM', 'HS256')
+
+METRICS_CONFIG = {
+    'metric_01': {
+        'metric_id': 'conversion_7d',
+        'display_name': '7-day Conversion Rate',
+        'event': {'name': 'purchase'},
+        'aggregation': 'binary',
+        'window': {'start': '0h', 'end': '7d'},
+    },
+    'metric_02': {
+        'metric_id': 'revenue_14d',
+        'display_name': '14-day Revenue',
+        'event': {'name': 'purchase'},
+        'aggregation': 'sum',
+        'window': {'start': '0h', 'end': '14d'},
+    },
+    'metric_03': {
+        'metric_id': 'session_7d',
+        'display_name': '7-day Session Count',
+        'event': {'name': 'session_start'},
+        'aggregation': 'count',
+        'window': {'start': '0h', 'end': '7d'},
+    },
+    'metric_04': {
+        'metric_id': 'revenue_p90',
+        'display_name': '14-day Revenue p90',
+        'event': {'name': 'purchase'},
+        'aggregation': 'quantile',
+        'quantile': 0.9,
+        'window': {'start': '0h', 'end': '14d'},
+    },
+}
+
+
+def make_experiment(users: int = 600, seed: int = 7, experiment_id: str = '0'):
+    """Synthetic exposures and events: variant B converts and spends a little more"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2025-01-01')
+    user_ids = np.arange(users)
+    variants = np.where(rng.random(users) < 0.5, 'A', 'B')
+    exposure_times = start + pd.to_timedelta(rng.integers(0, 14 * 86400, users), unit='s')
+    exposures = pd.DataFrame({
+        'user_id': user_ids,
+        'experiment_id': experiment_id,
+        'variant': variants,
+        'exposure_time': exposure_times,
+    })
+
+    events = []
+    for user, variant, exposed in zip(user_ids, variants, exposure_times):
+        lift = 1.3 if variant == 'B' else 1.0
+        for _ in range(rng.poisson(3)):
+            # some sessions fall before exposure, outside every window
+            offset = pd.Timedelta(hours=float(rng.uniform(-48, 20 * 24)))
+            events.append((user, 'session_start', exposed + offset, np.nan))
+        for _ in range(rng.poisson(0.6 * lift)):
+            offset = pd.Timedelta(hours=float(rng.uniform(0, 20 * 24)))
+            events.append((user, 'purchase', exposed + offset, round(float(rng.lognormal(3, 1)) * lift, 2)))
+    events = pd.DataFrame(events, columns=['user_id', 'event_name', 'event_time', 'event_value'])
+    return exposures, events
+
+
+@pytest.fixture
+def metrics_config():
+    return json.loads(json.dumps(METRICS_CONFIG))
+
+
+@pytest.fixture(scope='session')
+def experiment():
+    return make_experiment()
+
+
+@pytest.fixture
+def experiment_files(tmp_path, experiment):
+    """The synthetic experiment written as CSV files: (metrics, exposures, events) paths"""
+    exposures, events = experiment
+    paths = tuple(str(tmp_path / name) for name in ('metrics.json', 'exposures.csv', 'events.csv'))
+    with open(paths[0], 'w') as f:
+        json.dump(METRICS_CONFIG, f)
+    exposures.to_csv(paths[1], index=False)
+    events.to_csv(paths[2], index=False)
+    return paths
+
+
+@pytest.fixture(scope='session')
+def client():
+    from fastapi.testclient import TestClient
+
+    from api.database import Base, engine
+    from api.main import app
+
+    Base.metadata.create_all(bind=engine)
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope='session')
+def auth_headers(client):
+    client.post('/api/users/register', json={'email': 'tester@example.com', 'username': 'tester', 'password': 'pw'})
+    response = client.post('/api/users/token', data={'username': 'tester', 'password': 'pw'})
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def upload(client, auth_headers, experiment_files):
+    """
+    Upload the synthetic experiment's files (and optionally a users file) to
+    endpoint; metrics_config may be raw bytes, extra form fields are passed through
+    """
+    def _upload(metrics_config=None, users_csv: bytes | None = None, endpoint='/api/files/upload', **form):
+        metrics_path, exposures_path, events_path = experiment_files
+        if metrics_config is None:
+            metrics = open(metrics_path, 'rb').read()
+        else:
+            metrics = metrics_config if isinstance(metrics_config, bytes) else json.dumps(metrics_config).encode()
+        with open(exposures_path, 'rb') as exposures, open(events_path, 'rb') as events:
+            files = {
+                'json_file': ('metrics.json', metrics),
+                'exposures_file': ('exposures.csv', exposures),
+                'events_file': ('events.csv', events),
+            }
+            if users_csv is not None:
+                files['users_file'] = ('users.csv', users_csv)
+            data = {'exp_name': 'test', 'experiment_id': '0', 'selected_option': 'custom', **form}
+            return client.post(endpoint, headers=auth_headers, files=files, data=data)
+    return _upload
+
+
+def assert_results_close(expected, actual, rel=1e-7, path=''):
+    """Deep comparison of analysis results with a float tolerance; distribution value samples are skipped"""
+    if isinstance(expected, dict):
+        assert isinstance(actual, dict), path
+        assert set(expected) == set(actual), f'{path}: {sorted(set(expected) ^ set(actual))}'
+        for key in expected:
+            if key != 'values':
+                assert_results_close(expected[key], actual[key], rel, f'{path}/{key}')
+    elif isinstance(expected, (list, tuple)):
+        assert len(expected) == len(actual), path
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            assert_results_close(a, b, rel, f'{path}/{i}')
+    elif isinstance(expected, float) and isinstance(actual, (int, float)):
+        if np.isnan(expected):
+            assert np.isnan(actual), path
+        else:
+            assert actual == pytest.approx(expected, rel=rel, abs=1e-9), path
+    else:
+        assert expected == actual, path
+
+
+@pytest.fixture
+def db(client):
+    from api.database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
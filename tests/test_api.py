@@ -0,0 +1,456 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import UTC, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import assert_results_close
+
+
+def test_upload_analyzes_every_metric(upload):
+    response = upload()
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body['processing_error'] is None
+    assert {'conversion_7d', 'revenue_14d', 'session_7d', 'revenue_p90'} <= set(body['analysis'])
+
+
+def test_upload_rejects_unknown_quantile_user_value(upload, metrics_config):
+    metrics_config['metric_04']['user_value'] = 'max'
+    response = upload(metrics_config)
+    assert response.status_code == 400
+    assert 'user_value' in response.json()['detail']
+
+
+def test_preview_upload_is_marked_approximate(upload):
+    full = upload().json()['analysis']
+    response = upload(preview='true', preview_fraction='0.5')
+    assert response.status_code == 200, response.text
+    analysis = response.json()['analysis']
+    assert analysis['_preview']['fraction'] == 0.5
+    assert analysis['_preview']['sampled_users'] < full['_assignment_check']['users']
+    assert analysis['revenue_14d']['approximate'] is True
+    assert 'variant_a_ci_projected' in analysis['revenue_14d']
+    assert 'difference_ci_projected' in analysis['revenue_p90']
+
+
+def test_preview_rejects_fraction_out_of_range(upload):
+    assert upload(preview='true', preview_fraction='1.5').status_code == 400
+    assert upload(preview_fraction='0.5').status_code == 400
+
+
+def _cache_get(cache, db, key, compute):
+    return asyncio.run(cache.get_or_compute(db, key, compute))
+
+
+def test_result_cache_hits_after_first_computation(db):
+    from api.result_cache import ResultCache
+
+    calls = []
+    compute = lambda: (calls.append(1) or {'metric': len(calls)}, None)
+    key = uuid.uuid4().hex
+    assert _cache_get(ResultCache(), db, key, compute) == ({'metric': 1}, None, 'miss')
+    assert _cache_get(ResultCache(), db, key, compute) == ({'metric': 1}, None, 'hit')
+    assert len(calls) == 1
+
+
+def test_result_cache_does_not_store_errors(db):
+    from api.result_cache import ResultCache
+
+    cache, key = ResultCache(), uuid.uuid4().hex
+    assert _cache_get(cache, db, key, lambda: (None, 'Analysis failed: bad input'))[2] == 'miss'
+    assert _cache_get(cache, db, key, lambda: ({'metric': 1}, None)) == ({'metric': 1}, None, 'miss')
+
+
+def test_result_cache_shares_in_flight_computations(db):
+    from api.result_cache import ResultCache
+
+    cache, key = ResultCache(), uuid.uuid4().hex
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'metric': 1}, None
+
+    async def concurrently():
+        return await asyncio.gather(*(cache.get_or_compute(db, key, compute) for _ in range(3)))
+
+    statuses = sorted(status for _, _, status in asyncio.run(concurrently()))
+    assert statuses == ['miss', 'shared', 'shared']
+    assert len(calls) == 1
+
+
+def test_result_cache_expires_and_prunes_rows(db):
+    from api import crud, models
+    from api.result_cache import ResultCache
+
+    stale = uuid.uuid4().hex
+    crud.store_cached_analysis(db, stale, {'metric': 'stale'})
+    db.query(models.AnalysisCache).filter(models.AnalysisCache.cache_key == stale).update(
+        {'created_at': datetime.now(UTC) - timedelta(hours=2)}
+    )
+    db.commit()
+
+    cache = ResultCache(ttl_seconds=3600, max_rows=3)
+    assert _cache_get(cache, db, stale, lambda: ({'metric': 'fresh'}, None)) == ({'metric': 'fresh'}, None, 'miss')
+    for _ in range(4):
+        _cache_get(cache, db, uuid.uuid4().hex, lambda: ({'metric': 1}, None))
+    assert db.query(models.AnalysisCache).count() == 3
+
+
+@pytest.mark.parametrize('engine', ['duckdb', 'sharded'])
+def test_every_engine_returns_the_pandas_results(upload, engine):
+    expected = upload(engine='pandas').json()['analysis']
+    response = upload(engine=engine)
+    assert response.status_code == 200, response.text
+    assert response.json()['processing_error'] is None
+    assert_results_close(expected, response.json()['analysis'])
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'duckdb', 'sharded'])
+def test_analysis_errors_are_reported_alike_by_every_engine(upload, metrics_config, engine):
+    metrics_config['metric_01']['aggregation'] = 'median'
+    response = upload(metrics_config, engine=engine)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body['analysis'] is None
+    assert body['processing_error'].startswith('Analysis failed: ')
+
+
+def _user_metric_table(experiment, metrics_config):
+    """The synthetic experiment as a per-user metric table (see services.aggregated)"""
+    from services.metric_analysis import analyze_metric
+
+    exposures, events = experiment
+    table = exposures[['user_id', 'variant', 'exposure_time']]
+    for metric in metrics_config.values():
+        values = analyze_metric(exposures, events, metric).set_index('user_id')['metric_value']
+        table = table.assign(**{metric['metric_id']: table['user_id'].map(values).to_numpy()})
+    return table
+
+
+def test_aggregated_user_table_matches_raw_upload(client, auth_headers, upload, experiment, metrics_config, tmp_path):
+    del metrics_config['metric_04']
+    raw = upload(metrics_config).json()['analysis']
+    summary_path = tmp_path / 'users.csv'
+    _user_metric_table(experiment, metrics_config).to_csv(summary_path, index=False)
+
+    with open(summary_path, 'rb') as summary:
+        response = client.post(
+            '/api/files/upload/aggregated', headers=auth_headers,
+            files={'json_file': ('metrics.json', json.dumps(metrics_config).encode()), 'summary_file': ('users.csv', summary)},
+            data={'exp_name': 'test', 'experiment_id': '0', 'selected_option': 'custom', 'input_mode': 'users'},
+        )
+    assert response.status_code == 200, response.text
+    analysis = response.json()['analysis']
+    for metric in metrics_config.values():
+        for key in ('p-value', 'statistic', 'lift'):
+            assert analysis[metric['metric_id']][key] == pytest.approx(raw[metric['metric_id']][key], rel=1e-9)
+
+
+def test_aggregated_upload_rejects_unknown_input_mode(client, auth_headers, metrics_config):
+    response = client.post(
+        '/api/files/upload/aggregated', headers=auth_headers,
+        files={'json_file': ('metrics.json', json.dumps(metrics_config).encode()), 'summary_file': ('s.csv', b'a\n1\n')},
+        data={'exp_name': 'test', 'experiment_id': '0', 'selected_option': 'custom', 'input_mode': 'events'},
+    )
+    assert response.status_code == 400
+
+
+def test_admission_queues_in_arrival_order():
+    from api.admission import AdmissionController
+
+    controller = AdmissionController(memory_budget=100, max_concurrent=2, max_queue=4, max_wait=5)
+    order = []
+
+    async def analysis(name, cost, hold):
+        async with controller.admit(cost):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def run():
+        await asyncio.gather(
+            analysis('big', 80, 0.05), analysis('medium', 50, 0.01), analysis('small', 10, 0.01),
+            analysis('oversized', 500, 0.01),
+        )
+
+    asyncio.run(run())
+    # small fits beside big but queues behind medium; oversized runs alone at the end
+    assert order == ['big', 'medium', 'small', 'oversized']
+    assert controller.active == 0 and controller.reserved == 0
+
+
+@pytest.mark.parametrize('max_queue,status_code', [(0, 429), (1, 503)])
+def test_busy_server_rejects_uploads_with_retry_after(upload, metrics_config, monkeypatch, max_queue, status_code):
+    from api.admission import AdmissionController
+    from api.routers import files
+
+    busy = AdmissionController(max_concurrent=0, max_queue=max_queue, max_wait=0.05, retry_after=7)
+    monkeypatch.setattr(files, 'admission', busy)
+    # a config not analyzed before, so the result cache can't answer it
+    metrics_config['metric_01']['display_name'] = uuid.uuid4().hex
+    response = upload(metrics_config)
+    assert response.status_code == status_code
+    assert response.headers['Retry-After'] == '7'
+    assert busy.active == 0 and not busy._waiters
+
+
+@pytest.fixture
+def stored_upload(upload):
+    body = upload().json()
+    return body['id'], body['analysis']
+
+
+def test_series_endpoint_returns_columnar_daily_series(client, auth_headers, stored_upload):
+    upload_id, analysis = stored_upload
+    daily = analysis['revenue_14d']['daily_timeseries']
+    response = client.get(f'/api/files/{upload_id}/metrics/revenue_14d/series/daily', headers=auth_headers)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    columns = body['columns']
+    assert body['length'] == len(daily)
+    assert {len(values) for values in columns.values()} == {len(daily)}
+    assert columns['date'] == sorted(columns['date'])
+    assert sorted(columns['metric_value']) == pytest.approx(sorted(row['metric_value'] for row in daily))
+
+
+def test_series_endpoint_limits_range_and_points(client, auth_headers, stored_upload):
+    upload_id, _ = stored_upload
+    url = f'/api/files/{upload_id}/metrics/revenue_14d/series/cumulative'
+    columns = client.get(url, headers=auth_headers, params={'start': '2025-01-05', 'end': '2025-01-10'}).json()['columns']
+    start, end = (pd.Timestamp(day).value // 10 ** 6 for day in ('2025-01-05', '2025-01-10'))
+    assert columns['date'] and all(start <= date <= end for date in columns['date'])
+
+    columns = client.get(url, headers=auth_headers, params={'max_points': 5}).json()['columns']
+    assert max(columns['variant'].count(variant) for variant in set(columns['variant'])) == 5
+
+
+def test_series_endpoint_streams_arrow(client, auth_headers, stored_upload):
+    import pyarrow as pa
+
+    upload_id, analysis = stored_upload
+    response = client.get(f'/api/files/{upload_id}/metrics/revenue_p90/series/ci', headers=auth_headers,
+                          params={'format': 'arrow'})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/vnd.apache.arrow.stream'
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == len(analysis['revenue_p90']['ci_timeseries'])
+    assert table.schema.field('date').type == pa.timestamp('ms')
+
+
+def test_series_endpoint_errors(client, auth_headers, upload, stored_upload):
+    upload_id, _ = stored_upload
+    base = f'/api/files/{upload_id}/metrics'
+    assert client.get(f'{base}/revenue_14d/series/distribution', headers=auth_headers).status_code == 400
+    assert client.get(f'{base}/revenue_14d/series/daily', headers=auth_headers, params={'format': 'csv'}).status_code == 400
+    assert client.get(f'{base}/unknown/series/daily', headers=auth_headers).status_code == 404
+    assert client.get(f'{base}/revenue_14d/series/daily', headers=auth_headers,
+                      params={'start': 'not a date'}).status_code == 400
+
+    partial_id = upload(sections='ci').json()['id']
+    response = client.get(f'/api/files/{partial_id}/metrics/revenue_14d/series/daily', headers=auth_headers)
+    assert response.status_code == 409
+
+
+def _users_csv(experiment) -> bytes:
+    """A users file for the synthetic experiment: device for every user, country for most"""
+    exposures, _ = experiment
+    rng = np.random.default_rng(11)
+    users = pd.DataFrame({
+        'user_id': exposures['user_id'],
+        'device': rng.choice(['android', 'ios', 'web'], len(exposures)),
+        'country': rng.choice(['DE', 'NL', None], len(exposures), p=[0.5, 0.4, 0.1]),
+    })
+    return users.to_csv(index=False).encode()
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'duckdb'])
+def test_segments_partition_every_users_results(upload, experiment, engine):
+    response = upload(users_csv=_users_csv(experiment), segments='device,country', engine=engine)
+    assert response.status_code == 200, response.text
+    analysis = response.json()['analysis']
+    users = analysis['_assignment_check']['users']
+
+    for metric_id in ('conversion_7d', 'revenue_14d', 'session_7d'):
+        segments = analysis[metric_id]['segments']
+        assert set(segments) == {'device', 'country'}
+        assert set(segments['device']) == {'android', 'ios', 'web'}
+        for levels in segments.values():
+            assert sum(result['users']['A'] + result['users']['B'] for result in levels.values()) == users
+            assert all(result['tested'] for result in levels.values() if min(result['users'].values()) >= 30)
+    # quantile segments count the users with a value, a subset of each segment
+    for levels in analysis['revenue_p90']['segments'].values():
+        assert sum(result['users']['A'] + result['users']['B'] for result in levels.values()) < users
+
+
+def test_segment_results_agree_across_engines(upload, experiment):
+    users_csv = _users_csv(experiment)
+    expected = upload(users_csv=users_csv, segments='device', engine='pandas').json()['analysis']
+    actual = upload(users_csv=users_csv, segments='device', engine='duckdb').json()['analysis']
+    for metric_id in ('conversion_7d', 'revenue_14d', 'session_7d', 'revenue_p90'):
+        assert_results_close(expected[metric_id]['segments'], actual[metric_id]['segments'])
+
+
+def test_segments_reject_unknown_attribute(upload, experiment):
+    response = upload(users_csv=_users_csv(experiment), segments='plan')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'duckdb'])
+def test_skipped_sections_are_computed_on_demand(client, auth_headers, upload, engine):
+    full = upload(engine='pandas').json()['analysis']
+    body = upload(sections='ci', engine=engine).json()
+    analysis = body['analysis']
+    assert analysis['_sections_info']['skipped'] == ['daily', 'cumulative', 'distribution', 'lift']
+    assert 'daily_timeseries' not in analysis['revenue_14d']
+
+    for metric_id in ('revenue_14d', 'revenue_p90'):
+        response = client.get(f"/api/files/{body['id']}/metrics/{metric_id}/sections", headers=auth_headers,
+                              params={'sections': 'daily,lift'})
+        assert response.status_code == 200, response.text
+        sections = response.json()
+        assert_results_close(full[metric_id]['daily_timeseries'], sections['daily_timeseries'])
+        assert_results_close(full[metric_id]['lift_timeseries'], sections['lift_timeseries'])
+
+    # computed sections are stored with the upload
+    stored = client.get(f"/api/files/{body['id']}", headers=auth_headers).json()['analysis']
+    assert 'daily_timeseries' in stored['revenue_p90']
+
+
+def test_sections_endpoint_errors(client, auth_headers, upload):
+    upload_id = upload(sections='ci').json()['id']
+    base = f'/api/files/{upload_id}/metrics'
+    assert client.get(f'{base}/revenue_14d/sections', headers=auth_headers, params={'sections': 'bogus'}).status_code == 400
+    assert client.get(f'{base}/unknown/sections', headers=auth_headers, params={'sections': 'daily'}).status_code == 404
+    assert client.get('/api/files/999999/metrics/revenue_14d/sections', headers=auth_headers,
+                      params={'sections': 'daily'}).status_code == 404
+
+
+def test_power_simulation_from_an_upload_baseline(client, auth_headers, upload):
+    upload_id = upload().json()['id']
+    response = client.post('/api/power-simulation', headers=auth_headers, json={
+        'upload_id': upload_id, 'metric_id': 'revenue_14d', 'mde': 0.2,
+        'sample_sizes': [500, 5000], 'simulations': 200, 'seed': 3,
+    })
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert result['distribution'] == 'empirical'
+    assert result['test'] == 't-test'
+    assert [point['sample_size_per_variant'] for point in result['curve']] == [500, 5000]
+    assert result['curve'][0]['power'] < result['curve'][1]['power']
+
+    response = client.post('/api/power-simulation', headers=auth_headers, json={
+        'upload_id': upload_id, 'metric_id': 'conversion_7d', 'mde': 0.2, 'simulations': 100, 'seed': 3,
+    })
+    assert response.status_code == 200, response.text
+    assert response.json()['distribution'] == 'bernoulli'
+
+
+def test_power_simulation_request_errors(client, auth_headers):
+    distribution = {'name': 'bernoulli', 'p': 0.1}
+    for body in ({'mde': 0.2}, {'mde': 0.2, 'distribution': distribution, 'upload_id': 1, 'metric_id': 'x'}):
+        assert client.post('/api/power-simulation', headers=auth_headers, json=body).status_code == 400
+    response = client.post('/api/power-simulation', headers=auth_headers,
+                           json={'mde': 0.2, 'distribution': distribution, 'sample_sizes': []})
+    assert response.status_code == 422
+    response = client.post('/api/power-simulation', headers=auth_headers,
+                           json={'mde': 0.2, 'distribution': {'name': 'bernoulli'}})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('limits', [{'max_file_bytes': 1_000}, {'max_request_bytes': 20_000}])
+def test_oversized_uploads_are_rejected_and_removed(upload, monkeypatch, limits):
+    from api import uploads
+    from api.routers import files
+
+    spools = []
+
+    def limited_spool():
+        spools.append(uploads.UploadSpool(**limits))
+        return spools[-1]
+
+    monkeypatch.setattr(files, 'UploadSpool', limited_spool)
+    response = upload()
+    assert response.status_code == 413
+    assert 'limit' in response.json()['detail']
+    assert len(spools) == 1 and not os.path.exists(spools[0].path)
+
+
+def test_spooled_hash_is_the_sha256_of_the_upload(monkeypatch, tmp_path):
+    import hashlib
+    import io
+
+    from fastapi import UploadFile
+
+    from api import uploads
+
+    # several chunks, the last one partial
+    monkeypatch.setattr(uploads, 'UPLOAD_CHUNK_SIZE', 1_000)
+    content = np.random.default_rng(0).bytes(4_500)
+
+    with uploads.UploadSpool(directory=str(tmp_path)) as spool:
+        spooled = asyncio.run(spool.add('events', UploadFile(io.BytesIO(content), filename='events.csv')))
+        assert spooled.sha256 == hashlib.sha256(content).hexdigest()
+        assert spooled.size == len(content) == spool.total_bytes
+        with open(spooled.path, 'rb') as f:
+            assert f.read() == content
+    assert not os.path.exists(spool.path)
+
+
+def _sse_events(text: str) -> list:
+    """(event, data) pairs of a text/event-stream body, skipping comments"""
+    events = []
+    for block in text.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_upload_stream_reports_progress_then_the_upload(upload, db, monkeypatch):
+    from api import models
+    from api.result_cache import ResultCache
+    from api.routers import files
+
+    # metric progress is only reported when the analysis runs, not on a cache hit
+    monkeypatch.setattr(files, 'result_cache', ResultCache())
+    db.query(models.AnalysisCache).delete()
+    db.commit()
+
+    response = upload(endpoint='/api/files/upload/stream')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = _sse_events(response.text)
+
+    *progress, (final, result) = events
+    assert final == 'result'
+    assert {event for event, _ in progress} == {'progress'}
+    stages = [data['stage'] for _, data in progress]
+    assert stages == ['spooled', 'parsed', 'validated', *['metric'] * 4, 'serialized', 'analyzed', 'stored']
+    metrics = [data for data in (data for _, data in progress) if data['stage'] == 'metric']
+    assert [data['index'] for data in metrics] == [1, 2, 3, 4]
+    assert {data['total'] for data in metrics} == {4}
+    assert {data['metric_id'] for data in metrics} == {'conversion_7d', 'revenue_14d', 'session_7d', 'revenue_p90'}
+
+    assert result['processing_error'] is None
+    expected = upload().json()
+    assert result['id'] != expected['id']
+    assert set(result) == set(expected)
+    assert_results_close(expected['analysis'], result['analysis'])
+
+
+def test_upload_stream_reports_errors(upload):
+    response = upload(b'{not json', endpoint='/api/files/upload/stream')
+    assert response.status_code == 200
+    events = _sse_events(response.text)
+    assert events[0][1]['stage'] == 'spooled'
+    event, error = events[-1]
+    assert event == 'error'
+    assert error['status_code'] == 400
+    assert 'JSON' in error['detail']
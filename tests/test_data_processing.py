@@ -0,0 +1,429 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import assert_results_close
+from api.routers.files import make_json_serializable
+from services.analysis import prepare_experiment_data, run_experiment_analysis
+from services.load import load_files
+
+
+def _reference(experiment_files, sections=None):
+    metrics_path, exposures_path, events_path = experiment_files
+    metrics_config, exposures, events, _ = load_files(metrics_path, exposures_path, events_path, experiment_id='0')
+    results = run_experiment_analysis('0', exposures, events, metrics_config, max_workers=1, sections=sections)
+    return make_json_serializable(results)
+
+
+@pytest.mark.parametrize('sections', [None, [], ['daily', 'ci']])
+def test_duckdb_engine_matches_pandas(experiment_files, metrics_config, tmp_path, sections):
+    from services.duckdb_engine import run_experiment_analysis_duckdb
+
+    _, exposures_path, events_path = experiment_files
+    results = run_experiment_analysis_duckdb(
+        '0', exposures_path, events_path, metrics_config, temp_directory=str(tmp_path), sections=sections
+    )
+    assert_results_close(_reference(experiment_files, sections), make_json_serializable(results))
+
+
+def test_reference_results_cover_every_aggregation(experiment_files):
+    results = _reference(experiment_files)
+    assert {'conversion_7d', 'revenue_14d', 'session_7d', 'revenue_p90'} <= set(results)
+    assert 0 < results['conversion_7d']['variant_a_rate'] < 1
+    assert results['revenue_p90']['quantile'] == 0.9
+    json.dumps(results)
+
+
+def test_user_id_keys_agree_across_dtypes():
+    from services.user_ids import canonical_user_ids, user_id_hashes
+
+    as_int = user_id_hashes(pd.Series([1, 2, 3]))
+    assert (user_id_hashes(pd.Series([1.0, 2.0, 3.0])) == as_int).all()
+    assert (user_id_hashes(pd.Series(['1', '2', '3'])) == as_int).all()
+    assert (user_id_hashes(pd.Series([1.0, 2.0, None]))[:2] == as_int[:2]).all()
+    assert list(canonical_user_ids(pd.Series([1.0, None, 2.5]))) == ['1', None, '2.5']
+    assert list(canonical_user_ids(pd.Series(['7', 'abc', None]))) == ['7', 'abc', None]
+
+
+@pytest.mark.parametrize('shards,backend', [(1, 'process'), (3, 'process'), (4, 'queue')])
+def test_sharded_engine_matches_pandas(experiment_files, metrics_config, shards, backend):
+    from services.sharded import run_sharded_analysis
+
+    _, exposures_path, events_path = experiment_files
+    results = run_sharded_analysis(
+        '0', exposures_path, events_path, metrics_config, shards=shards, workers=2, backend=backend
+    )
+    assert_results_close(_reference(experiment_files), make_json_serializable(results))
+
+
+def test_sharded_engine_keeps_users_whole_across_id_dtypes(experiment_files, metrics_config):
+    from services.sharded import run_sharded_analysis
+
+    _, exposures_path, events_path = experiment_files
+    # an event without a user_id makes the events' ids read as floats, while exposures' stay integers
+    events = pd.read_csv(events_path)
+    pd.concat([events, pd.DataFrame({'user_id': [None], 'event_name': ['scroll']})]).to_csv(events_path, index=False)
+    assert pd.read_csv(events_path)['user_id'].dtype == float
+
+    results = run_sharded_analysis('0', exposures_path, events_path, metrics_config, shards=3, workers=2)
+    assert_results_close(_reference(experiment_files), make_json_serializable(results))
+
+
+def test_engines_agree_on_mean_user_value_quantiles(experiment_files, metrics_config, tmp_path):
+    from services.duckdb_engine import run_experiment_analysis_duckdb
+    from services.sharded import run_sharded_analysis
+
+    metrics_config['metric_04']['user_value'] = 'mean'
+    _, exposures_path, events_path = experiment_files
+    _, exposures, events, _ = load_files(json.dumps(metrics_config).encode(), exposures_path, events_path, experiment_id='0')
+    expected = make_json_serializable(run_experiment_analysis('0', exposures, events, metrics_config, max_workers=1))
+    assert expected['revenue_p90']['variant_a_n'] < (events['event_name'] == 'purchase').sum()
+
+    duckdb_results = run_experiment_analysis_duckdb('0', exposures_path, events_path, metrics_config,
+                                                    temp_directory=str(tmp_path))
+    assert_results_close(expected, make_json_serializable(duckdb_results))
+    sharded_results = run_sharded_analysis('0', exposures_path, events_path, metrics_config, shards=3, workers=2)
+    assert_results_close(expected, make_json_serializable(sharded_results))
+
+
+def test_preview_sample_is_the_same_for_any_id_dtype():
+    from services.sampling import in_user_sample
+
+    ids = np.arange(10_000)
+    sample = in_user_sample(pd.Series(ids), 0.1)
+    assert 800 < sample.sum() < 1200
+    assert (in_user_sample(pd.Series(ids.astype(float)), 0.1) == sample).all()
+    assert (in_user_sample(pd.Series(ids.astype(str)), 0.1) == sample).all()
+    # a smaller sample is contained in a larger one
+    assert not (in_user_sample(pd.Series(ids), 0.05) & ~sample).any()
+
+
+def test_sampled_tables_keep_whole_users_across_id_dtypes(experiment_files):
+    from services.load import read_sampled_table
+
+    _, exposures_path, events_path = experiment_files
+    events = pd.read_csv(events_path)
+    pd.concat([events, pd.DataFrame({'user_id': [None], 'event_name': ['scroll']})]).to_csv(events_path, index=False)
+
+    exposures = read_sampled_table(exposures_path, 0.3)
+    events = read_sampled_table(events_path, 0.3)
+    assert events['user_id'].dtype == float
+    assert set(events['user_id'].dropna().astype(int)) <= set(exposures['user_id'])
+    assert 0.2 < len(exposures) / 600 < 0.4
+
+
+@pytest.mark.skipif(not os.getenv('TEST_POSTGRES_URL'), reason='set TEST_POSTGRES_URL to run against Postgres')
+def test_postgres_engine_matches_pandas_across_id_dtypes(experiment_files, metrics_config):
+    from sqlalchemy import create_engine
+
+    from services.postgres_engine import drop_raw_data, ingest_raw_data, run_experiment_analysis_postgres
+
+    _, exposures_path, events_path = experiment_files
+    expected = _reference(experiment_files)
+    events = pd.read_csv(events_path)
+    pd.concat([events, pd.DataFrame({'user_id': [None], 'event_name': ['scroll']})]).to_csv(events_path, index=False)
+
+    engine = create_engine(os.environ['TEST_POSTGRES_URL'])
+    dataset_id = 990_001
+    try:
+        with engine.begin() as con:
+            drop_raw_data(con, dataset_id)
+            ingest_raw_data(con, dataset_id, '0', exposures_path, events_path, True)
+        with engine.begin() as con:
+            results = run_experiment_analysis_postgres(con, dataset_id, metrics_config)
+        assert_results_close(expected, make_json_serializable(results))
+    finally:
+        with engine.begin() as con:
+            drop_raw_data(con, dataset_id)
+        engine.dispose()
+
+
+def test_iter_table_filters_parquet_while_scanning(tmp_path):
+    from services.load import iter_table
+
+    path = str(tmp_path / 'exposures.parquet')
+    exposures = pd.DataFrame({
+        'user_id': np.arange(9),
+        'experiment_id': ['a'] * 3 + ['b'] * 3 + ['a'] * 3,
+        'variant': 'A',
+        'extra': 1.0,
+    })
+    exposures.to_parquet(path, row_group_size=3)
+
+    chunks = list(iter_table(path, columns=['user_id', 'experiment_id'], filters={'experiment_id': ['a']}, chunk_rows=2))
+    assert all(len(chunk) <= 2 for chunk in chunks)
+    table = pd.concat(chunks, ignore_index=True)
+    assert list(table.columns) == ['user_id', 'experiment_id']
+    assert table['user_id'].tolist() == [0, 1, 2, 6, 7, 8]
+
+    chunks = list(iter_table(path, columns=['user_id', 'experiment_id'], filters={'experiment_id': ['c']}))
+    assert len(chunks) == 1 and chunks[0].empty
+    assert list(chunks[0].columns) == ['user_id', 'experiment_id']
+
+
+def test_sharded_engine_reads_parquet_uploads(experiment_files, experiment, metrics_config, tmp_path):
+    from services.sharded import run_sharded_analysis
+
+    exposures, events = experiment
+    exposures_path, events_path = str(tmp_path / 'exposures.parquet'), str(tmp_path / 'events.parquet')
+    pd.concat([exposures, exposures.assign(experiment_id='1')]).to_parquet(exposures_path, row_group_size=200)
+    events.to_parquet(events_path, row_group_size=500)
+
+    results = run_sharded_analysis('0', exposures_path, events_path, metrics_config, shards=3, workers=2)
+    assert_results_close(_reference(experiment_files), make_json_serializable(results))
+
+
+@pytest.mark.parametrize('sections', [None, ['daily', 'ci']])
+def test_parallel_analysis_matches_serial(experiment_files, metrics_config, monkeypatch, sections):
+    from services import parallel
+
+    monkeypatch.setattr(parallel, 'PARALLEL_MIN_EVENTS', 0)
+    metrics_path, exposures_path, events_path = experiment_files
+    _, exposures, events, _ = load_files(metrics_path, exposures_path, events_path, experiment_id='0')
+    results = run_experiment_analysis('0', exposures, events, metrics_config, max_workers=3, sections=sections)
+    assert_results_close(_reference(experiment_files, sections), make_json_serializable(results))
+
+
+def test_parallel_analysis_handles_tz_aware_times(tmp_path, experiment, metrics_config, monkeypatch):
+    from services import parallel
+
+    monkeypatch.setattr(parallel, 'PARALLEL_MIN_EVENTS', 0)
+    exposures, events = experiment
+    paths = [str(tmp_path / name) for name in ('exposures.csv', 'events.csv')]
+    # ISO timestamps with a 'Z' suffix parse to tz-aware UTC columns
+    exposures.assign(exposure_time=exposures['exposure_time'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')).to_csv(paths[0], index=False)
+    events.assign(event_time=events['event_time'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')).to_csv(paths[1], index=False)
+    metrics_path = str(tmp_path / 'metrics.json')
+    with open(metrics_path, 'w') as f:
+        json.dump(metrics_config, f)
+    _, exposures, events, _ = load_files(metrics_path, *paths, experiment_id='0')
+    prepared_exposures, _ = prepare_experiment_data('0', exposures, events, metrics_config)
+    assert isinstance(prepared_exposures['exposure_time'].dtype, pd.DatetimeTZDtype)
+
+    serial = run_experiment_analysis('0', exposures, events, metrics_config, max_workers=1)
+    parallel_results = run_experiment_analysis('0', exposures, events, metrics_config, max_workers=2)
+    assert_results_close(make_json_serializable(serial), make_json_serializable(parallel_results))
+
+
+def test_shared_columns_refuse_object_arrays():
+    from services.parallel import SharedColumns
+
+    shared = SharedColumns()
+    try:
+        with pytest.raises(TypeError):
+            shared._put(np.array(['a', None], dtype=object))
+    finally:
+        shared.close()
+
+
+def test_broken_process_pool_is_replaced(monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+
+    from services import parallel
+
+    executor = parallel._get_executor(2)
+    monkeypatch.setattr(executor, 'submit', lambda *args, **kwargs: (_ for _ in ()).throw(BrokenProcessPool('died')))
+    frame = pd.DataFrame({'user_id': [1], 'experiment_id': '0', 'variant': 'A',
+                          'exposure_time': pd.to_datetime(['2025-01-01'])})
+    with pytest.raises(BrokenProcessPool):
+        parallel.analyze_metrics_parallel(frame, frame[['user_id']], [{}, {}], [[0], [1]], max_workers=2)
+    assert parallel._get_executor(2) is not executor
+
+
+def test_repeat_exposures_count_once_at_the_first():
+    start = pd.Timestamp('2025-01-01')
+    exposures = pd.DataFrame({
+        'user_id': [1, 1, 2, 2, 3, 4],
+        'experiment_id': '0',
+        'variant': ['A', 'A', 'B', 'A', 'A', 'B'],
+        'exposure_time': [start + pd.Timedelta(days=5), start, start, start + pd.Timedelta(days=1), start, start],
+    })
+    # user 1's purchase follows their second exposure but falls outside the window of their first
+    events = pd.DataFrame({
+        'user_id': [1, 3, 4],
+        'event_name': 'purchase',
+        'event_time': [start + pd.Timedelta(days=5, hours=1), start + pd.Timedelta(hours=1), start + pd.Timedelta(hours=1)],
+        'event_value': 1.0,
+    })
+    config = {'metric_01': {'metric_id': 'conversion_2d', 'event': {'name': 'purchase'}, 'aggregation': 'binary',
+                            'window': {'start': '0h', 'end': '2d'}}}
+
+    results = run_experiment_analysis('0', exposures, events, config)
+    check = results['_assignment_check']
+    assert check['users'] == 4
+    assert check['variant_counts'] == {'A': 2, 'B': 2}
+    assert check['repeat_exposures'] == 2
+    assert check['multi_variant_users'] == 1
+    assert results['conversion_2d']['variant_a_rate'] == 0.5
+    assert results['conversion_2d']['variant_b_rate'] == 0.5
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    from services.downsample import lttb_indices
+
+    x = np.arange(1_000, dtype=float)
+    y = np.sin(x / 50)
+    y[437] = 25.0
+    kept = lttb_indices(x, y, 50)
+    assert len(kept) == 50
+    assert kept[0] == 0 and kept[-1] == 999
+    assert (np.diff(kept) > 0).all()
+    assert 437 in kept
+    assert (lttb_indices(x[:10], y[:10], 50) == np.arange(10)).all()
+
+
+def test_downsample_series_bounds_each_variant():
+    from services.downsample import series_records
+
+    dates = pd.date_range('2025-01-01', periods=300, freq='h')
+    df = pd.DataFrame({
+        'date': np.tile(dates, 2),
+        'variant': np.repeat(['A', 'B'], 300),
+        'metric_value': np.random.default_rng(0).random(600),
+    })
+    records = pd.DataFrame(series_records(df, max_points=40))
+    assert records.groupby('variant').size().to_dict() == {'A': 40, 'B': 40}
+    assert records.groupby('variant')['date'].agg(['min', 'max']).eq([dates[0], dates[-1]]).all().all()
+    assert len(series_records(df)) == 600
+
+
+@pytest.mark.parametrize('span_days', [2, 30, 300])
+def test_time_unit_is_the_finest_that_fits_max_points(span_days):
+    from services.metric_analysis import TIME_UNITS, _choose_time_unit, _max_buckets
+
+    span = pd.Timedelta(days=span_days)
+    time_unit = _choose_time_unit({'window': {'start': '0h', 'end': '1d'}}, span, max_points=100)
+    assert _max_buckets(span, time_unit) <= 100
+    finer = TIME_UNITS[:TIME_UNITS.index(time_unit)]
+    assert all(_max_buckets(span, unit) > 100 for unit in finer)
+
+
+@pytest.mark.parametrize('start, span, max_points', [
+    ('2025-01-01 00:30', pd.Timedelta(hours=9, minutes=45), 10),
+    ('2025-01-11 23:00', pd.Timedelta(days=2_969, hours=2), 100),
+])
+def test_misaligned_exposures_fit_max_points(start, span, max_points):
+    from services.metric_analysis import _choose_time_unit
+
+    times = pd.Series([pd.Timestamp(start), pd.Timestamp(start) + span])
+    time_unit = _choose_time_unit({'window': {'start': '0h', 'end': '1d'}}, span, max_points=max_points)
+    bounds = times.dt.floor(time_unit)
+    buckets = (bounds.max() - bounds.min()) // pd.Timedelta(time_unit) + 1
+    assert buckets <= max_points
+
+
+def test_time_unit_beyond_weeks_fits_max_points():
+    from services.metric_analysis import _choose_time_unit, _max_buckets
+
+    span = pd.Timedelta(days=3_000)
+    time_unit = _choose_time_unit({'window': {'start': '0h', 'end': '7d'}}, span, max_points=100)
+    assert _max_buckets(span, time_unit) <= 100
+
+
+def _reference_window_totals(codes, event_ns, values, exposure_ns, windows):
+    from services.kernels import _window_totals_loop
+
+    starts = np.array([start for start, _ in windows], dtype=np.int64)
+    ends = np.array([end for _, end in windows], dtype=np.int64)
+    counts = np.zeros((len(windows), len(exposure_ns)))
+    sums = np.zeros((len(windows), len(exposure_ns)))
+    _window_totals_loop(codes, event_ns, values, exposure_ns, starts, ends, counts, sums)
+    return counts, sums
+
+
+@pytest.mark.parametrize('use_numba', [False, True])
+def test_window_totals_match_reference_loop(use_numba):
+    from services.kernels import NAT, numba_enabled, user_window_totals
+
+    if use_numba and not numba_enabled():
+        pytest.skip('Numba is not installed')
+    rng = np.random.default_rng(5)
+    hour = 3_600 * 10 ** 9
+    n_users, n_events = 200, 5_000
+    exposure_ns = rng.integers(0, 100 * hour, n_users)
+    exposure_ns[:5] = NAT
+    codes = rng.integers(-1, n_users, n_events)  # -1: never exposed
+    event_ns = exposure_ns[np.maximum(codes, 0)] + rng.integers(-50, 400, n_events) * hour
+    event_ns[rng.random(n_events) < 0.05] = NAT
+    event_ns[codes < 5] = rng.integers(0, 100 * hour, (codes < 5).sum())
+    values = np.where(rng.random(n_events) < 0.2, np.nan, rng.random(n_events))
+    # overlapping, nested and single-point windows, with events exactly on the bounds
+    windows = [(0, 24 * hour), (0, 168 * hour), (24 * hour, 48 * hour), (-48 * hour, 0), (48 * hour, 48 * hour)]
+    event_ns[:20] = exposure_ns[np.maximum(codes[:20], 0)] + 24 * hour
+
+    counts, sums = user_window_totals(codes, event_ns, values, exposure_ns, windows, use_numba=use_numba)
+    expected_counts, expected_sums = _reference_window_totals(codes, event_ns, values, exposure_ns, windows)
+    assert counts.shape == (len(windows), n_users)
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_allclose(sums, expected_sums, rtol=1e-12)
+    assert counts[:, :5].sum() == 0
+
+
+def test_expand_metric_windows_makes_one_metric_per_window():
+    from services.windows import expand_metric_windows
+
+    config = {
+        'metric_01': {
+            'metric_id': 'conversion',
+            'display_name': 'Conversion',
+            'event': {'name': 'purchase'},
+            'aggregation': 'binary',
+            'windows': [{'start': '0h', 'end': '1d'}, {'start': '0h', 'end': '7d', 'label': 'week'}],
+        },
+        'metric_02': {'metric_id': 'revenue', 'aggregation': 'sum', 'window': {'start': '0h', 'end': '7d'}},
+    }
+    expanded = expand_metric_windows(config)
+    assert list(expanded) == ['metric_01_1d', 'metric_01_week', 'metric_02']
+    assert expanded['metric_01_1d']['metric_id'] == 'conversion_1d'
+    assert expanded['metric_01_week']['display_name'] == 'Conversion (week)'
+    assert expanded['metric_01_week']['window'] == {'start': '0h', 'end': '7d'}
+    assert expanded['metric_01_1d']['window_of'] == 'conversion'
+    assert 'windows' not in expanded['metric_01_1d']
+    assert expand_metric_windows(expanded) == expanded
+
+
+def test_expand_metric_windows_labels_differing_starts():
+    from services.windows import expand_metric_windows
+
+    config = {'m': {'metric_id': 'x', 'windows': [{'start': '0h', 'end': '1d'}, {'start': '1d', 'end': '2d'}]}}
+    assert [m['metric_id'] for m in expand_metric_windows(config).values()] == ['x_0h_1d', 'x_1d_2d']
+
+
+@pytest.mark.parametrize('config', [
+    {'m': {'metric_id': 'x', 'window': {'start': '0h', 'end': '1d'}, 'windows': [{'start': '0h', 'end': '1d'}]}},
+    {'m': {'metric_id': 'x', 'windows': []}},
+    {'m': {'metric_id': 'x', 'windows': [{'start': '0h'}]}},
+    {'m': {'metric_id': 'x', 'windows': [{'start': '0h', 'end': '1d'}, {'start': '0h', 'end': '1d'}]}},
+    {'m': {'metric_id': 'x', 'windows': [{'start': '0h', 'end': '1d'}]}, 'n': {'metric_id': 'x_1d'}},
+])
+def test_expand_metric_windows_rejects_malformed_configs(config):
+    from services.windows import expand_metric_windows
+
+    with pytest.raises(ValueError):
+        expand_metric_windows(config)
+
+
+def test_multi_window_metric_matches_single_window_metrics(experiment_files):
+    from services.windows import expand_metric_windows
+
+    metrics_path, exposures_path, events_path = experiment_files
+    _, exposures, events, _ = load_files(metrics_path, exposures_path, events_path, experiment_id='0')
+    multi = {'metric_01': {
+        'metric_id': 'conversion', 'display_name': 'Conversion', 'event': {'name': 'purchase'},
+        'aggregation': 'binary', 'windows': [{'start': '0h', 'end': '7d'}, {'start': '0h', 'end': '14d'}],
+    }}
+    single = {
+        'a': {**multi['metric_01'], 'metric_id': 'conversion_7d', 'window': {'start': '0h', 'end': '7d'}},
+        'b': {**multi['metric_01'], 'metric_id': 'conversion_14d', 'window': {'start': '0h', 'end': '14d'}},
+    }
+    for metric in single.values():
+        del metric['windows']
+
+    expanded = run_experiment_analysis('0', exposures, events, expand_metric_windows(multi), max_workers=1, sections=[])
+    separate = run_experiment_analysis('0', exposures, events, single, max_workers=1, sections=[])
+    for metric_id in ('conversion_7d', 'conversion_14d'):
+        assert expanded[metric_id]['p-value'] == pytest.approx(separate[metric_id]['p-value'], rel=1e-12)
+        assert expanded[metric_id]['variant_a_rate'] == separate[metric_id]['variant_a_rate']
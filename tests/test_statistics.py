@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.sketches import SKETCH_RELATIVE_ACCURACY, QuantileSketch, quantile_rank
+from services.stat_tests import run_quantile_test
+
+
+@pytest.mark.parametrize('q', [0.1, 0.5, 0.9, 0.99])
+def test_sketch_quantile_within_relative_accuracy(q):
+    values = np.random.default_rng(1).lognormal(2, 1.5, 20_000)
+    exact = np.sort(values)[int(quantile_rank(len(values), q))]
+    estimate = QuantileSketch.from_values(values).quantile(q)
+    assert abs(estimate - exact) <= SKETCH_RELATIVE_ACCURACY * exact * (1 + 1e-9)
+
+
+def test_merged_sketches_equal_sketch_of_all_values():
+    rng = np.random.default_rng(2)
+    a, b = rng.exponential(10, 5_000), rng.exponential(20, 3_000)
+    merged = QuantileSketch.from_values(a).merge(QuantileSketch.from_values(b))
+    whole = QuantileSketch.from_values(np.concatenate([a, b]))
+    assert merged.n == 8_000
+    assert merged.quantile(0.9) == whole.quantile(0.9)
+    assert merged.quantile_ci(0.9) == whole.quantile_ci(0.9)
+
+
+def test_quantile_test_detects_shift():
+    rng = np.random.default_rng(3)
+    sketch_a = QuantileSketch.from_values(rng.lognormal(3, 1, 4_000))
+    sketch_b = QuantileSketch.from_values(rng.lognormal(3.3, 1, 4_000))
+    result = run_quantile_test(sketch_a, sketch_b, {'aggregation': 'quantile', 'quantile': 0.9})
+    assert result['significance'] == 'YES'
+    assert result['difference'] > 0
+    assert result['difference_ci'][0] > 0
+
+
+def test_quantile_test_without_interval_width_is_not_significant():
+    # every user in a variant has the same value: both intervals collapse to it
+    sketch_a, sketch_b = QuantileSketch.from_values([10.0] * 3), QuantileSketch.from_values([50.0] * 3)
+    result = run_quantile_test(sketch_a, sketch_b, {'aggregation': 'quantile', 'quantile': 0.5})
+    assert result['difference'] != 0
+    assert result['p-value'] == 1.0
+    assert result['significance'] == 'NO'
+
+
+def test_quantile_metrics_sample_users_not_events():
+    from services.metric_analysis import analyze_metric
+
+    exposures = pd.DataFrame({
+        'user_id': [1, 2, 3],
+        'experiment_id': '0',
+        'variant': ['A', 'A', 'B'],
+        'exposure_time': pd.to_datetime(['2025-01-01'] * 3),
+    })
+    events = pd.DataFrame({
+        'user_id': [1, 1, 1, 2, 3],
+        'event_name': 'purchase',
+        'event_time': pd.to_datetime(['2025-01-02'] * 5),
+        'event_value': [1.0, 2.0, 3.0, 10.0, 4.0],
+    })
+    config = {'aggregation': 'quantile', 'quantile': 0.5, 'event': {'name': 'purchase'},
+              'window': {'start': '0h', 'end': '7d'}}
+
+    users = analyze_metric(exposures, events, config).set_index('user_id')['metric_value']
+    assert users.to_dict() == {1: 6.0, 2: 10.0, 3: 4.0}
+    means = analyze_metric(exposures, events, {**config, 'user_value': 'mean'}).set_index('user_id')['metric_value']
+    assert means.to_dict() == {1: 2.0, 2: 10.0, 3: 4.0}
+    with pytest.raises(ValueError):
+        analyze_metric(exposures, events, {**config, 'user_value': 'max'})
+
+
+def test_simulated_bernoulli_power_matches_sample_size_formula():
+    from services.power_simulation import simulate_power
+    from services.sample_size import calculate_sample_size
+
+    n = calculate_sample_size(0.1, 0.2, 0.05, 0.8)
+    result = simulate_power({'name': 'bernoulli', 'p': 0.1}, 0.2, sample_sizes=[n], simulations=4000, seed=0)
+    assert result['test'] == 'chi-square'
+    assert result['normal_approximation'] == n
+    assert result['curve'][0]['power'] == pytest.approx(0.8, abs=0.04)
+
+
+def test_simulated_power_is_reproducible_with_a_seed():
+    from services.power_simulation import simulate_power
+
+    distribution = {'name': 'zero_inflated_lognormal', 'zero_prob': 0.9, 'mu': 3, 'sigma': 1}
+    first = simulate_power(distribution, 0.3, simulations=200, seed=11)
+    assert first == simulate_power(distribution, 0.3, simulations=200, seed=11)
+    assert first['test'] == 't-test'
+    assert first['curve'][0]['power'] < first['curve'][-1]['power']
+
+
+def test_simulated_power_rejects_empty_sample_sizes():
+    from services.power_simulation import simulate_power
+
+    with pytest.raises(ValueError):
+        simulate_power({'name': 'bernoulli', 'p': 0.1}, 0.2, sample_sizes=[])
+
+
+@pytest.mark.parametrize('share_a, mismatch', [(0.6, True), (0.5, False)])
+def test_assignment_check_flags_sample_ratio_mismatch(share_a, mismatch):
+    from services.analysis import assignment_check
+    from services.metric_analysis import first_exposures
+
+    users = 2_000
+    exposures = pd.DataFrame({
+        'user_id': np.arange(users),
+        'experiment_id': '0',
+        'variant': np.where(np.arange(users) < share_a * users, 'A', 'B'),
+        'exposure_time': pd.Timestamp('2025-01-01'),
+    })
+    result = assignment_check(first_exposures(exposures))
+    assert result['users'] == users
+    assert result['variant_counts'] == {'A': int(share_a * users), 'B': users - int(share_a * users)}
+    assert result['mismatch'] is mismatch
+    assert bool(result['p-value'] < result['alpha']) is mismatch